@@ -1,8 +1,7 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 import sys
 import os
+import functools
 from datetime import datetime
 
 st.set_page_config(
@@ -11,10 +10,15 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 ) 
 
-# path to import from scripts
+# path to import from scripts; they import each other as top-level modules,
+# so the app does too and every script shares one query_engine
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from scripts.query_engine import (
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts')))
+from query_engine import (
     get_connection,
+    set_default_pool,
+    data_version,
+    get_filter_options,
     get_overall_kpis,
     get_top_10_stores_by_ir,
     get_bottom_10_stores_by_isu,
@@ -27,35 +31,121 @@ from scripts.query_engine import (
     get_top_categories_by_lift, 
     get_best_performing_products,
     get_worst_performing_products, 
-    get_category_promo_correlation_data
+    get_category_promo_correlation_data,
+    get_table_page,
+    run_queries,
+    configure_instrumentation,
+    query_stats,
+    latency_histogram,
+    slow_queries,
+    reset_query_stats,
+    SLOW_QUERY_MS
 )
+from snapshot_backend import SnapshotPool
+from dashboard import figures
 
 
-#Database Connection
-conn = get_connection()
+# Snapshot serving
+# With DASHBOARD_SNAPSHOT set to a snapshot root (published by
+# load_data_to_sqlite.py --snapshot), every query reads that memory-mapped
+# snapshot instead of SQLite, so any number of Streamlit processes share one
+# copy of the fact data through the page cache.
+SNAPSHOT_PATH = os.environ.get('DASHBOARD_SNAPSHOT')
+
+
+@st.cache_resource
+def snapshot_pool(path):
+    return SnapshotPool(path)
+
+
+if SNAPSHOT_PATH:
+    set_default_pool(snapshot_pool(SNAPSHOT_PATH))
+
+
+# Sidebar Filters
+filter_options = get_filter_options(get_connection())
+with st.sidebar:
+    st.header("🔎 Filters")
+    selected_campaigns = st.multiselect(
+        "Campaign", list(filter_options["campaign"]), format_func=filter_options["campaign"].get
+    )
+    first_date, last_date = filter_options["date_range"]
+    selected_dates = st.date_input(
+        "Campaign dates", value=(first_date, last_date), min_value=first_date, max_value=last_date
+    )
+    selected_cities = st.multiselect("City", filter_options["city"])
+    selected_categories = st.multiselect("Category", filter_options["category"])
+    selected_promo_types = st.multiselect("Promotion Type", filter_options["promo_type"])
+    top_n = st.slider("Stores / products per ranking", min_value=5, max_value=25, value=10)
+
+    st.markdown("---")
+    show_profiler = st.checkbox("🐞 Show query profiler")
+    if show_profiler:
+        configure_instrumentation(slow_query_ms=st.number_input(
+            "Slow query threshold (ms)", min_value=1.0, value=float(SLOW_QUERY_MS), step=50.0
+        ))
+
+# The full date range is no filter at all; a half-picked range (one date so
+# far) filters from that date on
+start_date = selected_dates[0] if selected_dates and selected_dates[0] > first_date else None
+end_date = selected_dates[1] if len(selected_dates) > 1 and selected_dates[1] < last_date else None
+
+filters = dict(
+    campaign=selected_campaigns,
+    start_date=start_date,
+    end_date=end_date,
+    city=selected_cities,
+    category=selected_categories,
+    promo_type=selected_promo_types
+)
+
+
+def filtered(query, **kwargs):
+    return functools.partial(query, **filters, **kwargs)
+
+
+# Row budgets: charts get at most this many rows (smaller groups are summed
+# into "Other") and long tables are sent a page at a time, so what reaches
+# the browser does not grow with the catalog.
+CHART_ROW_BUDGET = 60
+HEATMAP_CELL_BUDGET = 120
+TABLE_PAGE_SIZE = 25
+
+
+def paged_table(query, key):
+    page_key = f"{key}_page"
+    result = get_table_page(get_connection(), query, page=st.session_state.get(page_key, 1) - 1,
+                            page_size=TABLE_PAGE_SIZE)
+    # a filter change can leave the stored page past the end
+    if st.session_state.get(page_key, 1) > result["pages"]:
+        st.session_state[page_key] = result["pages"]
+    st.dataframe(result["rows"], use_container_width=True)
+    if result["pages"] > 1:
+        st.number_input(
+            f"Page (of {result['pages']}, {result['total_rows']:,} rows)",
+            min_value=1, max_value=result["pages"], key=page_key
+        )
 
 
 # Main Navigation
 st.title("🛒 AtliQ Mart Promotion Insights Dashboard")
 
-tabs = st.tabs([
-    "📊 Overview & KPIs", 
-    "🏬 Store Performance", 
-    "🧾 Promotion Analysis", 
-    "📦 Product & Category Analysis"
-])
+# Each section is a fragment and only the selected one is rendered, so a
+# rerun only queries and draws what is on screen.
 
 
 # Overview & KPIs (Tab 1)
-with tabs[0]:
+@st.fragment
+def render_overview():
     st.header("📊 Overview & Key Metrics")
 
-    kpis = get_overall_kpis(conn)
+    kpis = run_queries([filtered(get_overall_kpis)])[0]
 
     col1, col2, col3 = st.columns(3)
     with col1:
         st.metric("Total Campaigns", kpis["total_campaigns"])
-        st.metric("Avg. Lift per Campaign", f"{kpis['avg_lift_per_campaign']:,.0f}")
+        avg_lift = kpis['avg_lift_per_campaign']
+        st.metric("Avg. Lift per Campaign", "–" if avg_lift is None else f"{avg_lift:,.0f}")
     with col2:
         st.metric("Units Sold (Before)", f'{kpis["total_units_before"]:,}')
         st.metric("Units Sold (After)", f'{kpis["total_units_after"]:,}')
@@ -68,247 +158,171 @@ with tabs[0]:
 
 
 # Store Performance (Tab 2)
-with tabs[1]:
+@st.fragment
+def render_store_performance():
     st.header("🏬 Store Performance Analysis")
 
+    version = data_version(get_connection())
+    queries = [
+        filtered(get_top_10_stores_by_ir, n=top_n),
+        filtered(get_bottom_10_stores_by_isu, n=top_n),
+        functools.partial(get_store_count_by_city, city=selected_cities)
+    ]
+    top_ir_df, bottom_isu_df, store_city_df = run_queries(queries)
+
    
-    st.subheader("⬆️ Top 10 Stores by Incremental Revenue")
-    top_ir_df = get_top_10_stores_by_ir(conn)
+    st.subheader(f"⬆️ Top {top_n} Stores by Incremental Revenue")
     st.dataframe(top_ir_df, use_container_width=True)
-
-    fig_top_ir = px.bar(
-        top_ir_df.sort_values("incremental_revenue", ascending=False),
-        x="incremental_revenue",
-        y="store_id",
-        color="city",
-        orientation="h",
-        text="incremental_revenue",
-        labels={"incremental_revenue": "Incremental Revenue", "store_id": "Store ID"},
-        title="Top 10 Stores by Incremental Revenue"
-    )
-    fig_top_ir.update_traces(textposition="outside")
-    fig_top_ir.update_layout(yaxis=dict(categoryorder="total ascending"))
+    fig_top_ir = figures.top_stores_by_ir(top_ir_df, version, figures.query_key(queries[0]), top_n=top_n)
     st.plotly_chart(fig_top_ir, use_container_width=True)
 
     
 
-    st.subheader("⬇️ Bottom 10 Stores by Incremental Units Sold")
-    bottom_isu_df = get_bottom_10_stores_by_isu(conn)
+    st.subheader(f"⬇️ Bottom {top_n} Stores by Incremental Units Sold")
     st.dataframe(bottom_isu_df, use_container_width=True)
-
-    fig_bottom_isu = px.bar(
-        bottom_isu_df.sort_values("incremental_sold_units", ascending=True),
-        x="incremental_sold_units",
-        y="store_id",
-        color="city",
-        orientation="h",
-        text="incremental_sold_units",
-        labels={"incremental_sold_units": "Incremental Sold Units", "store_id": "Store ID"},
-        title="Bottom 10 Stores by Incremental Sold Units"
-    )
-    fig_bottom_isu.update_traces(textposition="outside")
-    fig_bottom_isu.update_layout(yaxis=dict(categoryorder="total ascending"))
+    fig_bottom_isu = figures.bottom_stores_by_isu(bottom_isu_df, version, figures.query_key(queries[1]), top_n=top_n)
     st.plotly_chart(fig_bottom_isu, use_container_width=True)
 
     
 
     st.subheader("🏙️ Store Distribution by City")
-    store_city_df = get_store_count_by_city(conn)
     st.dataframe(store_city_df, use_container_width=True)
-
-    fig_store_count = px.bar(
-        store_city_df.sort_values("store_count", ascending=False),
-        x="city",
-        y="store_count",
-        color="city",
-        text="store_count",
-        labels={"store_count": "Number of Stores", "city": "City"},
-        title="Store Count by City"
-    )
-    fig_store_count.update_traces(textposition="outside")
+    fig_store_count = figures.store_count_by_city(store_city_df, version, figures.query_key(queries[2]))
     st.plotly_chart(fig_store_count, use_container_width=True)
 
 
 
-with tabs[2]:
+# Promotion Analysis (Tab 3)
+@st.fragment
+def render_promotion_analysis():
     st.header("🎯 Promotion Type Analysis")
+
+    version = data_version(get_connection())
+    queries = [
+        filtered(get_top_2_promo_types_by_ir),
+        filtered(get_bottom_2_promo_types_by_isu),
+        filtered(get_discount_vs_bogof_cashback),
+        filtered(get_product_response_analysis, max_rows=CHART_ROW_BUDGET),
+        filtered(get_balanced_promotions)
+    ]
+    (top_promos_ir_df, bottom_promos_isu_df, promo_comparison_df,
+     product_response_df, balanced_promos_df) = run_queries(queries)
    
     st.subheader("⬆️ Top 2 Promotion Types by Incremental Revenue")
-    top_promos_ir_df = get_top_2_promo_types_by_ir(conn)
     st.dataframe(top_promos_ir_df, use_container_width=True)
-
-    fig_top_promo_ir = px.bar(
-        top_promos_ir_df.sort_values("incremental_revenue", ascending=False),
-        x="promo_type",
-        y="incremental_revenue",
-        color="promo_type",
-        text="incremental_revenue",
-        title="Top 2 Promotion Types by Incremental Revenue"
-    )
-    fig_top_promo_ir.update_traces(textposition="outside")
-    fig_top_promo_ir.update_layout(height=500)
+    fig_top_promo_ir = figures.top_promo_types_by_ir(top_promos_ir_df, version, figures.query_key(queries[0]))
     st.plotly_chart(fig_top_promo_ir, use_container_width=True)
 
   
 
     st.subheader("⬇️ Bottom 2 Promotion Types by Incremental Sold Units")
-    bottom_promos_isu_df = get_bottom_2_promo_types_by_isu(conn)
     st.dataframe(bottom_promos_isu_df, use_container_width=True)
-
-    fig_bottom_promo_isu = px.bar(
-        bottom_promos_isu_df.sort_values("incremental_sold_units", ascending=True),
-        x="promo_type",
-        y="incremental_sold_units",
-        color="promo_type",
-        text="incremental_sold_units",
-        title="Bottom 2 Promotion Types by Incremental Units Sold"
-    )
-    fig_bottom_promo_isu.update_traces(textposition="outside")
-    fig_bottom_promo_isu.update_layout(height=500)
+    fig_bottom_promo_isu = figures.bottom_promo_types_by_isu(bottom_promos_isu_df, version, figures.query_key(queries[1]))
     st.plotly_chart(fig_bottom_promo_isu, use_container_width=True)
 
 
 
     st.subheader("🔄 Discount vs BOGOF/Cashback Promotions")
-    promo_comparison_df = get_discount_vs_bogof_cashback(conn)
     st.dataframe(promo_comparison_df, use_container_width=True)
-
-    fig_compare = px.bar(
-        promo_comparison_df.sort_values("incremental_revenue", ascending=False),
-        x="promo_type_group",
-        y="incremental_revenue",
-        color="promo_type_group",
-        text="incremental_revenue",
-        title="Discount vs BOGOF/Cashback: Revenue Impact"
-    )
-    fig_compare.update_traces(textposition="outside")
-    fig_compare.update_layout(height=500)
+    fig_compare = figures.discount_vs_bogof_cashback(promo_comparison_df, version, figures.query_key(queries[2]))
     st.plotly_chart(fig_compare, use_container_width=True)
 
  
     st.subheader("🛒 Top Products by Promotion Effectiveness")
 
-    product_response_df = get_product_response_analysis(conn)
-
     if not product_response_df.empty:
-        product_response_df = product_response_df.sort_values(by="total_lift", ascending=False)
-        fig_product_response = px.bar(
-            product_response_df,
-            y="product_name",               
-            x="total_lift",                 
-            color="promo_type",
-            text_auto=True,
-            orientation="h",                
-            title="Product Response to Different Promotion Types"
-        )
-
-        fig_product_response.update_layout(yaxis=dict(categoryorder='total ascending'))
-
+        fig_product_response = figures.product_response(product_response_df, version, figures.query_key(queries[3]))
         st.plotly_chart(fig_product_response, use_container_width=True)
+        paged_table(filtered(get_product_response_analysis), "product_response")
     else:
         st.info("No product response data available.")
 
 
 
     st.subheader("⚖️ Balanced Promotions (Units & Revenue)")
-    balanced_promos_df = get_balanced_promotions(conn)
     st.dataframe(balanced_promos_df, use_container_width=True)
-
-    fig_balanced = px.scatter(
-    balanced_promos_df,
-    x="avg_units_lift",
-    y="avg_revenue_lift",
-    color="promo_type",
-    size="avg_revenue_lift",
-    hover_name="promo_type",
-    title="Promotion Types Balancing Revenue and Units"
-    )
-
-    fig_balanced.update_layout(height=600)
+    fig_balanced = figures.balanced_promotions(balanced_promos_df, version, figures.query_key(queries[4]))
     st.plotly_chart(fig_balanced, use_container_width=True)
 
 
 
-with tabs[3]:
+# Product & Category Analysis (Tab 4)
+@st.fragment
+def render_product_analysis():
     st.header("📦 Product & Category Analysis")
 
+    version = data_version(get_connection())
+    queries = [
+        filtered(get_top_categories_by_lift),
+        filtered(get_best_performing_products, n=top_n),
+        filtered(get_worst_performing_products, n=top_n),
+        filtered(get_category_promo_correlation_data, max_rows=HEATMAP_CELL_BUDGET)
+    ]
+    top_categories_df, best_products_df, worst_products_df, category_promo_corr_df = run_queries(queries)
+
 
     st.subheader("⬆️ Top 5 Categories by Sales Lift")
-    top_categories_df = get_top_categories_by_lift(conn)
     st.dataframe(top_categories_df, use_container_width=True)
-
-    fig_top_cat = px.bar(
-        top_categories_df,
-        y="category",
-        x="total_units_lift",
-        color="category",
-        title="Top 5 Categories by Incremental Units Sold",
-        text_auto=True,
-        orientation="h",
-        color_discrete_sequence=px.colors.qualitative.Set2
-    )
-    fig_top_cat.update_layout(yaxis_title=None, xaxis_title="Incremental Units Sold")
+    fig_top_cat = figures.top_categories_by_lift(top_categories_df, version, figures.query_key(queries[0]))
     st.plotly_chart(fig_top_cat, use_container_width=True)
 
 
-    st.subheader("🏆 Top 10 Best Performing Products (by Revenue Lift)")
-    best_products_df = get_best_performing_products(conn)
+    st.subheader(f"🏆 Top {top_n} Best Performing Products (by Revenue Lift)")
     st.dataframe(best_products_df, use_container_width=True)
-
-    fig_best_products = px.bar(
-        best_products_df,
-        y="product_name",
-        x="revenue_lift",
-        color="product_name",
-        title="Top 10 Products by Revenue Lift",
-        text_auto=True,
-        orientation="h",
-        color_discrete_sequence=px.colors.qualitative.Pastel
-    )
-    fig_best_products.update_layout(yaxis_title=None, xaxis_title="Revenue Lift")
+    fig_best_products = figures.best_products(best_products_df, version, figures.query_key(queries[1]), top_n=top_n)
     st.plotly_chart(fig_best_products, use_container_width=True)
 
 
     st.subheader("❌ Worst Performing Products (Negative Lift)")
-    worst_products_df = get_worst_performing_products(conn)
     st.dataframe(worst_products_df, use_container_width=True)
-
-    fig_worst_products = px.bar(
-        worst_products_df,
-        y="product_name",
-        x="revenue_lift",
-        color="product_name",
-        title="Bottom 10 Products by Revenue Lift",
-        text_auto=True,
-        orientation="h",
-        color_discrete_sequence=px.colors.qualitative.Set3
-    )
-    fig_worst_products.update_layout(yaxis_title=None, xaxis_title="Revenue Lift")
+    fig_worst_products = figures.worst_products(worst_products_df, version, figures.query_key(queries[2]), top_n=top_n)
     st.plotly_chart(fig_worst_products, use_container_width=True)
 
    
 
     st.subheader("🔄 Correlation Between Category & Promo Type Effectiveness")
-    category_promo_corr_df = get_category_promo_correlation_data(conn)
-    st.dataframe(category_promo_corr_df, use_container_width=True)
-
-    fig_heatmap = px.density_heatmap(
-        category_promo_corr_df,
-        x="promo_type",
-        y="category",
-        z="avg_units_lift",
-        color_continuous_scale="Viridis",
-        title="Average Units Lift by Category and Promotion Type",
-        text_auto=True
-    )
-    fig_heatmap.update_traces(
-        hovertemplate="Promo Type: %{x}<br>Category: %{y}<br>Lift: %{z}<extra></extra>",
-        showscale=True
-    )
-    fig_heatmap.update_layout(
-        xaxis_title="Promotion Type",
-        yaxis_title="Category",
-        xaxis=dict(showgrid=True),
-        yaxis=dict(showgrid=True)
-    )
+    paged_table(filtered(get_category_promo_correlation_data), "category_promo")
+    fig_heatmap = figures.category_promo_heatmap(category_promo_corr_df, version, figures.query_key(queries[3]))
     st.plotly_chart(fig_heatmap, use_container_width=True)
+
+
+SECTIONS = {
+    "📊 Overview & KPIs": render_overview,
+    "🏬 Store Performance": render_store_performance,
+    "🧾 Promotion Analysis": render_promotion_analysis,
+    "📦 Product & Category Analysis": render_product_analysis,
+}
+section = st.radio("Section", list(SECTIONS), horizontal=True, label_visibility="collapsed", key="section")
+SECTIONS[section]()
+
+
+# Query Profiler (debug panel)
+if show_profiler:
+    st.markdown("---")
+    st.header("🐞 Query Profiler")
+    st.caption("Every query_engine call in this process since the last reset, slowest total time first.")
+
+    stats_df = query_stats()
+    st.dataframe(stats_df, use_container_width=True)
+
+    histogram_df = latency_histogram().sort_values("bucket_index")
+    if not histogram_df.empty:
+        fig_latency = figures.latency_histogram(histogram_df)
+        st.plotly_chart(fig_latency, use_container_width=True)
+
+    st.subheader("🐢 Slow Queries")
+    slow = slow_queries()
+    if not slow:
+        st.write("No calls over the threshold yet.")
+    for record in reversed(slow):
+        st.markdown(
+            f"**{record['function']}** — {record['elapsed_ms']:,.1f} ms, {record['rows']} rows, "
+            f"{record['vm_steps'] or 0:,} VM steps, "
+            f"{datetime.fromtimestamp(record['timestamp']):%H:%M:%S}"
+        )
+        for statement in record["statements"]:
+            st.code(statement["sql"].strip() + "\n\n-- plan\n" + "\n".join(statement["plan"]), language="sql")
+
+    if st.button("Reset profiler statistics"):
+        reset_query_stats()
+        st.rerun()
@@ -0,0 +1,299 @@
+import json
+import functools
+import threading
+from collections import OrderedDict
+
+# Figure cache
+# Every chart on the dashboard is built here from its query result. A built
+# figure is kept per (chart, data version, query key, options): a rerun over
+# unchanged data gets the stored figure back instead of running plotly.express
+# again, and a section whose figures are all stored never imports
+# plotly.express at all. Figures are stored as Figure objects rather than JSON
+# dicts because st.plotly_chart re-validates a dict on every call but
+# serializes a Figure as is; it copies the figure, so sharing it is safe.
+
+FIGURE_CACHE_MAX_ENTRIES = 256
+
+_FIGURES = OrderedDict()
+_FIGURES_LOCK = threading.Lock()
+_FIGURE_STATS = {'hits': 0, 'misses': 0}
+
+
+# Cache key of a query_engine call (a functools.partial of a metric function)
+def query_key(query):
+    return f"{query.func.__name__}:{json.dumps(query.keywords, sort_keys=True, default=str)}"
+
+
+# Wraps builder(df, **options). Called as chart(df, version, key, **options),
+# where `version` is the data version df was read at and `key` names the query
+# that produced it; without a version the figure is always rebuilt.
+def cached_figure(builder):
+    @functools.wraps(builder)
+    def wrapper(df, version=None, key=None, **options):
+        if version is None:
+            return builder(df, **options)
+        cache_key = (builder.__name__, version, key, json.dumps(options, sort_keys=True, default=str))
+        with _FIGURES_LOCK:
+            figure = _FIGURES.get(cache_key)
+            if figure is not None:
+                _FIGURES.move_to_end(cache_key)
+                _FIGURE_STATS['hits'] += 1
+                return figure
+            _FIGURE_STATS['misses'] += 1
+        figure = builder(df, **options)
+        with _FIGURES_LOCK:
+            _FIGURES[cache_key] = figure
+            while len(_FIGURES) > FIGURE_CACHE_MAX_ENTRIES:
+                _FIGURES.popitem(last=False)
+        return figure
+    return wrapper
+
+
+def clear_figure_cache():
+    with _FIGURES_LOCK:
+        _FIGURES.clear()
+        _FIGURE_STATS.update(hits=0, misses=0)
+
+
+def figure_cache_info():
+    with _FIGURES_LOCK:
+        return {'entries': len(_FIGURES), **_FIGURE_STATS}
+
+
+# Store Performance
+@cached_figure
+def top_stores_by_ir(df, top_n):
+    import plotly.express as px
+
+    fig = px.bar(
+        df.sort_values("incremental_revenue", ascending=False),
+        x="incremental_revenue",
+        y="store_id",
+        color="city",
+        orientation="h",
+        text="incremental_revenue",
+        labels={"incremental_revenue": "Incremental Revenue", "store_id": "Store ID"},
+        title=f"Top {top_n} Stores by Incremental Revenue"
+    )
+    fig.update_traces(textposition="outside")
+    fig.update_layout(yaxis=dict(categoryorder="total ascending"))
+    return fig
+
+
+@cached_figure
+def bottom_stores_by_isu(df, top_n):
+    import plotly.express as px
+
+    fig = px.bar(
+        df.sort_values("incremental_sold_units", ascending=True),
+        x="incremental_sold_units",
+        y="store_id",
+        color="city",
+        orientation="h",
+        text="incremental_sold_units",
+        labels={"incremental_sold_units": "Incremental Sold Units", "store_id": "Store ID"},
+        title=f"Bottom {top_n} Stores by Incremental Sold Units"
+    )
+    fig.update_traces(textposition="outside")
+    fig.update_layout(yaxis=dict(categoryorder="total ascending"))
+    return fig
+
+
+@cached_figure
+def store_count_by_city(df):
+    import plotly.express as px
+
+    fig = px.bar(
+        df.sort_values("store_count", ascending=False),
+        x="city",
+        y="store_count",
+        color="city",
+        text="store_count",
+        labels={"store_count": "Number of Stores", "city": "City"},
+        title="Store Count by City"
+    )
+    fig.update_traces(textposition="outside")
+    return fig
+
+
+# Promotion Analysis
+@cached_figure
+def top_promo_types_by_ir(df):
+    import plotly.express as px
+
+    fig = px.bar(
+        df.sort_values("incremental_revenue", ascending=False),
+        x="promo_type",
+        y="incremental_revenue",
+        color="promo_type",
+        text="incremental_revenue",
+        title="Top 2 Promotion Types by Incremental Revenue"
+    )
+    fig.update_traces(textposition="outside")
+    fig.update_layout(height=500)
+    return fig
+
+
+@cached_figure
+def bottom_promo_types_by_isu(df):
+    import plotly.express as px
+
+    fig = px.bar(
+        df.sort_values("incremental_sold_units", ascending=True),
+        x="promo_type",
+        y="incremental_sold_units",
+        color="promo_type",
+        text="incremental_sold_units",
+        title="Bottom 2 Promotion Types by Incremental Units Sold"
+    )
+    fig.update_traces(textposition="outside")
+    fig.update_layout(height=500)
+    return fig
+
+
+@cached_figure
+def discount_vs_bogof_cashback(df):
+    import plotly.express as px
+
+    fig = px.bar(
+        df.sort_values("incremental_revenue", ascending=False),
+        x="promo_type_group",
+        y="incremental_revenue",
+        color="promo_type_group",
+        text="incremental_revenue",
+        title="Discount vs BOGOF/Cashback: Revenue Impact"
+    )
+    fig.update_traces(textposition="outside")
+    fig.update_layout(height=500)
+    return fig
+
+
+@cached_figure
+def product_response(df):
+    import plotly.express as px
+
+    fig = px.bar(
+        df.sort_values(by="total_lift", ascending=False),
+        y="product_name",
+        x="total_lift",
+        color="promo_type",
+        text_auto=True,
+        orientation="h",
+        title="Product Response to Different Promotion Types"
+    )
+    fig.update_layout(yaxis=dict(categoryorder='total ascending'))
+    return fig
+
+
+@cached_figure
+def balanced_promotions(df):
+    import plotly.express as px
+
+    fig = px.scatter(
+        df,
+        x="avg_units_lift",
+        y="avg_revenue_lift",
+        color="promo_type",
+        size="avg_revenue_lift",
+        hover_name="promo_type",
+        title="Promotion Types Balancing Revenue and Units"
+    )
+    fig.update_layout(height=600)
+    return fig
+
+
+# Product & Category Analysis
+@cached_figure
+def top_categories_by_lift(df):
+    import plotly.express as px
+
+    fig = px.bar(
+        df,
+        y="category",
+        x="total_units_lift",
+        color="category",
+        title="Top 5 Categories by Incremental Units Sold",
+        text_auto=True,
+        orientation="h",
+        color_discrete_sequence=px.colors.qualitative.Set2
+    )
+    fig.update_layout(yaxis_title=None, xaxis_title="Incremental Units Sold")
+    return fig
+
+
+@cached_figure
+def best_products(df, top_n):
+    import plotly.express as px
+
+    fig = px.bar(
+        df,
+        y="product_name",
+        x="revenue_lift",
+        color="product_name",
+        title=f"Top {top_n} Products by Revenue Lift",
+        text_auto=True,
+        orientation="h",
+        color_discrete_sequence=px.colors.qualitative.Pastel
+    )
+    fig.update_layout(yaxis_title=None, xaxis_title="Revenue Lift")
+    return fig
+
+
+@cached_figure
+def worst_products(df, top_n):
+    import plotly.express as px
+
+    fig = px.bar(
+        df,
+        y="product_name",
+        x="revenue_lift",
+        color="product_name",
+        title=f"Bottom {top_n} Products by Revenue Lift",
+        text_auto=True,
+        orientation="h",
+        color_discrete_sequence=px.colors.qualitative.Set3
+    )
+    fig.update_layout(yaxis_title=None, xaxis_title="Revenue Lift")
+    return fig
+
+
+@cached_figure
+def category_promo_heatmap(df):
+    import plotly.express as px
+
+    fig = px.density_heatmap(
+        df,
+        x="promo_type",
+        y="category",
+        z="avg_units_lift",
+        color_continuous_scale="Viridis",
+        title="Average Units Lift by Category and Promotion Type",
+        text_auto=True
+    )
+    fig.update_traces(
+        hovertemplate="Promo Type: %{x}<br>Category: %{y}<br>Lift: %{z}<extra></extra>",
+        showscale=True
+    )
+    fig.update_layout(
+        xaxis_title="Promotion Type",
+        yaxis_title="Category",
+        xaxis=dict(showgrid=True),
+        yaxis=dict(showgrid=True)
+    )
+    return fig
+
+
+# Query Profiler; its data changes on every call, so it is never cached
+def latency_histogram(df):
+    import plotly.express as px
+
+    fig = px.bar(
+        df,
+        x="bucket",
+        y="calls",
+        color="function",
+        labels={"bucket": "Latency", "calls": "Calls"},
+        title="Latency Histogram by Function"
+    )
+    fig.update_xaxes(categoryorder="array", categoryarray=df["bucket"].unique())
+    return fig
@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import statistics
+
+import pandas as pd
+
+import query_engine
+from query_engine import (
+    DB_PATH,
+    clear_aggregate_cache,
+    clear_query_cache,
+    get_top_10_stores_by_ir,
+    get_bottom_10_stores_by_isu,
+    get_store_count_by_city,
+    get_top_2_promo_types_by_ir,
+    get_bottom_2_promo_types_by_isu,
+    get_balanced_promotions,
+    get_category_wise_sales_lift,
+    get_product_response_analysis,
+    get_overall_kpis,
+    get_discount_vs_bogof_cashback,
+    get_top_categories_by_lift,
+    get_best_performing_products,
+    get_worst_performing_products,
+    get_filter_options,
+    get_category_promo_correlation_data,
+)
+from parquet_backend import PARQUET_DIR, ParquetBackend, export_to_parquet
+from numpy_backend import NumpyBackend
+
+# The dashboard's queries, unfiltered and with a filter on each dimension
+QUERIES = [
+    get_top_10_stores_by_ir,
+    get_bottom_10_stores_by_isu,
+    get_store_count_by_city,
+    get_top_2_promo_types_by_ir,
+    get_bottom_2_promo_types_by_isu,
+    get_balanced_promotions,
+    get_category_wise_sales_lift,
+    get_product_response_analysis,
+    get_overall_kpis,
+    get_discount_vs_bogof_cashback,
+    get_top_categories_by_lift,
+    get_best_performing_products,
+    get_worst_performing_products,
+    get_filter_options,
+    get_category_promo_correlation_data,
+]
+FILTERED_QUERIES = {
+    "campaign filter": {'campaign': 'CAMP_DIW_01'},
+    "city filter": {'city': 'Chennai'},
+    "category filter": {'category': 'Grocery & Staples'},
+    "promo_type filter": {'promo_type': 'BOGOF'},
+    "date range filter": {'start_date': '2023-11-01', 'end_date': '2023-11-30'},
+}
+
+
+def _run_cold(conn, query, kwargs):
+    # Every run starts from empty caches so the backend does the actual scan
+    clear_query_cache()
+    clear_aggregate_cache()
+    start = time.perf_counter()
+    result = query(conn, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def _same(left, right):
+    if isinstance(left, pd.DataFrame):
+        try:
+            pd.testing.assert_frame_equal(left, right, check_dtype=False)
+        except AssertionError:
+            return False
+        return True
+    return left == right
+
+
+def benchmark(backends, repeat):
+    cases = [(query.__name__, query, {}) for query in QUERIES]
+    cases += [
+        (f"get_top_10_stores_by_ir ({name})", get_top_10_stores_by_ir, filters)
+        for name, filters in FILTERED_QUERIES.items()
+    ]
+    totals = {name: 0.0 for name in backends}
+    mismatches = 0
+
+    print(f"{'query':<55}" + "".join(f"{name:>18}" for name in backends))
+    for label, query, kwargs in cases:
+        timings, results = {}, {}
+        for name, (conn, use_rollups) in backends.items():
+            query_engine.USE_ROLLUPS = use_rollups
+            runs = [_run_cold(conn, query, kwargs) for _ in range(repeat)]
+            timings[name] = statistics.median(elapsed for elapsed, _ in runs)
+            results[name] = runs[-1][1]
+            totals[name] += timings[name]
+        reference = next(iter(results.values()))
+        same = all(_same(reference, result) for result in results.values())
+        mismatches += not same
+        print(f"{label:<55}" + "".join(f"{timings[name] * 1000:>16.1f}ms" for name in backends)
+              + ("" if same else "  ❌ results differ"))
+    print(f"{'total':<55}" + "".join(f"{totals[name] * 1000:>16.1f}ms" for name in backends))
+    query_engine.USE_ROLLUPS = True
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the SQLite, Parquet and NumPy backends on the dashboard queries")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--parquet', default=PARQUET_DIR)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--export', action='store_true', help="re-export the Parquet dataset from --db first")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, check_same_thread=False)
+    if args.export or not os.path.exists(args.parquet):
+        start = time.perf_counter()
+        rows = export_to_parquet(conn, args.parquet)
+        print(f"Exported {rows:,} rows to Parquet in {time.perf_counter() - start:.2f}s\n")
+
+    numpy_backend = NumpyBackend(args.db)
+    start = time.perf_counter()
+    arrays = numpy_backend.arrays()
+    load_time = time.perf_counter() - start
+    fact_frame_bytes = pd.read_sql("SELECT * FROM fact_events", conn).memory_usage(index=True, deep=True).sum()
+    print(f"NumPy snapshot loaded in {load_time:.2f}s: {arrays.nbytes / 2**20:,.1f} MiB "
+          f"(fact_events as a DataFrame: {fact_frame_bytes / 2**20:,.1f} MiB)\n")
+
+    backends = {
+        'sqlite rollups': (conn, True),
+        'sqlite scan': (conn, False),
+        'parquet scan': (ParquetBackend(args.parquet), False),
+        'numpy bincount': (numpy_backend, False),
+    }
+    mismatches = benchmark(backends, args.repeat)
+    conn.close()
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+#Set paths
+APP_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'dashboard', 'app.py'))
+
+DEFAULT_REPEAT = 5
+# The sections of dashboard/app.py, as its section radio names them
+SECTIONS = [
+    "📊 Overview & KPIs",
+    "🏬 Store Performance",
+    "🧾 Promotion Analysis",
+    "📦 Product & Category Analysis",
+]
+
+# Runs in a fresh interpreter, so every sample starts with nothing imported
+# and nothing cached. Times the Streamlit import, the first script run (the
+# app's imports, its queries and figures), a rerun (everything cached) and a
+# rerun with only the figure cache cleared.
+PROBE = """
+import sys, json, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=300)
+at.session_state['section'] = sys.argv[2]
+at.run()
+first_run = time.perf_counter()
+at.run()
+rerun = time.perf_counter()
+sys.modules['dashboard.figures'].clear_figure_cache()
+at.run()
+uncached = time.perf_counter()
+print(json.dumps({
+    'streamlit_import_ms': (imported - start) * 1000,
+    'first_run_ms': (first_run - imported) * 1000,
+    'rerun_ms': (rerun - first_run) * 1000,
+    'rerun_without_figure_cache_ms': (uncached - rerun) * 1000,
+    'plotly_express_imported': 'plotly.express' in sys.modules,
+    'errors': [str(exception.value) for exception in at.exception],
+}))
+"""
+TIMINGS = ['process_ms', 'streamlit_import_ms', 'first_run_ms', 'rerun_ms', 'rerun_without_figure_cache_ms']
+
+
+def probe(section):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', PROBE, APP_PATH, section], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"dashboard probe failed for {section}:\n{result.stderr}")
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    if sample['errors']:
+        raise RuntimeError(f"dashboard raised in {section}: {sample['errors']}")
+    sample['process_ms'] = elapsed * 1000
+    return sample
+
+
+def benchmark(repeat):
+    report = {}
+    for section in SECTIONS:
+        samples = [probe(section) for _ in range(repeat)]
+        report[section] = {
+            name: round(statistics.median(sample[name] for sample in samples), 1) for name in TIMINGS
+        }
+        report[section]['plotly_express_imported'] = samples[-1]['plotly_express_imported']
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure dashboard startup and rerun time, one section at a time, "
+                                                 "each sample in a fresh interpreter")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="fresh processes per section")
+    parser.add_argument('--report', default=None, help="also write the medians to this JSON file")
+    args = parser.parse_args()
+
+    report = benchmark(args.repeat)
+    print(f"{'section (median ms)':<32}{'process':>10}{'streamlit':>11}{'first run':>11}{'rerun':>9}"
+          f"{'no fig cache':>14}  plotly.express")
+    for section, result in report.items():
+        print(f"{section:<32}{result['process_ms']:>10.0f}{result['streamlit_import_ms']:>11.0f}"
+              f"{result['first_run_ms']:>11.0f}{result['rerun_ms']:>9.1f}"
+              f"{result['rerun_without_figure_cache_ms']:>14.1f}  "
+              f"{'imported' if result['plotly_express_imported'] else 'not imported'}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
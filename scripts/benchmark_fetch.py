@@ -0,0 +1,98 @@
+import json
+import time
+import sqlite3
+import argparse
+import statistics
+import tracemalloc
+
+import pandas as pd
+
+import query_engine
+from query_engine import DB_PATH, FETCH_BATCH_ROWS, fact_scan_query, read_frame
+
+DEFAULT_REPEAT = 5
+
+# Large results the query layer reads: whole tables and the unfiltered base scan
+QUERIES = {
+    'fact_events rows': ("SELECT * FROM fact_events", ()),
+    'base-grain scan': fact_scan_query(()),
+    'rollup_base': ("SELECT * FROM rollup_base", ()),
+    'rollup_product_promo_type': ("SELECT * FROM rollup_product_promo_type", ()),
+}
+
+READERS = {
+    'pd.read_sql': lambda conn, query, params: pd.read_sql(query, conn, params=params),
+    'read_frame': lambda conn, query, params: read_frame(conn, query, params),
+}
+
+
+def _traced_peak_mb(func):
+    tracemalloc.start()
+    try:
+        func()
+        return round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(conn, repeat):
+    report = {}
+    for name, (query, params) in QUERIES.items():
+        timings = {reader: [] for reader in READERS}
+        # the readers take turns, so neither one always runs on a warmer page cache
+        for _ in range(repeat):
+            for reader, read in READERS.items():
+                start = time.perf_counter()
+                read(conn, query, params)
+                timings[reader].append(time.perf_counter() - start)
+        frames = {reader: read(conn, query, params) for reader, read in READERS.items()}
+        try:
+            pd.testing.assert_frame_equal(frames['pd.read_sql'], frames['read_frame'])
+            identical = True
+        except AssertionError:
+            identical = False
+        # time to step through the result without building anything: the floor for any sqlite3 reader
+        start = time.perf_counter()
+        for _ in conn.execute(query, params):
+            pass
+        cursor_ms = (time.perf_counter() - start) * 1000
+        report[name] = {
+            'rows': len(frames['read_frame']),
+            'cursor_ms': round(cursor_ms, 1),
+            **{f'{reader}_ms': round(statistics.median(times) * 1000, 1) for reader, times in timings.items()},
+            **{f'{reader}_peak_mb': _traced_peak_mb(lambda: read(conn, query, params))
+               for reader, read in READERS.items()},
+            'identical': identical,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pd.read_sql with the columnar read_frame on large results")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--batch-rows', type=int, default=FETCH_BATCH_ROWS, help="rows read_frame fetches at a time")
+    parser.add_argument('--report', default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    query_engine.FETCH_BATCH_ROWS = args.batch_rows
+    conn = sqlite3.connect(args.db)
+    report = benchmark(conn, args.repeat)
+    conn.close()
+
+    print(f"{'result (median)':<28}{'rows':>10}{'cursor':>10}{'read_sql':>11}{'read_frame':>12}{'speedup':>9}"
+          f"{'peak MiB':>16}  same")
+    for name, result in report.items():
+        speedup = result['pd.read_sql_ms'] / max(result['read_frame_ms'], 1e-9)
+        print(f"{name:<28}{result['rows']:>10,}{result['cursor_ms']:>8.0f}ms{result['pd.read_sql_ms']:>9.0f}ms"
+              f"{result['read_frame_ms']:>10.0f}ms{speedup:>8.2f}x"
+              f"{result['pd.read_sql_peak_mb']:>8.0f} ->{result['read_frame_peak_mb']:>5.0f}"
+              f"  {'yes' if result['identical'] else 'NO'}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import json
+import time
+import asyncio
+import argparse
+import threading
+
+import numpy as np
+import tornado.httpclient
+import tornado.httpserver
+import tornado.netutil
+
+from query_engine import DB_PATH, clear_aggregate_cache, clear_query_cache, query_cache_info
+from query_service import SERVICE_WORKERS, QueryService, make_app
+
+DEFAULT_CLIENTS = 200
+# The request every client makes in the "identical" scenarios
+IDENTICAL_REQUEST = '/metrics/top_stores_by_ir?city=Chennai&city=Bengaluru&promo_type=BOGOF'
+
+
+# Runs the service on its own thread and event loop, so the clients below
+# reach it over real HTTP connections
+def start_service(db_path, workers, coalesce):
+    ready = threading.Event()
+    state = {}
+
+    async def run():
+        service = QueryService(db_path, workers, coalesce=coalesce)
+        sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+        server = tornado.httpserver.HTTPServer(make_app(service))
+        server.add_sockets(sockets)
+        state.update(service=service, port=sockets[0].getsockname()[1], loop=asyncio.get_running_loop(),
+                     stop=asyncio.Event())
+        ready.set()
+        await state['stop'].wait()
+        server.stop()
+        service.close()
+
+    thread = threading.Thread(target=asyncio.run, args=(run(),), daemon=True)
+    thread.start()
+    ready.wait()
+
+    def stop():
+        state['loop'].call_soon_threadsafe(state['stop'].set)
+        thread.join()
+    return state, stop
+
+
+async def _fire(base, paths, headers=None):
+    client = tornado.httpclient.AsyncHTTPClient(force_instance=True, max_clients=len(paths))
+    latencies = []
+
+    async def request(path):
+        start = time.perf_counter()
+        response = await client.fetch(base + path, headers=headers, raise_error=False, request_timeout=600)
+        latencies.append(time.perf_counter() - start)
+        return response
+
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(request(path) for path in paths))
+    elapsed = time.perf_counter() - start
+    client.close()
+    return responses, elapsed, latencies
+
+
+def run_scenario(state, paths, headers=None):
+    service = state['service']
+    before = dict(service.stats)
+    misses = query_cache_info()['misses']
+    responses, elapsed, latencies = asyncio.run(_fire(f"http://127.0.0.1:{state['port']}", paths, headers))
+    statuses = [response.code for response in responses]
+    p50, p95 = np.percentile(np.array(latencies) * 1000, [50, 95])
+    return {
+        'requests': len(paths),
+        'computed': service.stats['computed'] - before['computed'],
+        'coalesced': service.stats['coalesced'] - before['coalesced'],
+        # metric functions that actually ran rather than hit the result cache
+        'evaluated': query_cache_info()['misses'] - misses,
+        'not_modified': statuses.count(304),
+        'errors': sum(status >= 400 for status in statuses),
+        'wall_ms': round(elapsed * 1000, 1),
+        'p50_ms': round(float(p50), 1),
+        'p95_ms': round(float(p95), 1),
+    }
+
+
+def benchmark(db_path, clients, workers):
+    report = {}
+    for coalesce in (False, True):
+        state, stop = start_service(db_path, workers, coalesce)
+        try:
+            names = list(state['service'].metrics)
+            mix = [f'/metrics/{names[i % len(names)]}' for i in range(clients)]
+            label = 'coalesced' if coalesce else 'not coalesced'
+
+            # every client asks for the same uncached metric at once
+            clear_query_cache()
+            clear_aggregate_cache()
+            report[f'identical, cold, {label}'] = run_scenario(state, [IDENTICAL_REQUEST] * clients)
+
+            # the dashboard's metrics spread over the clients, nothing cached
+            clear_query_cache()
+            clear_aggregate_cache()
+            report[f'metric mix, cold, {label}'] = run_scenario(state, mix)
+
+            # every client revalidates the copy it already has
+            response, _, _ = asyncio.run(_fire(f"http://127.0.0.1:{state['port']}", [IDENTICAL_REQUEST]))
+            headers = {'If-None-Match': response[0].headers['Etag']}
+            report[f'revalidate, {label}'] = run_scenario(state, [IDENTICAL_REQUEST] * clients, headers)
+        finally:
+            stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fire concurrent clients at query_service.py and report how many "
+                                                 "computations they triggered and how long they waited")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--clients', type=int, default=DEFAULT_CLIENTS, help="concurrent requests per scenario")
+    parser.add_argument('--workers', type=int, default=SERVICE_WORKERS, help="service threads running queries")
+    parser.add_argument('--report', default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = benchmark(args.db, args.clients, args.workers)
+    print(f"{'scenario':<36}{'requests':>9}{'computed':>10}{'evaluated':>11}{'304':>6}{'errors':>8}"
+          f"{'wall':>10}{'p50':>9}{'p95':>9}")
+    for name, result in report.items():
+        print(f"{name:<36}{result['requests']:>9}{result['computed']:>10}{result['evaluated']:>11}"
+              f"{result['not_modified']:>6}{result['errors']:>8}{result['wall_ms']:>8.0f}ms"
+              f"{result['p50_ms']:>7.0f}ms{result['p95_ms']:>7.0f}ms")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import platform
+import argparse
+import tempfile
+import functools
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows; peak RSS is left out of the report there
+    resource = None
+
+from query_engine import (
+    ConnectionPool,
+    clear_aggregate_cache,
+    clear_query_cache,
+    run_queries,
+    get_filter_options,
+    get_overall_kpis,
+    get_top_10_stores_by_ir,
+    get_bottom_10_stores_by_isu,
+    get_store_count_by_city,
+    get_top_2_promo_types_by_ir,
+    get_bottom_2_promo_types_by_isu,
+    get_balanced_promotions,
+    get_product_response_analysis,
+    get_discount_vs_bogof_cashback,
+    get_top_categories_by_lift,
+    get_best_performing_products,
+    get_worst_performing_products,
+    get_category_promo_correlation_data,
+    build_rollup_tables,
+)
+from export_metrics import METRICS
+from load_data_to_sqlite import DEFAULT_WORKERS, LOAD_CACHE_SIZE, load_full
+from generate_synthetic_data import DEFAULT_SEED, generate
+
+DEFAULT_ROWS = 100_000
+DEFAULT_REPEAT = 5
+# A latency is reported as a regression when it is this much slower than the
+# baseline and at least REGRESSION_FLOOR_MS slower in absolute terms, so timer
+# noise on sub-millisecond cache hits is not flagged.
+DEFAULT_TOLERANCE = 0.25
+REGRESSION_FLOOR_MS = 1.0
+
+# Every exported metric, unfiltered and with one filter per dimension
+QUERIES = {query.__name__: query for query in METRICS.values()}
+QUERIES.update({
+    "get_top_10_stores_by_ir[campaign]": functools.partial(get_top_10_stores_by_ir, campaign='CAMP_DIW_01'),
+    "get_top_10_stores_by_ir[city]": functools.partial(get_top_10_stores_by_ir, city='Chennai'),
+    "get_top_10_stores_by_ir[category]": functools.partial(get_top_10_stores_by_ir, category='Grocery & Staples'),
+    "get_top_10_stores_by_ir[promo_type]": functools.partial(get_top_10_stores_by_ir, promo_type='BOGOF'),
+    "get_top_10_stores_by_ir[date_range]": functools.partial(get_top_10_stores_by_ir, start_date='2023-11-01',
+                                                             end_date='2023-11-30'),
+})
+
+# The batches dashboard/app.py runs, one per tab, with no filters selected
+DASHBOARD_TABS = {
+    "sidebar": [get_filter_options],
+    "overview": [get_overall_kpis],
+    "stores": [get_top_10_stores_by_ir, get_bottom_10_stores_by_isu, get_store_count_by_city],
+    "promotions": [
+        get_top_2_promo_types_by_ir,
+        get_bottom_2_promo_types_by_isu,
+        get_discount_vs_bogof_cashback,
+        get_product_response_analysis,
+        get_balanced_promotions,
+    ],
+    "products": [
+        get_top_categories_by_lift,
+        get_best_performing_products,
+        get_worst_performing_products,
+        get_category_promo_correlation_data,
+    ],
+}
+
+
+def _clear_caches():
+    clear_query_cache()
+    clear_aggregate_cache()
+
+
+def _peak_rss_mb():
+    # process high-water mark so far
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def _traced_peak_mb(func):
+    # Run once more under tracemalloc; kept out of the timed runs because
+    # tracing slows allocation-heavy code down considerably.
+    tracemalloc.start()
+    try:
+        func()
+        return round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+    finally:
+        tracemalloc.stop()
+
+
+def _latency(timings):
+    p50, p95 = np.percentile(np.array(timings) * 1000, [50, 95])
+    return {'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3), 'runs': len(timings)}
+
+
+# Times `func` cold (caches cleared before every run) and warm (caches primed)
+def _measure(func, repeat):
+    cold, warm = [], []
+    for _ in range(repeat):
+        _clear_caches()
+        start = time.perf_counter()
+        func()
+        cold.append(time.perf_counter() - start)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        warm.append(time.perf_counter() - start)
+    _clear_caches()
+    return {'cold': _latency(cold), 'warm': _latency(warm), 'peak_alloc_mb': _traced_peak_mb(func)}
+
+
+def benchmark_load(data_dir, db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA cache_size = {LOAD_CACHE_SIZE}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    rows, rejected, elapsed = load_full(conn, data_dir)
+    start = time.perf_counter()
+    conn.execute("ANALYZE")
+    analyze = time.perf_counter() - start
+    start = time.perf_counter()
+    build_rollup_tables(conn)
+    rollups = time.perf_counter() - start
+    conn.close()
+    return {
+        'rows': rows,
+        'rejected': sum(rejected.values()),
+        'workers': DEFAULT_WORKERS,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / max(elapsed, 1e-9)),
+        'analyze_seconds': round(analyze, 3),
+        'rollup_seconds': round(rollups, 3),
+        'peak_rss_mb': _peak_rss_mb(),
+        'database_mb': round(os.path.getsize(db_path) / 2**20, 2),
+    }
+
+
+def benchmark_queries(conn, repeat):
+    return {name: _measure(functools.partial(query, conn), repeat) for name, query in QUERIES.items()}
+
+
+def benchmark_dashboard(pool, repeat):
+    def assemble(batches):
+        return lambda: [run_queries(batch, pool=pool) for batch in batches]
+
+    report = {name: _measure(assemble([batch]), repeat) for name, batch in DASHBOARD_TABS.items()}
+    report['full page'] = _measure(assemble(DASHBOARD_TABS.values()), repeat)
+    # one batch of every exported metric, including those no tab shows yet
+    report['all metrics'] = _measure(assemble([list(METRICS.values())]), repeat)
+    return report
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Every (path, value) latency in a report, e.g. ('queries/get_overall_kpis/cold/p95_ms', 3.2)
+def _latencies(report, path=()):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            yield from _latencies(value, path + (key,))
+        elif key in ('p50_ms', 'p95_ms'):
+            yield '/'.join(path + (key,)), value
+
+
+def compare(report, baseline, tolerance):
+    previous = dict(_latencies(baseline))
+    regressions = []
+    for path, value in _latencies(report):
+        before = previous.get(path)
+        if before and value > before * (1 + tolerance) and value - before >= REGRESSION_FLOOR_MS:
+            regressions.append((path, before, value))
+    for path, before, value in regressions:
+        print(f"❌ {path}: {before:.2f}ms -> {value:.2f}ms ({value / before:.2f}x)")
+    if not regressions:
+        print(f"✅ no latency more than {tolerance:.0%} slower than the baseline")
+    return regressions
+
+
+def _print_summary(report):
+    load = report['load']
+    print(f"load: {load['rows']:,} rows in {load['seconds']:.2f}s ({load['rows_per_sec']:,} rows/sec), "
+          f"rollups {load['rollup_seconds']:.2f}s")
+    for section in ('queries', 'dashboard'):
+        print(f"\n{section:<45}{'cold p50':>11}{'cold p95':>11}{'warm p50':>11}{'peak MiB':>10}")
+        for name, result in report[section].items():
+            print(f"{name:<45}{result['cold']['p50_ms']:>9.1f}ms{result['cold']['p95_ms']:>9.1f}ms"
+                  f"{result['warm']['p50_ms']:>9.2f}ms{result['peak_alloc_mb']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading, every query_engine function and full dashboard "
+                                                 "assembly, and write a JSON report")
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="synthetic fact_events rows to generate")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--stores', type=int, default=None, help="scale the synthetic store dimension")
+    parser.add_argument('--data-dir', default=None, help="benchmark these CSV files instead of generating data")
+    parser.add_argument('--work-dir', default=None, help="where generated data and the database go (default: a temp dir)")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="timed runs per measurement")
+    parser.add_argument('--report', default='benchmark_report.json')
+    parser.add_argument('--baseline', default=None, help="earlier report to compare latencies against")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    # read up front: the baseline may be the file this run is about to overwrite
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = args.work_dir or tmp
+        os.makedirs(work_dir, exist_ok=True)
+        report = {'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sqlite': sqlite3.sqlite_version,
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'repeat': args.repeat,
+        }}
+
+        data_dir = args.data_dir
+        if data_dir is None:
+            data_dir = os.path.join(work_dir, 'data')
+            start = time.perf_counter()
+            generate(data_dir, args.rows, args.seed, args.stores)
+            elapsed = time.perf_counter() - start
+            report['meta'].update(rows=args.rows, seed=args.seed, stores=args.stores)
+            report['generate'] = {'seconds': round(elapsed, 3), 'rows_per_sec': round(args.rows / max(elapsed, 1e-9))}
+        else:
+            report['meta']['data_dir'] = os.path.abspath(data_dir)
+
+        db_path = os.path.join(work_dir, 'benchmark.sqlite')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        report['load'] = benchmark_load(data_dir, db_path)
+
+        pool = ConnectionPool(db_path)
+        report['queries'] = benchmark_queries(pool.get(), args.repeat)
+        report['dashboard'] = benchmark_dashboard(pool, args.repeat)
+        pool.close_all()
+        report['peak_rss_mb'] = _peak_rss_mb()
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    _print_summary(report)
+    print(f"\n📝 Report written to {args.report}")
+
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import sys
+
+from query_engine import METRIC_DEFINITIONS, compile_grain_query, get_connection, fact_scan_query, normalize_filters
+
+# Queries that read the raw star schema: the unfiltered base scan and a
+# filtered scan per query_engine filter. Rollup tables are read whole on
+# purpose (they hold one row per group), so they are not listed here.
+PLAN_QUERIES = {
+    "base grain scan": {},
+    "campaign filter": {'campaign': 'CAMP_DIW_01'},
+    "city filter": {'city': 'Chennai'},
+    "category filter": {'category': 'Grocery & Staples'},
+    "promo_type filter": {'promo_type': 'BOGOF'},
+    "campaign + city filter": {'campaign': 'CAMP_SAN_01', 'city': ['Bengaluru', 'Chennai']},
+}
+
+
+def explain(conn, query, params=()):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+
+# A step is unindexed when it SCANs a table without an index. Scans of
+# subqueries that the plan materializes itself are fine.
+def unindexed_steps(plan):
+    derived = {detail.split()[-1] for detail in plan if detail.startswith(('MATERIALIZE', 'CO-ROUTINE'))}
+    return [
+        detail for detail in plan
+        if detail.startswith('SCAN') and 'INDEX' not in detail and detail.split()[1] not in derived
+    ]
+
+
+def main():
+    conn = get_connection()
+    failures = 0
+    for name, filters in PLAN_QUERIES.items():
+        plan = explain(conn, *fact_scan_query(normalize_filters(filters)))
+        bad = unindexed_steps(plan)
+        failures += bool(bad)
+        print(f"{'❌' if bad else '✅'} {name}")
+        for detail in plan:
+            print(f"    {detail}")
+    # the narrower scans compiled for the metrics' own grains, under every filter above
+    for grain in dict.fromkeys(definition.grain for definition in METRIC_DEFINITIONS.values()):
+        bad = [detail for filters in PLAN_QUERIES.values()
+               for detail in unindexed_steps(explain(conn, *compile_grain_query(grain, normalize_filters(filters))))]
+        failures += bool(bad)
+        print(f"{'❌' if bad else '✅'} {' x '.join(grain)} grain scan")
+        for detail in dict.fromkeys(bad):
+            print(f"    {detail}")
+    conn.close()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
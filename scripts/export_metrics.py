@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from query_engine import (
+    DB_PATH,
+    ConnectionPool,
+    data_version,
+    prefetch_queries,
+    run_queries,
+    get_filter_options,
+    get_overall_kpis,
+    get_top_10_stores_by_ir,
+    get_bottom_10_stores_by_isu,
+    get_store_count_by_city,
+    get_top_2_promo_types_by_ir,
+    get_bottom_2_promo_types_by_isu,
+    get_balanced_promotions,
+    get_category_wise_sales_lift,
+    get_category_promo_effectiveness,
+    get_product_response_analysis,
+    get_discount_vs_bogof_cashback,
+    get_top_categories_by_lift,
+    get_best_performing_products,
+    get_worst_performing_products,
+    get_top_10_products_by_lift,
+    get_bottom_10_products_by_lift,
+    get_category_promo_correlation_data,
+)
+from snapshot_backend import SnapshotPool
+
+#Set paths
+EXPORT_DIR = os.path.join(os.path.dirname(__file__), '..', 'reports')
+
+FORMATS = ('parquet', 'csv', 'json')
+MANIFEST_FILE = 'manifest.json'
+
+# Every metric, by the file name it is exported under
+METRICS = {
+    'filter_options': get_filter_options,
+    'overall_kpis': get_overall_kpis,
+    'top_stores_by_ir': get_top_10_stores_by_ir,
+    'bottom_stores_by_isu': get_bottom_10_stores_by_isu,
+    'store_count_by_city': get_store_count_by_city,
+    'top_promo_types_by_ir': get_top_2_promo_types_by_ir,
+    'bottom_promo_types_by_isu': get_bottom_2_promo_types_by_isu,
+    'balanced_promotions': get_balanced_promotions,
+    'category_wise_sales_lift': get_category_wise_sales_lift,
+    'category_promo_effectiveness': get_category_promo_effectiveness,
+    'product_response_analysis': get_product_response_analysis,
+    'discount_vs_bogof_cashback': get_discount_vs_bogof_cashback,
+    'top_categories_by_lift': get_top_categories_by_lift,
+    'best_performing_products': get_best_performing_products,
+    'worst_performing_products': get_worst_performing_products,
+    'top_products_by_lift': get_top_10_products_by_lift,
+    'bottom_products_by_lift': get_bottom_10_products_by_lift,
+    'category_promo_correlation': get_category_promo_correlation_data,
+}
+# Metrics that describe the whole dataset and take no filters
+UNFILTERED_METRICS = {'filter_options', 'store_count_by_city'}
+
+
+def _metric_queries(filters):
+    return {
+        name: query if name in UNFILTERED_METRICS else functools.partial(query, **filters)
+        for name, query in METRICS.items()
+    }
+
+
+# Runs every metric once. In parallel they go through run_queries on the
+# pool's per-thread connections; otherwise they share one warm connection.
+# Either way the fact rows are scanned once, at the grain every metric rolls
+# up from, and the dimensions are read once.
+def compute_metrics(pool, filters=None, parallel=False):
+    queries = _metric_queries(filters or {})
+    if parallel:
+        return dict(zip(queries, run_queries(list(queries.values()), pool=pool)))
+    conn = pool.get()
+    prefetch_queries(conn, queries.values())
+    return {name: query(conn) for name, query in queries.items()}
+
+
+def _as_frame(result):
+    # tables as they are; flat dicts (the KPIs) as one row; anything nested is left as JSON
+    if isinstance(result, pd.DataFrame):
+        return result
+    if isinstance(result, dict) and not any(isinstance(value, (dict, list, tuple)) for value in result.values()):
+        return pd.DataFrame([result])
+    return None
+
+
+def write_metric(out_dir, name, result, fmt):
+    frame = _as_frame(result)
+    if frame is None or fmt == 'json':
+        path = os.path.join(out_dir, f'{name}.json')
+        if frame is not None:
+            frame.to_json(path, orient='records', date_format='iso', indent=2)
+        else:
+            with open(path, 'w') as f:
+                json.dump(result, f, indent=2, default=str)
+    elif fmt == 'csv':
+        path = os.path.join(out_dir, f'{name}.csv')
+        frame.to_csv(path, index=False)
+    else:
+        path = os.path.join(out_dir, f'{name}.parquet')
+        frame.to_parquet(path, index=False)
+    return path
+
+
+# With snapshot set, the metrics are read from that memory-mapped snapshot
+# (see snapshot_backend.py) instead of the database.
+def export_metrics(db_path=DB_PATH, out_dir=EXPORT_DIR, fmt='parquet', filters=None, parallel=False, snapshot=None):
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    os.makedirs(out_dir, exist_ok=True)
+    pool = SnapshotPool(snapshot) if snapshot else ConnectionPool(db_path)
+    try:
+        start = time.perf_counter()
+        results = compute_metrics(pool, filters, parallel)
+        elapsed = time.perf_counter() - start
+        version = data_version(pool.get())
+    finally:
+        pool.close_all()
+
+    files = {name: os.path.basename(write_metric(out_dir, name, result, fmt)) for name, result in results.items()}
+    manifest = {
+        'exported_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'database': os.path.abspath(snapshot or db_path),
+        'data_version': version,
+        'filters': filters or {},
+        'format': fmt,
+        'compute_seconds': round(elapsed, 3),
+        'files': files,
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute every dashboard metric and write them to files, "
+                                                 "without starting Streamlit")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--out', default=EXPORT_DIR, help="directory for the metric files and manifest.json")
+    parser.add_argument('--format', choices=FORMATS, default='parquet')
+    parser.add_argument('--parallel', action='store_true', help="run the metrics on the shared query thread pool")
+    parser.add_argument('--snapshot', default=None, metavar='DIR',
+                        help="read from the snapshot published in DIR instead of the database")
+    parser.add_argument('--campaign', action='append', help="campaign_id to keep (repeatable)")
+    parser.add_argument('--city', action='append', help="city to keep (repeatable)")
+    parser.add_argument('--category', action='append', help="product category to keep (repeatable)")
+    parser.add_argument('--promo-type', action='append', help="promo_type to keep (repeatable)")
+    parser.add_argument('--start-date', help="keep campaigns running on or after this date (YYYY-MM-DD)")
+    parser.add_argument('--end-date', help="keep campaigns running on or before this date (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    if not args.snapshot and not os.path.exists(args.db):
+        sys.exit(f"❌ No database at {args.db}; run load_data_to_sqlite.py first")
+    filters = {
+        name: value for name, value in {
+            'campaign': args.campaign,
+            'city': args.city,
+            'category': args.category,
+            'promo_type': args.promo_type,
+            'start_date': args.start_date,
+            'end_date': args.end_date,
+        }.items() if value
+    }
+
+    start = time.perf_counter()
+    manifest = export_metrics(args.db, args.out, args.format, filters, args.parallel, args.snapshot)
+    elapsed = time.perf_counter() - start
+    print(f"✅ Exported {len(manifest['files'])} metrics as {args.format} to {os.path.abspath(args.out)} "
+          f"in {elapsed:.2f}s (queries {manifest['compute_seconds']:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
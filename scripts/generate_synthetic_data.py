@@ -0,0 +1,154 @@
+import os
+import time
+import shutil
+import argparse
+
+import numpy as np
+import pandas as pd
+
+#Set paths
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+DEFAULT_SEED = 42
+# Rows generated and written per chunk. Each chunk has its own random stream,
+# so this is part of what makes a seed reproducible; it is not an option.
+CHUNKSIZE = 1_000_000
+
+FACT_COLUMNS = [
+    'event_id', 'store_id', 'campaign_id', 'product_code', 'base_price', 'promo_type',
+    'quantity_sold(before_promo)', 'quantity_sold(after_promo)',
+]
+
+# Event ids are i * EVENT_ID_MULTIPLIER mod 16**EVENT_ID_DIGITS in hex: an odd
+# multiplier makes that a bijection, so ids are unique, look random and never
+# need a lookup table.
+EVENT_ID_DIGITS = 10
+EVENT_ID_MULTIPLIER = 0x9E3779B97F
+
+
+# Distributions fitted to a template dataset (the shipped CSVs by default):
+# - offers: every (product, campaign) pair with its base_price and promo_type
+# - per product: log-normal units sold before the promotion
+# - per promo_type: log-normal ratio of units after to units before
+# - per store: its share of pre-promotion volume, used as its sampling weight
+def fit_profile(template_dir=DATA_DIR):
+    facts = pd.read_csv(os.path.join(template_dir, 'fact_events.csv'))
+    before = facts['quantity_sold(before_promo)'].clip(lower=1)
+    after = facts['quantity_sold(after_promo)'].clip(lower=1)
+    facts['log_before'] = np.log(before)
+    facts['log_lift'] = np.log(after / before)
+
+    offers = (
+        facts.groupby(['product_code', 'campaign_id'])[['base_price', 'promo_type']]
+        .first()
+        .reset_index()
+    )
+    products = facts.groupby('product_code')['log_before'].agg(['mean', 'std']).fillna(0)
+    lifts = facts.groupby('promo_type')['log_lift'].agg(['mean', 'std']).fillna(0)
+    store_volume = facts.groupby('store_id')['quantity_sold(before_promo)'].sum()
+    return {
+        'offers': offers,
+        'products': products,
+        'lifts': lifts,
+        'store_weights': store_volume / store_volume.sum(),
+    }
+
+
+# Scales the store dimension to `count` stores. Extra stores copy an existing
+# store's city and volume share and continue its id prefix (STBLR-10, ...).
+def scale_stores(stores, weights, count):
+    if count is None or count <= len(stores):
+        return stores, weights.reindex(stores['store_id']).fillna(0).to_numpy()
+    extra = []
+    next_number = {}
+    for store_id in stores['store_id']:
+        prefix, number = store_id.rsplit('-', 1)
+        next_number[prefix] = max(next_number.get(prefix, 0), int(number) + 1)
+    templates = stores.to_dict('records')
+    for i in range(count - len(stores)):
+        template = templates[i % len(templates)]
+        prefix = template['store_id'].rsplit('-', 1)[0]
+        extra.append({'store_id': f"{prefix}-{next_number[prefix]}", 'city': template['city'],
+                      'template': template['store_id']})
+        next_number[prefix] += 1
+    scaled = pd.concat([stores, pd.DataFrame(extra).drop(columns='template')], ignore_index=True)
+    templates_by_store = list(stores['store_id']) + [row['template'] for row in extra]
+    return scaled, weights.reindex(templates_by_store).fillna(0).to_numpy()
+
+
+def _event_ids(start, stop):
+    ids = (np.arange(start, stop, dtype=np.uint64) * np.uint64(EVENT_ID_MULTIPLIER)) % np.uint64(16 ** EVENT_ID_DIGITS)
+    return np.char.zfill(np.char.mod('%x', ids), EVENT_ID_DIGITS)
+
+
+def _generate_chunk(profile, stores, store_weights, start, stop, seed):
+    rng = np.random.default_rng([seed, start])
+    rows = stop - start
+    offers = profile['offers']
+    products = profile['products']
+    lifts = profile['lifts']
+
+    store = rng.choice(len(stores), size=rows, p=store_weights / store_weights.sum())
+    offer = rng.integers(0, len(offers), size=rows)
+    product_code = offers['product_code'].to_numpy()[offer]
+    promo_type = offers['promo_type'].to_numpy()[offer]
+
+    log_before = rng.normal(products['mean'].reindex(product_code).to_numpy(),
+                            products['std'].reindex(product_code).to_numpy())
+    before = np.maximum(np.rint(np.exp(log_before)), 1).astype(np.int64)
+    lift = np.exp(rng.normal(lifts['mean'].reindex(promo_type).to_numpy(), lifts['std'].reindex(promo_type).to_numpy()))
+    after = np.maximum(np.rint(before * lift), 0).astype(np.int64)
+
+    return pd.DataFrame({
+        'event_id': _event_ids(start, stop),
+        'store_id': stores['store_id'].to_numpy()[store],
+        'campaign_id': offers['campaign_id'].to_numpy()[offer],
+        'product_code': product_code,
+        'base_price': offers['base_price'].to_numpy()[offer],
+        'promo_type': promo_type,
+        'quantity_sold(before_promo)': before,
+        'quantity_sold(after_promo)': after,
+    }, columns=FACT_COLUMNS)
+
+
+# Writes dim_*.csv and a `rows`-row fact_events.csv to out_dir, in the same
+# layout as data/. The same arguments always produce the same files.
+def generate(out_dir, rows, seed=DEFAULT_SEED, stores=None, template_dir=DATA_DIR):
+    if rows > 16 ** EVENT_ID_DIGITS:
+        raise ValueError(f"at most {16 ** EVENT_ID_DIGITS:,} rows have unique event ids")
+    os.makedirs(out_dir, exist_ok=True)
+    profile = fit_profile(template_dir)
+
+    for name in ('dim_campaigns.csv', 'dim_products.csv'):
+        shutil.copyfile(os.path.join(template_dir, name), os.path.join(out_dir, name))
+    store_dim, store_weights = scale_stores(pd.read_csv(os.path.join(template_dir, 'dim_stores.csv')),
+                                            profile['store_weights'], stores)
+    store_dim.to_csv(os.path.join(out_dir, 'dim_stores.csv'), index=False)
+
+    fact_path = os.path.join(out_dir, 'fact_events.csv')
+    with open(fact_path, 'w', newline='') as f:
+        f.write(','.join(FACT_COLUMNS) + '\n')
+        for start in range(0, rows, CHUNKSIZE):
+            stop = min(start + CHUNKSIZE, rows)
+            chunk = _generate_chunk(profile, store_dim, store_weights, start, stop, seed)
+            chunk.to_csv(f, header=False, index=False)
+    return fact_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic AtliQ Mart dataset with the shipped CSV schemas")
+    parser.add_argument('--rows', type=int, default=100_000, help="fact_events rows (1e4 to 1e8 is typical)")
+    parser.add_argument('--out', required=True, help="directory for the generated CSV files")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--stores', type=int, default=None, help="scale dim_stores up to this many stores")
+    parser.add_argument('--template-dir', default=DATA_DIR, help="dataset the distributions are fitted to")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    generate(args.out, args.rows, args.seed, args.stores, args.template_dir)
+    elapsed = time.perf_counter() - start
+    print(f"✅ Generated {args.rows:,} fact_events rows in {elapsed:.2f}s ({args.rows / max(elapsed, 1e-9):,.0f} rows/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,498 @@
 import pandas as pd
 import sqlite3
 import os
+import io
+import re
+import csv
+import sys
+import time
+import argparse
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from query_engine import (
+    CAMPAIGN_DATE_COLUMNS,
+    bump_load_generation,
+    build_rollup_tables,
+    kpi_summary_current,
+    rebuild_kpi_summary,
+    apply_kpi_delta,
+    ranking_sketches_current,
+    rebuild_ranking_sketches,
+    apply_ranking_sketch_delta,
+)
+from snapshot_backend import SNAPSHOT_DIR, publish_snapshot
 
 #Set paths
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'retail_events_db.sqlite')
+QUARANTINE_PATH = os.path.join(os.path.dirname(__file__), '..', 'quarantine', 'fact_events_rejected.csv')
+
+# fact_events.csv is parsed in byte ranges of about this size (some 80k rows)
+DEFAULT_RANGE_BYTES = 4 * 2**20
+# Processes parsing and validating ranges; one process writes
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+# Page cache for the loading connection (negative = KiB)
+LOAD_CACHE_SIZE = -262144
+
+# fact_events.csv columns -> (staging column, SQLite type)
+FACT_CSV_COLUMNS = {
+    'event_id': ('event_id', 'TEXT'),
+    'store_id': ('store_id', 'TEXT'),
+    'campaign_id': ('campaign_id', 'TEXT'),
+    'product_code': ('product_code', 'TEXT'),
+    'base_price': ('base_price', 'INTEGER'),
+    'promo_type': ('promo_type', 'TEXT'),
+    'quantity_sold(before_promo)': ('quantity_sold_before_promo', 'INTEGER'),
+    'quantity_sold(after_promo)': ('quantity_sold_after_promo', 'INTEGER'),
+}
+INTEGER_COLUMNS = [col for col, (_, sql_type) in FACT_CSV_COLUMNS.items() if sql_type == 'INTEGER']
+TEXT_DTYPES = {col: str for col in FACT_CSV_COLUMNS if col not in INTEGER_COLUMNS}
+STAGE_COLUMNS = [name for name, _ in FACT_CSV_COLUMNS.values()]
+
+# promo_type values look like "25% OFF", "BOGOF" or "500 Cashback"
+PROMO_TYPE_PATTERN = r'\d+% OFF|BOGOF|\d+ Cashback'
+
+DIMENSION_KEYS = {
+    'dim_campaigns': 'campaign_id',
+    'dim_products': 'product_code',
+    'dim_stores': 'store_id',
+}
+
+# dim_campaigns.csv writes dates as DD-MM-YYYY; they are stored as ISO-8601
+# text (SQLite's date representation), which compares and sorts as a date.
+CAMPAIGN_DATE_FORMAT = '%d-%m-%Y'
+
+# Star schema: integer surrogate keys on the dimensions, the fact table keyed
+# on event_id and referencing the dimensions by surrogate key.
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS dim_campaigns (
+        campaign_key INTEGER PRIMARY KEY,
+        campaign_id TEXT NOT NULL UNIQUE,
+        campaign_name TEXT NOT NULL,
+        start_date TEXT,
+        end_date TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS dim_products (
+        product_key INTEGER PRIMARY KEY,
+        product_code TEXT NOT NULL UNIQUE,
+        product_name TEXT NOT NULL,
+        category TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS dim_stores (
+        store_key INTEGER PRIMARY KEY,
+        store_id TEXT NOT NULL UNIQUE,
+        city TEXT NOT NULL
+    )""",
+    # lookups behind the city and category filters in query_engine
+    "CREATE INDEX IF NOT EXISTS idx_dim_stores_city ON dim_stores (city)",
+    "CREATE INDEX IF NOT EXISTS idx_dim_products_category ON dim_products (category)",
+    """CREATE TABLE IF NOT EXISTS fact_events (
+        event_id TEXT PRIMARY KEY,
+        store_key INTEGER NOT NULL REFERENCES dim_stores (store_key),
+        campaign_key INTEGER NOT NULL REFERENCES dim_campaigns (campaign_key),
+        product_key INTEGER NOT NULL REFERENCES dim_products (product_key),
+        base_price INTEGER NOT NULL,
+        promo_type TEXT NOT NULL,
+        quantity_sold_before_promo INTEGER NOT NULL,
+        quantity_sold_after_promo INTEGER NOT NULL
+    )""",
+]
+
+# Covering indexes for the fact table's foreign keys. Each carries the rest of
+# the query_engine base grain plus the measures, so the base GROUP BY (and any
+# scan restricted to one store, product or campaign) never touches the table.
+FACT_INDEXES = [
+    """CREATE INDEX IF NOT EXISTS idx_fact_events_store_grain ON fact_events (
+        store_key, product_key, campaign_key, promo_type,
+        base_price, quantity_sold_before_promo, quantity_sold_after_promo
+    )""",
+    """CREATE INDEX IF NOT EXISTS idx_fact_events_product ON fact_events (
+        product_key, promo_type, store_key, campaign_key,
+        base_price, quantity_sold_before_promo, quantity_sold_after_promo
+    )""",
+    """CREATE INDEX IF NOT EXISTS idx_fact_events_campaign ON fact_events (
+        campaign_key, store_key, product_key, promo_type,
+        base_price, quantity_sold_before_promo, quantity_sold_after_promo
+    )""",
+]
+
+FACT_TABLE_COLUMNS = [
+    'event_id', 'store_key', 'campaign_key', 'product_key', 'base_price', 'promo_type',
+    'quantity_sold_before_promo', 'quantity_sold_after_promo',
+]
+
+# Staged rows resolved to surrogate keys. Staging only takes rows whose store,
+# product and campaign are known, so every row finds its keys.
+STAGED_FACTS_SQL = """(
+    SELECT
+        f.event_id,
+        s.store_key,
+        c.campaign_key,
+        p.product_key,
+        f.base_price,
+        f.promo_type,
+        f.quantity_sold_before_promo,
+        f.quantity_sold_after_promo
+    FROM temp.stage_fact_events f
+    JOIN dim_stores s ON s.store_id = f.store_id
+    JOIN dim_campaigns c ON c.campaign_id = f.campaign_id
+    JOIN dim_products p ON p.product_code = f.product_code
+    WHERE f.rowid IN (SELECT MAX(rowid) FROM temp.stage_fact_events GROUP BY event_id)
+)"""
+
+def _read_dimensions(data_dir):
+    dimensions = {table: pd.read_csv(os.path.join(data_dir, f'{table}.csv'), dtype=str) for table in DIMENSION_KEYS}
+    campaigns = dimensions['dim_campaigns']
+    for column in CAMPAIGN_DATE_COLUMNS:
+        campaigns[column] = pd.to_datetime(campaigns[column], format=CAMPAIGN_DATE_FORMAT).dt.strftime('%Y-%m-%d')
+    # campaign keys are handed out in time order, and fact_events is clustered on them
+    dimensions['dim_campaigns'] = campaigns.sort_values(['start_date', 'campaign_id'], kind='mergesort')
+    return dimensions
+
+
+def _rows(df, columns):
+    return zip(*(df[col].tolist() for col in columns))
+
+
+def _insert_sql(table, columns, verb='INSERT'):
+    return f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+
+
+def _create_schema(conn):
+    for statement in SCHEMA + FACT_INDEXES:
+        conn.execute(statement)
+
+
+def _drop_staging(conn):
+    conn.execute("DROP TABLE IF EXISTS temp.stage_fact_events")
+
+
+# Parallel staging
+# fact_events.csv is cut into byte ranges at line ends. A process pool parses
+# each range and validates it (types, non-negative numbers, promo_type and the
+# store, product and campaign against in-memory sets of the dimension keys);
+# this process is the only writer and stages the clean rows into a TEMP table
+# in file order, so the main database is not locked while the file is parsed.
+# Rejected rows go to a quarantine CSV with their line number and the reasons.
+# Cutting at newlines assumes no quoted field spans lines, which holds for
+# the fact export.
+
+_DIMENSION_KEY_SETS = None
+
+
+def _dimension_keys(conn, dimensions, existing=False):
+    keys = {}
+    for table, column in DIMENSION_KEYS.items():
+        known = set(dimensions[table][column])
+        # an incremental load may reference rows already in the dimension tables
+        if existing:
+            known.update(key for key, in conn.execute(f"SELECT {column} FROM {table}"))
+        keys[column] = known
+    return keys
+
+
+def _init_worker(keys):
+    global _DIMENSION_KEY_SETS
+    _DIMENSION_KEY_SETS = keys
+
+
+def _byte_ranges(csv_path, range_bytes):
+    with open(csv_path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode('utf-8-sig')]))
+        size = os.fstat(f.fileno()).st_size
+        starts = [f.tell()]
+        while starts[-1] + range_bytes < size:
+            f.seek(starts[-1] + range_bytes)
+            f.readline()
+            if f.tell() >= size:
+                break
+            starts.append(f.tell())
+    missing = [col for col in FACT_CSV_COLUMNS if col not in header]
+    if missing:
+        raise ValueError(f"{os.path.basename(csv_path)} has no {', '.join(missing)} column")
+    return header, list(zip(starts, starts[1:] + [size]))
+
+
+# Rows of a range the C parser rejected for having too many fields; every
+# other row is kept, by its line within the range.
+def _parse_ragged(text, header):
+    lines, records, ragged = [], [], []
+    for line, fields in enumerate(csv.reader(io.StringIO(text))):
+        if not fields:
+            continue
+        if len(fields) > len(header):
+            ragged.append((line, fields))
+            continue
+        lines.append(line)
+        records.append([field if field != '' else None for field in fields]
+                       + [None] * (len(header) - len(fields)))
+    chunk = pd.DataFrame(records, index=lines, columns=header, dtype=object)
+    rejects = pd.DataFrame([fields[:len(header)] for _, fields in ragged],
+                           index=[line for line, _ in ragged], columns=header, dtype=object)
+    rejects['reason'] = [f"expected {len(header)} fields, saw {len(fields)}" for _, fields in ragged]
+    return chunk, rejects
+
+
+def _validate(chunk):
+    missing = chunk.isna()
+    # blank lines parse as rows with every field missing
+    blank = missing.all(axis=1)
+    if blank.any():
+        chunk, missing = chunk[~blank], missing[~blank]
+
+    checks = {f'missing {col}': missing[col] for col in FACT_CSV_COLUMNS}
+    numbers = {}
+    for col in INTEGER_COLUMNS:
+        # the parser already typed a column whose values are all integers
+        if chunk[col].dtype == 'int64':
+            numbers[col] = chunk[col]
+        else:
+            numbers[col] = pd.to_numeric(chunk[col], errors='coerce')
+            checks[f'malformed {col}'] = ~missing[col] & (numbers[col].isna() | (numbers[col] % 1 != 0))
+        checks[f'negative {col}'] = numbers[col] < 0
+    # a range holds a handful of distinct promo types; match those, not every row
+    promo_types = [value for value in chunk['promo_type'].dropna().unique()
+                   if re.fullmatch(PROMO_TYPE_PATTERN, value)]
+    checks['malformed promo_type'] = ~missing['promo_type'] & ~chunk['promo_type'].isin(promo_types)
+    for col, known in _DIMENSION_KEY_SETS.items():
+        checks[f'unknown {col}'] = ~missing[col] & ~chunk[col].isin(known)
+
+    failed = pd.DataFrame(checks)
+    bad = failed.any(axis=1).to_numpy()
+    rejects = chunk[bad].copy()
+    rejects['reason'] = ['; '.join(failed.columns[flags]) for flags in failed.to_numpy()[bad]]
+    clean = chunk.loc[~bad, list(FACT_CSV_COLUMNS)].copy()
+    for col in INTEGER_COLUMNS:
+        clean[col] = numbers[col][~bad].astype('int64')
+    return clean, rejects
+
+
+# Runs in a worker: parses and validates one byte range. Returns the clean
+# rows, the rejected ones (indexed by line within the range) and the number
+# of lines the range spans.
+def _parse_range(csv_path, header, start, end):
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
+    if not data.strip():
+        chunk, ragged = pd.DataFrame(columns=header, dtype=object), None
+    else:
+        try:
+            # text columns as text (an event_id like "123e45" would otherwise
+            # turn into a float); integer columns are typed by the parser and
+            # come back as text or floats when a value is malformed or missing
+            chunk = pd.read_csv(io.BytesIO(data), header=None, names=header, dtype=TEXT_DTYPES,
+                                keep_default_na=False, na_values=[''], skip_blank_lines=False)
+            ragged = None
+        except pd.errors.ParserError:
+            chunk, ragged = _parse_ragged(data.decode('utf-8'), header)
+    clean, rejects = _validate(chunk)
+    if ragged is not None and len(ragged):
+        rejects = pd.concat([rejects, ragged]).sort_index()
+    return clean, rejects, lines
+
+
+# Results of _parse_range for every range, in file order. At most two ranges
+# per worker are in flight, so memory stays bounded when the writer is slower
+# than the parsers.
+def _parsed_ranges(csv_path, keys, range_bytes, workers):
+    header, ranges = _byte_ranges(csv_path, range_bytes)
+    if workers <= 1 or len(ranges) == 1:
+        _init_worker(keys)
+        for start, end in ranges:
+            yield _parse_range(csv_path, header, start, end)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(keys,)) as pool:
+        pending = deque()
+        for start, end in ranges:
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+            pending.append(pool.submit(_parse_range, csv_path, header, start, end))
+        while pending:
+            yield pending.popleft().result()
+
+
+# Stages the valid rows of fact_events.csv and writes the rejected ones to
+# `quarantine_path` (if given). Returns the rows read and a Counter of the
+# rejection reasons.
+def _stage_fact_events(conn, csv_path, keys, range_bytes=DEFAULT_RANGE_BYTES, workers=DEFAULT_WORKERS,
+                       quarantine_path=None):
+    _drop_staging(conn)
+    definition = ', '.join(f'{name} {sql_type}' for name, sql_type in FACT_CSV_COLUMNS.values())
+    conn.execute(f"CREATE TEMP TABLE stage_fact_events ({definition})")
+    insert = _insert_sql('temp.stage_fact_events', STAGE_COLUMNS)
+
+    rows, rejected = 0, Counter()
+    # line 1 is the header
+    first_line = 2
+    quarantine = None
+    try:
+        if quarantine_path:
+            os.makedirs(os.path.dirname(os.path.abspath(quarantine_path)), exist_ok=True)
+            quarantine = open(quarantine_path, 'w', newline='')
+        with conn:
+            for index, (clean, rejects, lines) in enumerate(_parsed_ranges(csv_path, keys, range_bytes, workers)):
+                conn.executemany(insert, _rows(clean, list(FACT_CSV_COLUMNS)))
+                rows += len(clean) + len(rejects)
+                rejected.update(rejects['reason'])
+                if quarantine is not None and (len(rejects) or index == 0):
+                    rejects = rejects.rename_axis('line').reset_index()
+                    rejects['line'] += first_line
+                    columns = ['line', 'reason'] + [col for col in rejects.columns if col not in ('line', 'reason')]
+                    rejects[columns].to_csv(quarantine, index=False, header=index == 0)
+                first_line += lines
+    finally:
+        if quarantine is not None:
+            quarantine.close()
+    return rows, rejected
+
+
+def _upsert(conn, table, source, key, columns):
+    updates = ', '.join(f'{col} = excluded.{col}' for col in columns if col != key)
+    changed = ' OR '.join(f'{table}.{col} IS NOT excluded.{col}' for col in columns if col != key)
+    # SQLite needs a WHERE clause before ON CONFLICT when upserting from a SELECT
+    conn.execute(f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        SELECT {', '.join(columns)} FROM {source} WHERE true
+        ON CONFLICT ({key}) DO UPDATE SET {updates}
+        WHERE {changed}
+    """)
+
+
+# Full load: rebuilds the star schema from the CSVs in one transaction. Readers
+# keep seeing the previous tables until it commits.
+def load_full(conn, data_dir, range_bytes=DEFAULT_RANGE_BYTES, workers=DEFAULT_WORKERS, quarantine_path=None):
+    dimensions = _read_dimensions(data_dir)
+
+    start = time.perf_counter()
+    rows, rejected = _stage_fact_events(conn, os.path.join(data_dir, 'fact_events.csv'),
+                                        _dimension_keys(conn, dimensions), range_bytes, workers, quarantine_path)
+    conn.execute("BEGIN")
+    try:
+        bump_load_generation(conn)
+        for table in ['fact_events', *DIMENSION_KEYS]:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        for statement in SCHEMA:
+            conn.execute(statement)
+        for table, df in dimensions.items():
+            conn.executemany(_insert_sql(table, list(df.columns)), _rows(df, list(df.columns)))
+        # clustered by campaign: the rows of one campaign (one time window) sit together
+        conn.execute(f"INSERT INTO fact_events ({', '.join(FACT_TABLE_COLUMNS)}) "
+                     f"SELECT * FROM {STAGED_FACTS_SQL} ORDER BY campaign_key")
+        # indexes are built after the bulk insert, which is faster than maintaining them row by row
+        for statement in FACT_INDEXES:
+            conn.execute(statement)
+        rebuild_kpi_summary(conn)
+        rebuild_ranking_sketches(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _drop_staging(conn)
+    elapsed = time.perf_counter() - start
+    return rows, rejected, elapsed
+
+
+# Incremental mode: the staged rows are merged on their keys in one short
+# transaction, so only new or changed rows are written and readers never see
+# a partial load.
+def merge_incremental(conn, data_dir, range_bytes=DEFAULT_RANGE_BYTES, workers=DEFAULT_WORKERS,
+                      quarantine_path=None):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(fact_events)")]
+    if columns and 'store_key' not in columns:
+        sys.exit("fact_events predates the star schema; run a full load first")
+    dimensions = _read_dimensions(data_dir)
+
+    start = time.perf_counter()
+    rows, rejected = _stage_fact_events(conn, os.path.join(data_dir, 'fact_events.csv'),
+                                        _dimension_keys(conn, dimensions, existing=bool(columns)),
+                                        range_bytes, workers, quarantine_path)
+    conn.execute("BEGIN")
+    try:
+        # the KPI summary and ranking sketches can only be patched if they
+        # match the data being merged into
+        kpis_current = kpi_summary_current(conn)
+        sketches_current = ranking_sketches_current(conn)
+        bump_load_generation(conn)
+        _create_schema(conn)
+        for table, key in DIMENSION_KEYS.items():
+            df = dimensions[table]
+            conn.execute(f"DROP TABLE IF EXISTS temp.stage_{table}")
+            conn.execute(f"CREATE TEMP TABLE stage_{table} ({', '.join(df.columns)})")
+            conn.executemany(_insert_sql(f'temp.stage_{table}', list(df.columns)), _rows(df, list(df.columns)))
+            _upsert(conn, table, f'temp.stage_{table}', key, list(df.columns))
+            conn.execute(f"DROP TABLE temp.stage_{table}")
+        if kpis_current:
+            apply_kpi_delta(conn, STAGED_FACTS_SQL)
+        if sketches_current:
+            apply_ranking_sketch_delta(conn, STAGED_FACTS_SQL)
+        _upsert(conn, 'fact_events', STAGED_FACTS_SQL, 'event_id', FACT_TABLE_COLUMNS)
+        if not kpis_current:
+            rebuild_kpi_summary(conn)
+        if not sketches_current:
+            rebuild_ranking_sketches(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _drop_staging(conn)
+    elapsed = time.perf_counter() - start
+    return rows, rejected, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the AtliQ Mart CSV files into SQLite")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--range-mb', type=float, default=DEFAULT_RANGE_BYTES / 2**20,
+                        help="size of the byte ranges fact_events.csv is parsed in")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="processes parsing and validating fact_events.csv (1 parses in this process)")
+    parser.add_argument('--quarantine', default=QUARANTINE_PATH, help="CSV file the rejected rows are written to")
+    parser.add_argument('--incremental', action='store_true',
+                        help="merge new or changed rows on their keys instead of replacing the tables")
+    parser.add_argument('--snapshot', nargs='?', const=SNAPSHOT_DIR, default=None, metavar='DIR',
+                        help="also publish a memory-mapped snapshot for the serving processes (default: retail_events_snapshot/)")
+    args = parser.parse_args()
+
+    ##Connecting to SQLite
+    conn = sqlite3.connect(args.db)
+    conn.execute(f"PRAGMA cache_size = {LOAD_CACHE_SIZE}")
+    # WAL lets dashboard readers keep querying while a load is running
+    conn.execute("PRAGMA journal_mode = WAL")
+
+    # Loading the csv files into the database
+    if args.incremental:
+        load = merge_incremental
+    else:
+        load = load_full
+    rows, rejected, elapsed = load(conn, args.data_dir, int(args.range_mb * 2**20), args.workers, args.quarantine)
+    print(f"fact_events: {rows:,} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/sec)")
+    if rejected:
+        print(f"⚠️ quarantined {sum(rejected.values()):,} invalid rows to {os.path.abspath(args.quarantine)}")
+        for reason, count in rejected.most_common():
+            print(f"   {count:>10,}  {reason}")
+
+    # Refreshing planner statistics so the covering indexes get picked
+    conn.execute("ANALYZE")
+
+    # Pre-aggregating the dashboard grains
+    build_rollup_tables(conn)
 
-#Load csv files
-df_campaigns = pd.read_csv(os.path.join(DATA_DIR, 'dim_campaigns.csv'))
-df_products = pd.read_csv(os.path.join(DATA_DIR, 'dim_products.csv'))
-df_stores = pd.read_csv(os.path.join(DATA_DIR, 'dim_stores.csv'))
-df_events = pd.read_csv(os.path.join(DATA_DIR, 'fact_events.csv'))
+    # Publishing the snapshot the serving processes map, swapped in atomically
+    if args.snapshot:
+        name, manifest = publish_snapshot(conn, args.snapshot)
+        print(f"📦 Published snapshot {name} ({manifest['rows']:,} fact rows) to {os.path.abspath(args.snapshot)}")
 
-##Connecting to SQLite
-conn = sqlite3.connect(DB_PATH)
+    #Closing the connection
+    conn.close()
 
-# Loading the dataframes into the database
-df_campaigns.to_sql('dim_campaigns', conn, if_exists='replace', index=False)
-df_products.to_sql('dim_products', conn, if_exists='replace', index=False)
-df_stores.to_sql('dim_stores', conn, if_exists='replace', index=False)
-df_events.to_sql('fact_events', conn, if_exists='replace', index=False)
+    print(f"✅ Data loaded successfully into {os.path.basename(args.db)}")
 
-#Closing the connection
-conn.close()
 
-print("✅ Data loaded successfully into retail_events_db.sqlite")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from query_engine import (
+    DB_PATH,
+    BASE_GRAIN,
+    BASE_MEASURES,
+    CAMPAIGN_DATE_COLUMNS,
+    CAMPAIGN_FILTERS,
+    ConnectionPool,
+    data_version,
+    read_frame,
+    read_frames,
+    select_campaigns,
+)
+
+# Rows per chunk when reading fact_events out of SQLite
+LOAD_CHUNKSIZE = 500_000
+
+# Dimension tables in surrogate-key order; a row's position is its code
+DIMENSION_QUERIES = {
+    'dim_stores': "SELECT store_key, store_id, city FROM dim_stores ORDER BY store_key",
+    'dim_products': "SELECT product_key, product_code, product_name, category FROM dim_products ORDER BY product_key",
+    'dim_campaigns': "SELECT campaign_key, campaign_id, campaign_name, start_date, end_date FROM dim_campaigns ORDER BY campaign_key",
+}
+DIMENSION_DATES = {'dim_campaigns': CAMPAIGN_DATE_COLUMNS}
+FACT_QUERY = """
+    SELECT
+        store_key,
+        product_key,
+        campaign_key,
+        promo_type,
+        base_price,
+        quantity_sold_before_promo,
+        quantity_sold_after_promo
+    FROM fact_events
+"""
+# filter name -> (dimension the codes index, column the values match);
+# campaign and date filters select row ranges instead (see FactArrays)
+FILTER_COLUMNS = {
+    'city': ('store', 'city'),
+    'category': ('product', 'category'),
+    'promo_type': ('promo_type', 'promo_type'),
+}
+
+
+def _code_lookup(keys):
+    # surrogate key -> dense code, -1 for keys the dimension does not have
+    lookup = np.full(int(keys.max()) + 1 if len(keys) else 1, -1, dtype=np.int64)
+    lookup[keys] = np.arange(len(keys))
+    return lookup
+
+
+# In-memory snapshot of fact_events
+# Every grain column is stored as a small integer code into its dimension
+# (store, product and campaign by surrogate-key order, promo_type by sorted
+# value) and the measures as int32. The codes are also combined into one group
+# code per row, numbering only the store/product/campaign/promo_type
+# combinations that actually occur (group_index maps each back to its place in
+# the full cross-product), so a row costs about 20 bytes and the base grain is
+# one bincount per measure over the observed combinations. Rows are sorted by
+# campaign, so a campaign or date filter reads only the slices of the
+# campaigns it selects.
+class FactArrays:
+    def __init__(self, conn, chunksize=LOAD_CHUNKSIZE):
+        dimensions = {
+            name: read_frame(conn, query, parse_dates=DIMENSION_DATES.get(name))
+            for name, query in DIMENSION_QUERIES.items()
+        }
+        self.dimensions = {
+            name: frame.drop(columns=frame.columns[0]).reset_index(drop=True)
+            for name, frame in dimensions.items()
+        }
+        promo_types = sorted(row[0] for row in conn.execute("SELECT DISTINCT promo_type FROM fact_events"))
+        self.labels = {
+            'store': self.dimensions['dim_stores'],
+            'product': self.dimensions['dim_products'],
+            'campaign': self.dimensions['dim_campaigns'],
+            'promo_type': pd.DataFrame({'promo_type': promo_types}),
+        }
+        lookups = {
+            'store': _code_lookup(dimensions['dim_stores']['store_key'].to_numpy()),
+            'product': _code_lookup(dimensions['dim_products']['product_key'].to_numpy()),
+            'campaign': _code_lookup(dimensions['dim_campaigns']['campaign_key'].to_numpy()),
+        }
+
+        chunks = []
+        for chunk in read_frames(conn, FACT_QUERY, chunksize):
+            codes = {
+                name: lookups[name][chunk[f'{name}_key'].to_numpy()]
+                for name in lookups
+            }
+            codes['promo_type'] = pd.Categorical(chunk['promo_type'], categories=promo_types).codes
+            # rows whose key has no dimension row drop out, as in the SQL inner join
+            keep = np.logical_and.reduce([code >= 0 for code in codes.values()])
+            chunks.append({
+                **{name: code[keep] for name, code in codes.items()},
+                'base_price': chunk['base_price'].to_numpy()[keep],
+                'units_before': chunk['quantity_sold_before_promo'].to_numpy()[keep],
+                'units_after': chunk['quantity_sold_after_promo'].to_numpy()[keep],
+            })
+
+        self.shape = tuple(len(self.labels[name]) for name in ('store', 'product', 'campaign', 'promo_type'))
+        self.columns = {}
+        for name, size in zip(('store', 'product', 'campaign', 'promo_type'), self.shape):
+            self.columns[name] = self._concat(chunks, name, np.min_scalar_type(max(size - 1, 0)))
+        for name in ('base_price', 'units_before', 'units_after'):
+            self.columns[name] = self._concat(chunks, name, np.int32)
+        order = np.argsort(self.columns['campaign'], kind='stable')
+        self.columns = {name: column[order] for name, column in self.columns.items()}
+        # rows of campaign code c are campaign_offsets[c]:campaign_offsets[c + 1]
+        self.campaign_offsets = np.searchsorted(self.columns['campaign'], np.arange(self.shape[2] + 1))
+        combination = self.columns['store'].astype(np.int64)
+        for name, size in zip(('product', 'campaign', 'promo_type'), self.shape[1:]):
+            combination = combination * size + self.columns[name]
+        # sorted, so groups come out in the same store-major order as the cross-product
+        self.group_index, group = np.unique(combination, return_inverse=True)
+        self.columns['group'] = group.astype(np.min_scalar_type(max(len(self.group_index) - 1, 0)))
+
+    @staticmethod
+    def _concat(chunks, name, dtype):
+        if not chunks:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate([chunk[name] for chunk in chunks]).astype(dtype)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values()) + self.group_index.nbytes
+
+    def _campaign_rows(self, filters):
+        # the columns cut down to the campaigns the campaign and date filters
+        # select; a single campaign is a view, no copy
+        filters = [(name, values) for name, values in filters if name in CAMPAIGN_FILTERS]
+        if not filters:
+            return self.columns
+        campaigns = self.labels['campaign']
+        codes = np.flatnonzero(campaigns['campaign_id'].isin(select_campaigns(campaigns, filters)).to_numpy())
+        slices = [slice(self.campaign_offsets[code], self.campaign_offsets[code + 1]) for code in codes]
+        if len(slices) == 1:
+            return {name: column[slices[0]] for name, column in self.columns.items()}
+        return {
+            name: np.concatenate([column[rows] for rows in slices]) if slices else column[:0]
+            for name, column in self.columns.items()
+        }
+
+    def _mask(self, columns, filters):
+        mask = None
+        for name, values in filters:
+            if name in CAMPAIGN_FILTERS:
+                continue
+            dimension, column = FILTER_COLUMNS[name]
+            allowed = self.labels[dimension][column].isin(values).to_numpy()
+            selected = allowed[columns[dimension]]
+            mask = selected if mask is None else mask & selected
+        return mask
+
+    def scan(self, filters=()):
+        columns = self._campaign_rows(filters)
+        group = columns['group']
+        before = columns['units_before']
+        after = columns['units_after']
+        price = columns['base_price']
+
+        mask = self._mask(columns, filters)
+        if mask is not None:
+            group, before, after, price = group[mask], before[mask], after[mask], price[mask]
+
+        # float64 bincount weights sum integers exactly below 2**53
+        incremental = after.astype(np.int64) - before
+        groups = len(self.group_index)
+        measures = {
+            'event_count': np.bincount(group, minlength=groups),
+            'units_before': np.bincount(group, weights=before, minlength=groups),
+            'units_after': np.bincount(group, weights=after, minlength=groups),
+            'incremental_units': np.bincount(group, weights=incremental, minlength=groups),
+            'incremental_revenue': np.bincount(group, weights=incremental * price, minlength=groups),
+        }
+        present = np.flatnonzero(measures['event_count'])
+        store, product, campaign, promo_type = np.unravel_index(self.group_index[present], self.shape)
+        df = pd.DataFrame({
+            'store_id': self.labels['store']['store_id'].to_numpy()[store],
+            'product_code': self.labels['product']['product_code'].to_numpy()[product],
+            'campaign_id': self.labels['campaign']['campaign_id'].to_numpy()[campaign],
+            'promo_type': self.labels['promo_type']['promo_type'].to_numpy()[promo_type],
+        })
+        for name, values in measures.items():
+            df[name] = np.rint(values[present]).astype(np.int64)
+        return df[BASE_GRAIN + BASE_MEASURES]
+
+
+# Backend
+class NumpyBackend:
+    # A query_engine storage backend that answers from a FactArrays snapshot of
+    # a SQLite database. The snapshot is reloaded whenever the database's load
+    # generation moves on. Pass an instance wherever the metric functions take
+    # a connection.
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = os.path.abspath(db_path)
+        self.identity = f'numpy:{self.db_path}'
+        self._pool = ConnectionPool(self.db_path)
+        self._lock = threading.Lock()
+        self._version = None
+        self._arrays = None
+
+    def data_version(self):
+        return data_version(self._pool.get())
+
+    def arrays(self):
+        conn = self._pool.get()
+        version = data_version(conn)
+        with self._lock:
+            if self._arrays is None or version != self._version:
+                self._arrays = FactArrays(conn)
+                self._version = version
+            return self._arrays
+
+    def dimensions(self):
+        return self.arrays().dimensions
+
+    def scan(self, filters=()):
+        return self.arrays().scan(filters)
@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import shutil
+import argparse
+import threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import query_engine
+from query_engine import (
+    BASE_GRAIN,
+    BASE_MEASURES,
+    CAMPAIGN_DATE_COLUMNS,
+    DATE_FILTERS,
+    data_version,
+    read_frame,
+    read_frames,
+    select_campaigns,
+)
+
+#Set paths
+PARQUET_DIR = os.path.join(os.path.dirname(__file__), '..', 'retail_events_parquet')
+
+# Rows per chunk when exporting fact_events out of SQLite
+EXPORT_CHUNKSIZE = 500_000
+VERSION_FILE = 'VERSION'
+
+# fact_events with the surrogate keys swapped back for natural ids, so the
+# Parquet files stand on their own and can be partitioned by campaign_id.
+EXPORT_QUERY = """
+    SELECT
+        f.event_id,
+        s.store_id,
+        c.campaign_id,
+        p.product_code,
+        f.base_price,
+        f.promo_type,
+        f.quantity_sold_before_promo,
+        f.quantity_sold_after_promo
+    FROM fact_events f
+    JOIN dim_stores s ON s.store_key = f.store_key
+    JOIN dim_products p ON p.product_key = f.product_key
+    JOIN dim_campaigns c ON c.campaign_key = f.campaign_key
+"""
+FACT_SCHEMA = pa.schema([
+    ('event_id', pa.string()),
+    ('store_id', pa.string()),
+    ('campaign_id', pa.string()),
+    ('product_code', pa.string()),
+    ('base_price', pa.int64()),
+    ('promo_type', pa.string()),
+    ('quantity_sold_before_promo', pa.int64()),
+    ('quantity_sold_after_promo', pa.int64()),
+])
+PARTITIONING = ds.partitioning(pa.schema([('campaign_id', pa.string())]), flavor='hive')
+DIMENSION_QUERIES = {
+    'dim_stores': "SELECT store_id, city FROM dim_stores",
+    'dim_products': "SELECT product_code, product_name, category FROM dim_products",
+    'dim_campaigns': "SELECT campaign_id, campaign_name, start_date, end_date FROM dim_campaigns ORDER BY campaign_key",
+}
+DIMENSION_DATES = {'dim_campaigns': CAMPAIGN_DATE_COLUMNS}
+
+
+# Export
+def export_to_parquet(conn, out_dir=PARQUET_DIR, chunksize=EXPORT_CHUNKSIZE):
+    # Everything is written next to out_dir and swapped in with renames, so a
+    # reader never sees a half-written dataset.
+    out_dir = os.path.abspath(out_dir)
+    staging_dir = out_dir + '.tmp'
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+
+    fact_dir = os.path.join(staging_dir, 'fact_events')
+    rows = 0
+    for part, chunk in enumerate(read_frames(conn, EXPORT_QUERY, chunksize)):
+        table = pa.Table.from_pandas(chunk, schema=FACT_SCHEMA, preserve_index=False)
+        ds.write_dataset(table, fact_dir, format='parquet', partitioning=PARTITIONING,
+                         basename_template=f'part-{part}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore')
+        rows += len(chunk)
+
+    for name, query in DIMENSION_QUERIES.items():
+        dimension = read_frame(conn, query, parse_dates=DIMENSION_DATES.get(name))
+        pq.write_table(pa.Table.from_pandas(dimension, preserve_index=False),
+                       os.path.join(staging_dir, f'{name}.parquet'))
+
+    # The export inherits the SQLite load generation as its data version
+    with open(os.path.join(staging_dir, VERSION_FILE), 'w') as f:
+        f.write(str(data_version(conn)))
+
+    old_dir = out_dir + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old_dir)
+    os.rename(staging_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return rows
+
+
+# Typed, so an empty selection still matches the string columns
+def _strings(values):
+    return pa.array(list(values), type=pa.string())
+
+
+# Backend
+class ParquetBackend:
+    # A query_engine storage backend over a directory written by
+    # export_to_parquet. Pass an instance wherever the metric functions take
+    # a connection.
+
+    def __init__(self, path=PARQUET_DIR):
+        self.path = os.path.abspath(path)
+        self.identity = f'parquet:{self.path}'
+        self._lock = threading.Lock()
+        self._version = None
+        self._dataset = None
+        self._dimensions = None
+
+    def data_version(self):
+        with open(os.path.join(self.path, VERSION_FILE)) as f:
+            return f.read().strip()
+
+    def _open(self):
+        # Re-open the dataset and dimensions whenever a new export is swapped in
+        version = self.data_version()
+        with self._lock:
+            if version != self._version:
+                self._dataset = ds.dataset(os.path.join(self.path, 'fact_events'), format='parquet',
+                                           partitioning=PARTITIONING)
+                self._dimensions = {
+                    name: pq.read_table(os.path.join(self.path, f'{name}.parquet')).to_pandas()
+                    for name in DIMENSION_QUERIES
+                }
+                self._version = version
+            return self._dataset, self._dimensions
+
+    def dimensions(self):
+        return self._open()[1]
+
+    def _filter_expression(self, filters, dimensions):
+        # campaign is the partition key, so it and the date window prune whole
+        # directories; city and category resolve to the matching store/product
+        # ids first.
+        expression = None
+        for name, values in filters:
+            if name == 'campaign':
+                clause = ds.field('campaign_id').isin(_strings(values))
+            elif name in DATE_FILTERS:
+                campaigns = select_campaigns(dimensions['dim_campaigns'], [(name, values)])
+                clause = ds.field('campaign_id').isin(_strings(campaigns))
+            elif name == 'promo_type':
+                clause = ds.field('promo_type').isin(_strings(values))
+            elif name == 'city':
+                stores = dimensions['dim_stores']
+                clause = ds.field('store_id').isin(_strings(stores.loc[stores['city'].isin(values), 'store_id']))
+            elif name == 'category':
+                products = dimensions['dim_products']
+                clause = ds.field('product_code').isin(
+                    _strings(products.loc[products['category'].isin(values), 'product_code']))
+            else:
+                raise ValueError(f"Unknown filter: {name}")
+            expression = clause if expression is None else expression & clause
+        return expression
+
+    def scan(self, filters=()):
+        dataset, dimensions = self._open()
+        table = dataset.to_table(
+            columns=BASE_GRAIN + ['base_price', 'quantity_sold_before_promo', 'quantity_sold_after_promo'],
+            filter=self._filter_expression(filters, dimensions),
+        )
+        incremental_units = pc.subtract(table['quantity_sold_after_promo'], table['quantity_sold_before_promo'])
+        table = table.append_column('incremental_units', incremental_units)
+        table = table.append_column('incremental_revenue', pc.multiply(incremental_units, table['base_price']))
+        grouped = table.group_by(BASE_GRAIN, use_threads=False).aggregate([
+            ('base_price', 'count'),
+            ('quantity_sold_before_promo', 'sum'),
+            ('quantity_sold_after_promo', 'sum'),
+            ('incremental_units', 'sum'),
+            ('incremental_revenue', 'sum'),
+        ])
+        df = grouped.to_pandas().rename(columns={
+            'base_price_count': 'event_count',
+            'quantity_sold_before_promo_sum': 'units_before',
+            'quantity_sold_after_promo_sum': 'units_after',
+            'incremental_units_sum': 'incremental_units',
+            'incremental_revenue_sum': 'incremental_revenue',
+        })
+        return df[BASE_GRAIN + BASE_MEASURES]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the SQLite star schema to partitioned Parquet")
+    parser.add_argument('--db', default=query_engine.DB_PATH)
+    parser.add_argument('--out', default=PARQUET_DIR)
+    parser.add_argument('--chunksize', type=int, default=EXPORT_CHUNKSIZE)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    rows = export_to_parquet(conn, args.out, args.chunksize)
+    conn.close()
+    print(f"✅ Exported {rows:,} fact_events rows to {os.path.basename(os.path.abspath(args.out))}")
+
+
+if __name__ == "__main__":
+    main()
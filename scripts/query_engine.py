@@ -1,282 +1,1633 @@
 import sqlite3
+import numpy as np
 import pandas as pd
 import os
+import sys
+import json
+import time
+import bisect
+import heapq
+import logging
+import functools
+import uuid
+import weakref
+import threading
+import pathlib
+import datetime
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'retail_events_db.sqlite')
 
+# Pragmas for the dashboard's read-only connections
+READ_PRAGMAS = {
+    'query_only': 'ON',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -65536,
+    'temp_store': 'MEMORY',
+}
+
+
+# Connection pool
+# Each thread gets its own read-only connection, opened lazily and reused for
+# the life of the thread. The database is kept in WAL mode by the loader, so
+# these readers run in parallel with each other and with a running load. Only
+# the thread's own local holds its connection (the pool keeps weak references
+# for close_all), so a connection is closed as soon as its thread exits; this
+# matters for Streamlit, which runs every rerun on a fresh script thread.
+class PooledConnection(sqlite3.Connection):
+    # a plain subclass, only so the pool can hold weak references to it
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, db_path=DB_PATH, pragmas=READ_PRAGMAS):
+        self.db_path = db_path
+        self.pragmas = dict(pragmas)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = weakref.WeakSet()
+
+    def _open(self):
+        uri = pathlib.Path(self.db_path).resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, factory=PooledConnection)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            try:
+                conn.total_changes
+                return conn
+            except sqlite3.ProgrammingError:
+                # closed by the caller; open a fresh one
+                with self._lock:
+                    self._connections.discard(conn)
+        conn = self._local.conn = self._open()
+        return conn
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = list(self._connections), weakref.WeakSet()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # still held by its own live thread; it is closed when that thread exits
+                pass
+
+
+_POOL = ConnectionPool()
+
+
 def get_connection():
-    return sqlite3.connect(DB_PATH)
-
-
-def get_top_10_stores_by_ir(conn):
-    query = """
-        SELECT 
-            s.store_id,
-            s.city,
-            SUM(("quantity_sold(after_promo)" - "quantity_sold(before_promo)")  * e.base_price) AS incremental_revenue
-        FROM fact_events e
-        JOIN dim_stores s ON e.store_id = s.store_id
-        GROUP BY s.store_id, s.city
-        ORDER BY incremental_revenue DESC
-        LIMIT 10;
-    """
-    return pd.read_sql(query, conn)
-
-
-def get_bottom_10_stores_by_isu(conn):
-    query = """
-        SELECT 
-            s.store_id,
-            s.city,
-            SUM("quantity_sold(after_promo)" - "quantity_sold(before_promo)") AS incremental_sold_units
-        FROM fact_events e
-        JOIN dim_stores s ON e.store_id = s.store_id
-        GROUP BY s.store_id, s.city
-        ORDER BY incremental_sold_units ASC
-        LIMIT 10;
-    """
-    return pd.read_sql(query, conn)
-
-
-def get_store_count_by_city(conn):
-    query = """
-        SELECT 
-            city,
-            COUNT(store_id) AS store_count
-        FROM dim_stores
-        GROUP BY city
-        ORDER BY store_count DESC;
-    """
-    return pd.read_sql(query, conn)
-
-
-def get_top_2_promo_types_by_ir(conn):
-    query = """
-        SELECT 
-            promo_type,
-            SUM(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") * base_price) AS incremental_revenue
-        FROM fact_events
-        GROUP BY promo_type
-        ORDER BY incremental_revenue DESC
-        LIMIT 2;
-    """
-    return pd.read_sql(query, conn)
-
-
-def get_bottom_2_promo_types_by_isu(conn):
-    query = """
-        SELECT 
-            promo_type,
-            SUM("quantity_sold(after_promo)" - "quantity_sold(before_promo)") AS incremental_sold_units
-        FROM fact_events
-        GROUP BY promo_type
-        ORDER BY incremental_sold_units ASC
-        LIMIT 2;
-    """
-    return pd.read_sql(query, conn)
-
-
-
-
-def get_sales_lift_by_category(conn):
-    query = """
-        SELECT 
-            p.category,
-            SUM(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") AS total_sold_lift
-        FROM fact_events e
-        JOIN dim_products p ON e.product_code = p.product_code
-        GROUP BY p.category
-        ORDER BY total_sold_lift DESC;
-    """
-    return pd.read_sql(query, conn)
-
-
-def get_top_10_products_by_lift(conn):
-    query = """
-        SELECT 
-            p.product_name,
-            SUM(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") AS sold_lift
-        FROM fact_events e
-        JOIN dim_products p ON e.product_code = p.product_code
-        GROUP BY p.product_name
-        ORDER BY sold_lift DESC
-        LIMIT 10;
-    """
-    return pd.read_sql(query, conn)
-
-
-def get_bottom_10_products_by_lift(conn):
-    query = """
-        SELECT 
-            p.product_name,
-            SUM(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") AS sold_lift
-        FROM fact_events e
-        JOIN dim_products p ON e.product_code = p.product_code
-        GROUP BY p.product_name
-        ORDER BY sold_lift ASC
-        LIMIT 10;
-    """
-    return pd.read_sql(query, conn)
-
-
-def get_category_promo_effectiveness(conn):
-    query = """
-        SELECT 
-            p.category,
-            e.promo_type,
-            SUM(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") AS sold_lift
-        FROM fact_events e
-        JOIN dim_products p ON e.product_code = p.product_code
-        GROUP BY p.category, e.promo_type
-        ORDER BY p.category, sold_lift DESC;
-    """
-    return pd.read_sql(query, conn)
-
-
-
-def get_balanced_promotions(conn):
-    query = """
+    return _POOL.get()
+
+
+# Swaps the pool get_connection and run_queries use by default. Anything with
+# get() and close_all() will do, e.g. snapshot_backend.SnapshotPool.
+def set_default_pool(pool):
+    global _POOL
+    _POOL = pool
+
+
+# Batch execution
+# Independent query functions run concurrently on a shared thread pool, each
+# worker on its own pooled read-only connection. SQLite releases the GIL while
+# a statement runs, so a batch takes about as long as its slowest query.
+
+BATCH_MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _executor():
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='query_engine')
+        return _EXECUTOR
+
+
+def _run_pooled(query, pool):
+    return query(pool.get())
+
+
+# Runs each `query(conn)` (a metric function or a functools.partial of one)
+# and returns their results in the same order. Connections come from `pool`
+# (the dashboard database's pool by default).
+def run_queries(queries, pool=None):
+    pool = pool or _POOL
+    queries = list(queries)
+    # one scan per filter set, at the grain all of the batch's metrics roll up from
+    prefetch_queries(pool.get(), queries)
+    futures = [_executor().submit(_run_pooled, query, pool) for query in queries]
+    return [future.result() for future in futures]
+
+
+# Columnar fetch
+# pd.read_sql fetches every result row as a tuple, lays the rows out as one 2-D
+# object array and converts each column back out of it. read_frame fetches
+# FETCH_BATCH_ROWS rows at a time instead and transposes each batch straight
+# into one typed buffer per column (int64 or float64 for numbers, object for
+# text), so numbers never pass through an object array and the full list of
+# row tuples never exists. Small batches keep the tuples being transposed in
+# cache; the buffers are concatenated once per frame and the DataFrame is built
+# on them without another copy. Columns and dtypes are the same as pd.read_sql's.
+
+FETCH_BATCH_ROWS = 512
+
+
+def _column_buffer(values):
+    if isinstance(values[0], str):
+        return np.array(values, dtype=object)
+    buffer = np.array(values)
+    # NULLs, blobs or mixed types: the raw values, for _concat_column to infer
+    return buffer if buffer.dtype.kind in 'iuf' else values
+
+
+# Column buffers for up to max_rows more rows of the cursor (all of them if
+# max_rows is None), or None once it is exhausted
+def _fetch_columns(cursor, width, max_rows=None):
+    buffers = [[] for _ in range(width)]
+    fetched = 0
+    while max_rows is None or fetched < max_rows:
+        rows = cursor.fetchmany(FETCH_BATCH_ROWS if max_rows is None else min(FETCH_BATCH_ROWS, max_rows - fetched))
+        if not rows:
+            break
+        fetched += len(rows)
+        for buffer, values in zip(buffers, zip(*rows)):
+            buffer.append(_column_buffer(values))
+    if not fetched:
+        return None
+    return [_concat_column(buffer) for buffer in buffers]
+
+
+def _concat_column(pieces):
+    if any(isinstance(piece, tuple) for piece in pieces):
+        # pandas infers the whole column at once, as read_sql does
+        return pd.Series([value for piece in pieces
+                          for value in (piece if isinstance(piece, tuple) else piece.tolist())]).to_numpy()
+    return np.concatenate(pieces) if len(pieces) > 1 else pieces[0]
+
+
+def _frame(names, columns, parse_dates=None):
+    frame = pd.DataFrame(dict(zip(names, columns)), copy=False)
+    for name in parse_dates or ():
+        frame[name] = pd.to_datetime(frame[name], errors='coerce')
+    return frame
+
+
+# The result of `query` as one DataFrame
+def read_frame(conn, query, params=(), parse_dates=None):
+    cursor = conn.execute(query, params)
+    names = [column[0] for column in cursor.description]
+    columns = _fetch_columns(cursor, len(names))
+    if columns is None:
+        columns = [np.array([], dtype=object) for _ in names]
+    return _frame(names, columns, parse_dates)
+
+
+# The result of `query` as DataFrames of up to chunksize rows each, for
+# results too large to hold at once
+def read_frames(conn, query, chunksize, params=(), parse_dates=None):
+    cursor = conn.execute(query, params)
+    names = [column[0] for column in cursor.description]
+    while True:
+        columns = _fetch_columns(cursor, len(names), chunksize)
+        if columns is None:
+            return
+        yield _frame(names, columns, parse_dates)
+
+
+# Shared aggregation layer
+# The fact table is scanned once at the finest grain the dashboard needs
+# (store x product x campaign x promo_type). Every metric function rolls that
+# result up to its own grain in pandas, so one page load costs one fact scan
+# instead of one per query. When the loader has materialized rollup tables for
+# the current load, grains are read from those instead of the fact table.
+# Results are shared between connections to the same database and dropped as
+# soon as the database changes.
+
+# Storage backends
+# Metric functions take either a sqlite3 connection or a backend object (see
+# parquet_backend.py) with:
+#   identity          a string naming the dataset, used in cache keys
+#   data_version()    changes whenever the stored data does
+#   scan(filters)     the base-grain frame (BASE_GRAIN + BASE_MEASURES) for
+#                     normalized FACT_FILTERS
+#   dimensions()      {'dim_stores', 'dim_products', 'dim_campaigns'} frames
+# Only SQLite has materialized rollups; set USE_ROLLUPS = False to make it scan
+# fact_events too (useful when benchmarking backends against each other).
+
+USE_ROLLUPS = True
+
+BASE_GRAIN = ['store_id', 'product_code', 'campaign_id', 'promo_type']
+BASE_MEASURES = ['event_count', 'units_before', 'units_after', 'incremental_units', 'incremental_revenue']
+
+# Columns that come from a dimension table; asking for one of them behaves
+# like an inner JOIN against that dimension.
+DIMENSION_COLUMNS = {
+    'city': 'dim_stores',
+    'product_name': 'dim_products',
+    'category': 'dim_products',
+    'campaign_name': 'dim_campaigns',
+}
+DIMENSION_KEYS = {
+    'dim_stores': 'store_id',
+    'dim_products': 'product_code',
+    'dim_campaigns': 'campaign_id',
+}
+
+# Materialized rollups written by load_data_to_sqlite.py, smallest first.
+# A grain is answered from the first rollup that carries all of its columns.
+ROLLUP_TABLES = {
+    'rollup_promo_type': ['promo_type'],
+    'rollup_campaign': ['campaign_id', 'campaign_name'],
+    'rollup_category': ['category'],
+    'rollup_category_promo_type': ['category', 'promo_type'],
+    'rollup_store': ['store_id', 'city'],
+    'rollup_product': ['product_code', 'product_name', 'category'],
+    'rollup_product_promo_type': ['product_code', 'product_name', 'category', 'promo_type'],
+    'rollup_base': ['store_id', 'product_code', 'campaign_id', 'promo_type'],
+}
+
+_AGGREGATE_CACHE = {}
+_AGGREGATE_CACHE_SIZE = 8
+_AGGREGATE_CACHE_LOCK = threading.Lock()
+
+
+# Connections to the same database file share one entry, keyed on the load
+# generation, so parallel queries on pooled connections still share a single
+# fact scan. Without a generation (or for in-memory databases) the entry is
+# private to the connection and keyed on SQLite's own change counters.
+def _aggregate_entry(conn):
+    version = data_version(conn)
+    database = _database_file(conn)
+    owner = None
+    if version is None or not database:
+        # data_version moves when another connection commits, total_changes when this one does
+        version = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+        database = id(conn)
+        # the connection is kept in the entry so its id cannot be reused while cached
+        owner = conn
+    with _AGGREGATE_CACHE_LOCK:
+        entry = _AGGREGATE_CACHE.get(database)
+        if entry is None or entry['owner'] is not owner or entry['version'] != version:
+            if entry is None and len(_AGGREGATE_CACHE) >= _AGGREGATE_CACHE_SIZE:
+                _AGGREGATE_CACHE.pop(next(iter(_AGGREGATE_CACHE)))
+            entry = {'owner': owner, 'version': version, 'grains': {}, 'lock': threading.Lock()}
+            _AGGREGATE_CACHE[database] = entry
+    return entry
+
+
+def clear_aggregate_cache():
+    _AGGREGATE_CACHE.clear()
+
+
+# Filters every metric function accepts. Each value is a single string or a
+# list of strings; the lists are bound as one JSON array parameter, so the SQL
+# text only depends on which filters are active and sqlite3's statement cache
+# reuses the prepared statement. Each clause restricts a leading column of one
+# of the covering fact indexes, so only the filtered slice is scanned.
+#
+# start_date and end_date take one date each (a datetime.date or an ISO
+# "YYYY-MM-DD" string) and select the campaigns whose window overlaps
+# [start_date, end_date]. fact_events has no time column of its own: every
+# event belongs to its campaign's window, so a date range prunes to whole
+# campaigns and the scan costs as much as the campaigns in the window.
+FACT_FILTERS = {
+    'campaign': "campaign_key IN (SELECT campaign_key FROM dim_campaigns WHERE campaign_id IN (SELECT value FROM json_each(?)))",
+    'start_date': "campaign_key IN (SELECT campaign_key FROM dim_campaigns WHERE end_date >= (SELECT value FROM json_each(?)))",
+    'end_date': "campaign_key IN (SELECT campaign_key FROM dim_campaigns WHERE start_date <= (SELECT value FROM json_each(?)))",
+    'city': "store_key IN (SELECT store_key FROM dim_stores WHERE city IN (SELECT value FROM json_each(?)))",
+    'category': "product_key IN (SELECT product_key FROM dim_products WHERE category IN (SELECT value FROM json_each(?)))",
+    'promo_type': "promo_type IN (SELECT value FROM json_each(?))",
+}
+DATE_FILTERS = ('start_date', 'end_date')
+# Filters that only ever select whole campaigns
+CAMPAIGN_FILTERS = ('campaign',) + DATE_FILTERS
+# dim_campaigns columns the loader stores as ISO dates; read back as datetime64
+CAMPAIGN_DATE_COLUMNS = ['start_date', 'end_date']
+
+
+# Turns filter keyword arguments into a hashable, order-independent tuple
+def normalize_filters(filters):
+    normalized = []
+    for name, values in filters.items():
+        if name not in FACT_FILTERS:
+            raise ValueError(f"unknown filter {name!r}; expected one of {', '.join(FACT_FILTERS)}")
+        if values is None:
+            continue
+        if name in DATE_FILTERS:
+            values = [_iso_date(values)]
+        elif isinstance(values, str):
+            values = [values]
+        values = tuple(sorted(set(values)))
+        if values:
+            normalized.append((name, values))
+    return tuple(sorted(normalized))
+
+
+def _iso_date(value):
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        raise ValueError(f"expected a date or an ISO 'YYYY-MM-DD' string, got {value!r}") from None
+
+
+# True when normalized `filters` only select whole campaigns
+def _campaign_only(filters):
+    return all(name in CAMPAIGN_FILTERS for name, _ in filters)
+
+
+# campaign_ids of `campaigns` (a dim_campaigns frame) selected by the campaign
+# and date filters among normalized `filters`
+def select_campaigns(campaigns, filters):
+    selected = pd.Series(True, index=campaigns.index)
+    for name, values in filters:
+        if name == 'campaign':
+            selected &= campaigns['campaign_id'].isin(values)
+        elif name == 'start_date':
+            selected &= campaigns['end_date'] >= pd.Timestamp(values[0])
+        elif name == 'end_date':
+            selected &= campaigns['start_date'] <= pd.Timestamp(values[0])
+    return campaigns.loc[selected, 'campaign_id'].tolist()
+
+
+# Metric definitions
+# Each measure is declared once: the base measures as SQL summed over fact
+# rows, the derived ones as ratios of base measures taken after a grain is
+# summed. A Metric declares the grain it is computed at, the measures it
+# reports (under its own column names) and how its rows are filtered, ordered
+# and cut, and the metric functions below evaluate their METRIC_DEFINITIONS
+# entry rather than repeating the expressions. compile_grain_query turns any
+# grain and filters into one statement over the star schema carrying every
+# base measure; plan_queries merges the grains of a batch of metrics into the
+# one grain they all roll up from, so a batch costs one scan and a metric
+# added to it adds none.
+
+BASE_MEASURE_SQL = {
+    'event_count': "COUNT(*)",
+    'units_before': "SUM(quantity_sold_before_promo)",
+    'units_after': "SUM(quantity_sold_after_promo)",
+    'incremental_units': "SUM(quantity_sold_after_promo - quantity_sold_before_promo)",
+    'incremental_revenue': "SUM((quantity_sold_after_promo - quantity_sold_before_promo) * base_price)",
+}
+# measure -> (numerator, denominator), both base measures
+DERIVED_MEASURES = {
+    'avg_units_lift': ('incremental_units', 'event_count'),
+    'avg_revenue_lift': ('incremental_revenue', 'event_count'),
+}
+# Surrogate key and alias each dimension is joined on in compiled scans
+DIMENSION_JOINS = {
+    'dim_stores': ('store_key', 's'),
+    'dim_products': ('product_key', 'p'),
+    'dim_campaigns': ('campaign_key', 'c'),
+}
+
+
+class Metric:
+    # `columns` maps each reported column to a measure; `where` is a condition
+    # on the reported columns (DataFrame.query syntax); rows are sorted on
+    # `order` (a column or a list of them) with `ascending` as sort_values
+    # takes it, and rounded to `decimals` first when given
+    def __init__(self, grain, columns, where=None, order=None, ascending=False, decimals=None):
+        self.grain = tuple(grain)
+        self.columns = dict(columns)
+        self.where = where
+        self.order = order
+        self.ascending = ascending
+        self.decimals = decimals
+
+    # The metric's rows from `frame`, the summed grain; the first `n` when given
+    def evaluate(self, frame, n=None):
+        df = frame[list(self.grain) + list(self.columns.values())]
+        df = df.set_axis(list(self.grain) + list(self.columns), axis=1)
+        if self.decimals is not None:
+            df = df.round(self.decimals)
+        if self.where is not None:
+            df = df.query(self.where)
+        if self.order is not None:
+            df = df.sort_values(self.order, ascending=self.ascending, kind='mergesort')
+        if n is not None:
+            df = df.head(n)
+        return df.reset_index(drop=True)
+
+
+# Every grain-based metric, by the name export_metrics.py and query_service.py use
+METRIC_DEFINITIONS = {
+    'overall_kpis': Metric(['campaign_id', 'campaign_name'], {
+        'units_before': 'units_before', 'units_after': 'units_after', 'incremental_revenue': 'incremental_revenue',
+    }),
+    'top_stores_by_ir': Metric(['store_id', 'city'], {'incremental_revenue': 'incremental_revenue'},
+                               order='incremental_revenue'),
+    'bottom_stores_by_isu': Metric(['store_id', 'city'], {'incremental_sold_units': 'incremental_units'},
+                                   order='incremental_sold_units', ascending=True),
+    'top_promo_types_by_ir': Metric(['promo_type'], {'incremental_revenue': 'incremental_revenue'},
+                                    order='incremental_revenue'),
+    'bottom_promo_types_by_isu': Metric(['promo_type'], {'incremental_sold_units': 'incremental_units'},
+                                        order='incremental_sold_units', ascending=True),
+    'balanced_promotions': Metric(['promo_type'], {
+        'avg_units_lift': 'avg_units_lift', 'avg_revenue_lift': 'avg_revenue_lift',
+    }, where='avg_units_lift > 0 and avg_revenue_lift > 0', order=['avg_units_lift', 'avg_revenue_lift']),
+    'category_wise_sales_lift': Metric(['category'], {'sales_lift': 'incremental_units'}, order='sales_lift'),
+    'product_response_analysis': Metric(['product_name', 'category', 'promo_type'],
+                                        {'total_lift': 'incremental_units'}, order='total_lift'),
+    'discount_vs_bogof_cashback': Metric(['promo_type'], {'incremental_revenue': 'incremental_revenue'}),
+    'top_categories_by_lift': Metric(['category'], {
+        'total_units_lift': 'incremental_units', 'total_revenue_lift': 'incremental_revenue',
+    }, order='total_units_lift', decimals=2),
+    'best_performing_products': Metric(['product_name'], {
+        'units_lift': 'incremental_units', 'revenue_lift': 'incremental_revenue',
+    }, where='units_lift > 0 and revenue_lift > 0', order='revenue_lift', decimals=2),
+    'worst_performing_products': Metric(['product_name'], {
+        'units_lift': 'incremental_units', 'revenue_lift': 'incremental_revenue',
+    }, where='units_lift < 0 or revenue_lift < 0', order='revenue_lift', ascending=True, decimals=2),
+    'category_promo_correlation': Metric(['category', 'promo_type'], {
+        'avg_units_lift': 'avg_units_lift', 'avg_revenue_lift': 'avg_revenue_lift',
+    }, decimals=2),
+    'top_products_by_lift': Metric(['product_name'], {'sold_lift': 'incremental_units'}, order='sold_lift'),
+    'bottom_products_by_lift': Metric(['product_name'], {'sold_lift': 'incremental_units'}, order='sold_lift',
+                                      ascending=True),
+    'category_promo_effectiveness': Metric(['category', 'promo_type'], {'sold_lift': 'incremental_units'},
+                                           order=['category', 'sold_lift'], ascending=[True, False]),
+}
+
+
+# Marks a metric function as evaluating METRIC_DEFINITIONS[name], so batches
+# of them can be planned (the attribute survives functools.wraps)
+def metric(name):
+    def decorate(func):
+        func.metric = METRIC_DEFINITIONS[name]
+        return func
+    return decorate
+
+
+def _add_derived_measures(df):
+    for measure, (numerator, denominator) in DERIVED_MEASURES.items():
+        df[measure] = df[numerator] / df[denominator]
+    return df
+
+
+# The dimension table a grain column is read from; None for fact columns (promo_type)
+def _column_table(column):
+    if column in DIMENSION_COLUMNS:
+        return DIMENSION_COLUMNS[column]
+    return next((table for table, key in DIMENSION_KEYS.items() if key == column), None)
+
+
+# One statement summing every base measure over `grain` for the fact rows
+# matching normalized `filters`. The GROUP BY runs on the integer surrogate
+# keys, which the covering fact indexes carry, and the dimension columns are
+# joined back on the grouped result; when the grain holds dimension attributes
+# (city, category, ...) the joined groups are summed again at the grain.
+def compile_grain_query(grain, filters=()):
+    column_tables = [_column_table(column) for column in grain]
+    tables = list(dict.fromkeys(table for table in column_tables if table))
+    fact_columns = [column for column, table in zip(grain, column_tables) if table is None]
+    clauses = [FACT_FILTERS[name] for name, _ in filters]
+    params = [json.dumps(list(values)) for _, values in filters]
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    regroup = any(column in DIMENSION_COLUMNS for column in grain)
+
+    group = [DIMENSION_JOINS[table][0] for table in tables] + fact_columns
+    select = [f"{DIMENSION_JOINS[table][1]}.{column}" if table else f"g.{column}"
+              for column, table in zip(grain, column_tables)]
+    measures = [f"SUM(g.{measure}) AS {measure}" if regroup else f"g.{measure}" for measure in BASE_MEASURES]
+    joins = [f"JOIN {table} {alias} ON {alias}.{key} = g.{key}"
+             for table, (key, alias) in DIMENSION_JOINS.items() if table in tables]
+    select_sql = ",\n        ".join(select + measures)
+    group_sql = ",\n            ".join(group + [f"{BASE_MEASURE_SQL[measure]} AS {measure}" for measure in BASE_MEASURES])
+    joins_sql = "\n    ".join(joins)
+    query = f"""
     SELECT
-        promo_type,
-        AVG("quantity_sold(after_promo)" - "quantity_sold(before_promo)") AS avg_units_lift,
-        AVG(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") * base_price) AS avg_revenue_lift
-    FROM fact_events
-    GROUP BY promo_type
-    HAVING avg_units_lift > 0 AND avg_revenue_lift > 0
-    ORDER BY avg_units_lift DESC, avg_revenue_lift DESC;
-    """
-
-    return pd.read_sql(query, conn)
-
-
-def get_category_wise_sales_lift(conn):
-    query = """
-        SELECT 
-            p.category,
-            SUM("quantity_sold(after_promo)" - "quantity_sold(before_promo)") AS sales_lift
-        FROM fact_events e
-        JOIN dim_products p ON e.product_code = p.product_code
-        GROUP BY p.category
-        ORDER BY sales_lift DESC;
-    """
-    return pd.read_sql(query, conn)
-
-
-def get_product_response_analysis(conn):
-    query = """
-        SELECT 
-            p.product_name,
-            p.category,
-            e.promo_type,
-            SUM("quantity_sold(after_promo)" - "quantity_sold(before_promo)") AS total_lift
-        FROM fact_events e
-        JOIN dim_products p ON e.product_code = p.product_code
-        GROUP BY p.product_name, p.category, e.promo_type
-        ORDER BY total_lift DESC;
-    """
-    return pd.read_sql(query, conn)
+        {select_sql}
+    FROM (
+        SELECT
+            {group_sql}
+        FROM fact_events
+        {where}
+        GROUP BY {', '.join(group)}
+    ) g
+    {joins_sql}
+"""
+    if regroup:
+        query += f"    GROUP BY {', '.join(select)}\n"
+    return query, params
 
 
-import pandas as pd
+# Base-grain scan of the star schema
+def fact_scan_query(filters=()):
+    return compile_grain_query(BASE_GRAIN, filters)
 
-def get_overall_kpis(conn):
-    query = """
-        WITH campaign_summary AS (
-            SELECT 
-                c.campaign_id,
-                SUM(e."quantity_sold(before_promo)") AS units_before,
-                SUM(e."quantity_sold(after_promo)") AS units_after,
-                SUM(
-                    (e."quantity_sold(after_promo)" - e."quantity_sold(before_promo)") * e.base_price
-                ) AS incremental_revenue
-            FROM fact_events e
-            JOIN dim_campaigns c ON e.campaign_id = c.campaign_id
-            GROUP BY c.campaign_id
-        )
+
+def _scan_fact_events(conn, filters=()):
+    if not _is_sqlite(conn):
+        return conn.scan(filters)
+    query, params = fact_scan_query(filters)
+    return read_frame(conn, query, params)
+
+
+def _is_sqlite(conn):
+    return isinstance(conn, sqlite3.Connection)
+
+
+def _dimension_tables(grain):
+    return list(dict.fromkeys(DIMENSION_COLUMNS[col] for col in grain if col in DIMENSION_COLUMNS))
+
+
+def _rollup_sql(columns):
+    tables = _dimension_tables(columns)
+    aliases = {table: f"d{i}" for i, table in enumerate(tables)}
+    select = [f"{aliases[DIMENSION_COLUMNS[col]]}.{col}" if col in DIMENSION_COLUMNS else f"b.{col}" for col in columns]
+    joins = [f"JOIN {table} {aliases[table]} ON b.{DIMENSION_KEYS[table]} = {aliases[table]}.{DIMENSION_KEYS[table]}"
+             for table in tables]
+    measures = [f"SUM(b.{measure}) AS {measure}" for measure in BASE_MEASURES]
+    return (
+        f"SELECT {', '.join(select + measures)} FROM rollup_base b {' '.join(joins)} "
+        f"GROUP BY {', '.join(select)}"
+    )
+
+
+def _read_metadata(conn):
+    try:
+        return dict(conn.execute("SELECT key, value FROM etl_metadata;").fetchall())
+    except sqlite3.OperationalError:
+        return {}
+
+
+def _write_metadata(conn, key, value):
+    conn.execute("CREATE TABLE IF NOT EXISTS etl_metadata (key TEXT PRIMARY KEY, value INTEGER)")
+    conn.execute("INSERT OR REPLACE INTO etl_metadata (key, value) VALUES (?, ?)", (key, value))
+
+
+# Called by the loader inside the transaction that writes the raw tables, so
+# the generation changes exactly when the data does: rollups built for an
+# earlier load stop being current and cached results stop matching. The
+# generation restarts at 1 in a recreated database, so every load also gets a
+# random load_id (63 bits, to fit the INTEGER column) that data_version
+# includes.
+def bump_load_generation(conn):
+    generation = _read_metadata(conn).get('load_generation', 0) + 1
+    _write_metadata(conn, 'load_generation', generation)
+    _write_metadata(conn, 'load_id', uuid.uuid4().int >> 65)
+    return generation
+
+
+def build_rollup_tables(conn):
+    conn.execute("BEGIN")
+    try:
+        for table in ROLLUP_TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"CREATE TABLE rollup_base AS {fact_scan_query()[0]}")
+        # campaign and date filters read only their campaigns' rows
+        conn.execute("CREATE INDEX idx_rollup_base_campaign ON rollup_base (campaign_id)")
+        for table, columns in ROLLUP_TABLES.items():
+            if table != 'rollup_base':
+                conn.execute(f"CREATE TABLE {table} AS {_rollup_sql(columns)}")
+        _write_metadata(conn, 'rollup_generation', _read_metadata(conn).get('load_generation', 0))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# Campaign KPI summary
+# The overview totals per campaign, kept by the loader inside its data
+# transaction: a full load rebuilds the table, an incremental merge adds the
+# staged rows and subtracts the rows they replace. get_overall_kpis reads it
+# instead of aggregating the fact table, so its cost does not grow with history.
+KPI_SUMMARY_SCHEMA = """CREATE TABLE IF NOT EXISTS kpi_campaign_summary (
+    campaign_key INTEGER PRIMARY KEY,
+    event_count INTEGER NOT NULL,
+    units_before INTEGER NOT NULL,
+    units_after INTEGER NOT NULL,
+    incremental_revenue INTEGER NOT NULL
+)"""
+
+
+def kpi_summary_current(conn):
+    metadata = _read_metadata(conn)
+    return 'kpi_generation' in metadata and metadata['kpi_generation'] == metadata.get('load_generation')
+
+
+def rebuild_kpi_summary(conn):
+    conn.execute("DROP TABLE IF EXISTS kpi_campaign_summary")
+    conn.execute(KPI_SUMMARY_SCHEMA)
+    conn.execute("""
+        INSERT INTO kpi_campaign_summary
+        SELECT
+            campaign_key,
+            COUNT(*),
+            SUM(quantity_sold_before_promo),
+            SUM(quantity_sold_after_promo),
+            SUM((quantity_sold_after_promo - quantity_sold_before_promo) * base_price)
+        FROM fact_events
+        GROUP BY campaign_key
+    """)
+    _write_metadata(conn, 'kpi_generation', _read_metadata(conn).get('load_generation', 0))
+
+
+# `staged` is a subquery of incoming fact rows (event_id, campaign_key,
+# base_price and the two quantities). Must run before they are merged into
+# fact_events, while the rows they replace are still there.
+def apply_kpi_delta(conn, staged):
+    conn.execute(f"""
+        INSERT INTO kpi_campaign_summary
         SELECT
-            COUNT(*) AS total_campaigns,
-            SUM(units_before) AS total_units_before,
-            SUM(units_after) AS total_units_after,
-            SUM(units_after - units_before) AS incremental_units,
-            SUM(incremental_revenue) AS incremental_revenue,
-            AVG(units_after - units_before) AS avg_lift_per_campaign
-        FROM campaign_summary;
-    """
-    df = pd.read_sql(query, conn)
-    return df.iloc[0].to_dict()
-
-def get_discount_vs_bogof_cashback(conn):
-    query = """
-        SELECT 
-            CASE
-                WHEN LOWER(promo_type) LIKE 'discount%' THEN 'Discount'
-                WHEN LOWER(promo_type) = 'bogof' THEN 'BOGOF'
-                WHEN LOWER(promo_type) = 'cashback' THEN 'Cashback'
-                ELSE 'Other'
-            END AS promo_type_group,
-            SUM(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") * base_price) AS incremental_revenue
+            campaign_key,
+            SUM(sign),
+            SUM(sign * quantity_sold_before_promo),
+            SUM(sign * quantity_sold_after_promo),
+            SUM(sign * (quantity_sold_after_promo - quantity_sold_before_promo) * base_price)
+        FROM (
+            SELECT 1 AS sign, campaign_key, base_price, quantity_sold_before_promo, quantity_sold_after_promo
+            FROM {staged}
+            UNION ALL
+            SELECT -1, campaign_key, base_price, quantity_sold_before_promo, quantity_sold_after_promo
+            FROM fact_events
+            WHERE event_id IN (SELECT event_id FROM {staged})
+        )
+        GROUP BY campaign_key
+        ON CONFLICT (campaign_key) DO UPDATE SET
+            event_count = event_count + excluded.event_count,
+            units_before = units_before + excluded.units_before,
+            units_after = units_after + excluded.units_after,
+            incremental_revenue = incremental_revenue + excluded.incremental_revenue
+    """)
+    conn.execute("DELETE FROM kpi_campaign_summary WHERE event_count = 0")
+    _write_metadata(conn, 'kpi_generation', _read_metadata(conn).get('load_generation', 0))
+
+
+def _kpi_summary(conn):
+    if not USE_ROLLUPS or not _is_sqlite(conn) or not kpi_summary_current(conn):
+        return None
+    return read_frame(conn, """
+        SELECT c.campaign_id, c.campaign_name, k.units_before, k.units_after, k.incremental_revenue
+        FROM kpi_campaign_summary k
+        JOIN dim_campaigns c ON c.campaign_key = k.campaign_key
+    """)
+
+
+# Approximate rankings
+# The ranking functions can answer from Space-Saving sketches instead of
+# grouping every event (mode='approx'). The loader keeps one sketch pair per
+# ranked dimension and measure: one over positive contributions and one over
+# the magnitude of negative ones, since the measures can be negative and
+# Space-Saving only counts up. Replaced rows in an incremental merge go in as
+# opposite-sign contributions, so both sketches only grow.
+#
+# The loader already has each batch's exact per-item totals, so a batch is
+# summarized by its SKETCH_CAPACITY largest items with no error, and that
+# summary is merged into the stored sketch the way mergeable Space-Saving
+# merges two sketches. Each sketch overestimates an item by at most its
+# recorded error, and an item it does not monitor has a true count no larger
+# than its smallest counter (0 while it has free counters). The net estimate
+# is positive minus negative, and the true value lies in [estimate - positive
+# error, estimate + negative error]. Every item is exact while a dimension has
+# no more than SKETCH_CAPACITY members, and after a full load the
+# SKETCH_CAPACITY largest items of each side are.
+#
+# Only top-N rankings have an approx mode: the sketches keep the largest
+# items, so they cannot bound which items are the smallest.
+
+SKETCH_CAPACITY = 256
+RANKING_MODES = ('exact', 'approx')
+
+SKETCH_SCHEMA = """CREATE TABLE IF NOT EXISTS ranking_sketches (
+    metric TEXT NOT NULL,
+    side TEXT NOT NULL,
+    item TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    error INTEGER NOT NULL,
+    PRIMARY KEY (metric, side, item)
+)"""
+# ranked dimension -> (join from fact_events, item column)
+SKETCH_DIMENSIONS = {
+    'store_id': ("JOIN dim_stores d ON d.store_key = f.store_key", "d.store_id"),
+    'product_code': ("JOIN dim_products d ON d.product_key = f.product_key", "d.product_code"),
+    'promo_type': ("", "f.promo_type"),
+}
+SKETCH_MEASURES = ['incremental_units', 'incremental_revenue']
+
+
+class SpaceSaving:
+    # Space-Saving summary: at most `capacity` counters of [count, error]
+
+    def __init__(self, capacity=SKETCH_CAPACITY, counters=None):
+        self.capacity = capacity
+        self.counters = {item: list(counter) for item, counter in (counters or {}).items()}
+        full = len(self.counters) >= capacity
+        self._min_count = min(count for count, _ in self.counters.values()) if full else 0
+
+    # Exact summary of one batch's per-item totals: its `capacity` largest
+    # positive items. Every item left out is no larger than the smallest one
+    # kept, so the unmonitored-item bound holds with no error at all.
+    @classmethod
+    def from_totals(cls, items, totals, capacity=SKETCH_CAPACITY):
+        positive = [(total, item) for item, total in zip(items, totals) if total > 0]
+        kept = heapq.nlargest(capacity, positive)
+        return cls(capacity, {item: (total, 0) for total, item in kept})
+
+    def min_count(self):
+        return self._min_count
+
+    # (count, error): the true count lies in [count - error, count]
+    def estimate(self, item):
+        counter = self.counters.get(item)
+        if counter is None:
+            floor = self.min_count()
+            return floor, floor
+        return tuple(counter)
+
+    # Sketch of both streams together. Items one side does not monitor are
+    # counted at that side's bound, so the result keeps the same guarantees.
+    def merge(self, other):
+        merged = {}
+        for item in set(self.counters) | set(other.counters):
+            count, error = self.estimate(item)
+            other_count, other_error = other.estimate(item)
+            merged[item] = [count + other_count, error + other_error]
+        kept = heapq.nlargest(self.capacity, merged.items(), key=lambda entry: (entry[1][0], entry[0]))
+        return SpaceSaving(self.capacity, dict(kept))
+
+
+def ranking_sketches_current(conn):
+    metadata = _read_metadata(conn)
+    return 'sketch_generation' in metadata and metadata['sketch_generation'] == metadata.get('load_generation')
+
+
+def _sketch_metric(dimension, measure):
+    return f"{dimension}.{measure}"
+
+
+def _read_sketch(conn, metric, side):
+    rows = conn.execute("SELECT item, count, error FROM ranking_sketches WHERE metric = ? AND side = ?", (metric, side))
+    return SpaceSaving(SKETCH_CAPACITY, {item: (count, error) for item, count, error in rows})
+
+
+def _write_sketch(conn, metric, side, sketch):
+    conn.execute("DELETE FROM ranking_sketches WHERE metric = ? AND side = ?", (metric, side))
+    conn.executemany(
+        "INSERT INTO ranking_sketches (metric, side, item, count, error) VALUES (?, ?, ?, ?, ?)",
+        [(metric, side, item, count, error) for item, (count, error) in sketch.counters.items()],
+    )
+
+
+# `source` is a subquery of signed fact rows (sign, store_key, product_key,
+# promo_type, base_price and the two quantities). Its per-item net totals are
+# sketched and merged into the stored sketches.
+def _merge_sketch_batch(conn, source, replace=False):
+    conn.execute(SKETCH_SCHEMA)
+    for dimension, (join, item) in SKETCH_DIMENSIONS.items():
+        batch = read_frame(conn, f"""
+            SELECT
+                {item} AS item,
+                SUM(f.sign * (f.quantity_sold_after_promo - f.quantity_sold_before_promo)) AS incremental_units,
+                SUM(f.sign * (f.quantity_sold_after_promo - f.quantity_sold_before_promo) * f.base_price)
+                    AS incremental_revenue
+            FROM {source} f
+            {join}
+            GROUP BY {item}
+        """)
+        for measure in SKETCH_MEASURES:
+            metric = _sketch_metric(dimension, measure)
+            items, totals = batch['item'].tolist(), batch[measure].tolist()
+            sides = {
+                'positive': SpaceSaving.from_totals(items, totals),
+                'negative': SpaceSaving.from_totals(items, [-total for total in totals]),
+            }
+            for side, sketch in sides.items():
+                if not replace:
+                    sketch = _read_sketch(conn, metric, side).merge(sketch)
+                _write_sketch(conn, metric, side, sketch)
+    _write_metadata(conn, 'sketch_generation', _read_metadata(conn).get('load_generation', 0))
+
+
+def rebuild_ranking_sketches(conn):
+    conn.execute("DROP TABLE IF EXISTS ranking_sketches")
+    _merge_sketch_batch(conn, """(
+        SELECT 1 AS sign, store_key, product_key, promo_type, base_price,
+               quantity_sold_before_promo, quantity_sold_after_promo
+        FROM fact_events
+    )""", replace=True)
+
+
+# Like apply_kpi_delta: must run before the staged rows are merged into fact_events
+def apply_ranking_sketch_delta(conn, staged):
+    _merge_sketch_batch(conn, f"""(
+        SELECT 1 AS sign, store_key, product_key, promo_type, base_price,
+               quantity_sold_before_promo, quantity_sold_after_promo
+        FROM {staged}
+        UNION ALL
+        SELECT -1, store_key, product_key, promo_type, base_price,
+               quantity_sold_before_promo, quantity_sold_after_promo
         FROM fact_events
-        GROUP BY promo_type_group
-        ORDER BY incremental_revenue DESC;
-    """
-    return pd.read_sql(query, conn)
-
-def get_top_categories_by_lift(conn):
-    query = """
-        SELECT 
-            dp.category,
-            ROUND(SUM("quantity_sold(after_promo)" - "quantity_sold(before_promo)"), 2) AS total_units_lift,
-            ROUND(SUM(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") * fe.base_price), 2) AS total_revenue_lift
-        FROM fact_events fe
-        JOIN dim_products dp ON fe.product_code = dp.product_code
-        GROUP BY dp.category
-        ORDER BY total_units_lift DESC
-        LIMIT 5;
-    """
-    return pd.read_sql_query(query, conn)
-
-
-def get_best_performing_products(conn):
-    query = """
-        SELECT 
-            dp.product_name,
-            ROUND(SUM("quantity_sold(after_promo)" - "quantity_sold(before_promo)"), 2) AS units_lift,
-            ROUND(SUM(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") * fe.base_price), 2) AS revenue_lift
-        FROM fact_events fe
-        JOIN dim_products dp ON fe.product_code = dp.product_code
-        GROUP BY dp.product_name
-        HAVING units_lift > 0 AND revenue_lift > 0
-        ORDER BY revenue_lift DESC
-        LIMIT 10;
-    """
-    return pd.read_sql_query(query, conn)
-
-def get_worst_performing_products(conn):
-    query = """
-        SELECT 
-            dp.product_name,
-            ROUND(SUM("quantity_sold(after_promo)" - "quantity_sold(before_promo)"), 2) AS units_lift,
-            ROUND(SUM(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") * fe.base_price), 2) AS revenue_lift
-        FROM fact_events fe
-        JOIN dim_products dp ON fe.product_code = dp.product_code
-        GROUP BY dp.product_name
-        HAVING units_lift < 0 OR revenue_lift < 0
-        ORDER BY revenue_lift ASC
-        LIMIT 10;
-    """
-    return pd.read_sql_query(query, conn)
-
-def get_category_promo_correlation_data(conn):
-    query = """
-        SELECT 
-            dp.category,
-            fe.promo_type,
-            ROUND(AVG("quantity_sold(after_promo)" - "quantity_sold(before_promo)"), 2) AS avg_units_lift,
-            ROUND(AVG(("quantity_sold(after_promo)" - "quantity_sold(before_promo)") * fe.base_price), 2) AS avg_revenue_lift
-        FROM fact_events fe
-        JOIN dim_products dp ON fe.product_code = dp.product_code
-        GROUP BY dp.category, fe.promo_type;
-    """
-    return pd.read_sql_query(query, conn)
+        WHERE event_id IN (SELECT event_id FROM {staged})
+    )""")
+
+
+def _use_sketches(mode, filters, bottom=False):
+    if mode not in RANKING_MODES:
+        raise ValueError(f"unknown mode {mode!r}; expected one of {', '.join(RANKING_MODES)}")
+    if mode == 'approx' and bottom:
+        raise ValueError("approximate rankings only answer top-N: the sketches keep the largest items "
+                         "and cannot bound the smallest; use mode='exact'")
+    if mode == 'approx' and normalize_filters(filters):
+        raise ValueError("approximate rankings are only kept for unfiltered data; use mode='exact' with filters")
+    return mode == 'approx'
+
+
+# Estimates with bounds per item of `dimension`: one `<measure>`,
+# `<measure>_lower` and `<measure>_upper` column per measure, over every item
+# any of the sketches monitors. Falls back to exact values (with zero-width
+# bounds) when the sketches are missing or older than the data.
+def _sketch_estimates(conn, dimension, measures):
+    if not (_is_sqlite(conn) and ranking_sketches_current(conn)):
+        df = get_grain_aggregates(conn, [dimension])[[dimension] + measures].copy()
+        for measure in measures:
+            df[f'{measure}_lower'] = df[measure]
+            df[f'{measure}_upper'] = df[measure]
+        return df
+
+    sketches = {
+        measure: {side: _read_sketch(conn, _sketch_metric(dimension, measure), side)
+                  for side in ('positive', 'negative')}
+        for measure in measures
+    }
+    items = sorted(set().union(*(sketch.counters for sides in sketches.values() for sketch in sides.values())))
+    df = pd.DataFrame({dimension: items})
+    for measure, sides in sketches.items():
+        positive = [sides['positive'].estimate(item) for item in items]
+        negative = [sides['negative'].estimate(item) for item in items]
+        df[measure] = [p - n for (p, _), (n, _) in zip(positive, negative)]
+        df[f'{measure}_lower'] = [p - n - p_error for (p, p_error), (n, _) in zip(positive, negative)]
+        df[f'{measure}_upper'] = [p - n + n_error for (p, _), (n, n_error) in zip(positive, negative)]
+    return df
+
+
+def _rollups_current(conn):
+    if not USE_ROLLUPS or not _is_sqlite(conn):
+        return False
+    metadata = _read_metadata(conn)
+    return 'rollup_generation' in metadata and metadata['rollup_generation'] == metadata.get('load_generation')
+
+
+# Result cache
+# Metric results are cached process-wide, keyed on the database file, its data
+# version (the generations the loader writes to etl_metadata), the function
+# name and its parameters. A load changes the version, so a new load is never
+# answered from an older one. Databases without etl_metadata are not cached.
+
+QUERY_CACHE_MAX_ENTRIES = 256
+QUERY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_QUERY_CACHE = OrderedDict()
+_QUERY_CACHE_LOCK = threading.Lock()
+_QUERY_CACHE_VERSIONS = {}
+_QUERY_CACHE_STATS = {'hits': 0, 'misses': 0, 'bytes': 0}
+
+
+def _database_file(conn):
+    if not _is_sqlite(conn):
+        return conn.identity
+    return next((row[2] for row in conn.execute("PRAGMA database_list") if row[1] == 'main'), '')
+
+
+def data_version(conn):
+    if not _is_sqlite(conn):
+        return conn.data_version()
+    metadata = _read_metadata(conn)
+    if 'load_generation' not in metadata:
+        return None
+    return (metadata['load_generation'], metadata.get('rollup_generation'), metadata.get('load_id'))
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted(value))
+    return value
+
+
+def _result_size(result):
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=True, deep=True).sum())
+    return sys.getsizeof(result)
+
+
+# Callers get their own copy so mutating a result cannot corrupt the cache
+def _copy_result(result):
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    if isinstance(result, dict):
+        return dict(result)
+    return result
+
+
+def _evict(key):
+    _, size = _QUERY_CACHE.pop(key)
+    _QUERY_CACHE_STATS['bytes'] -= size
+
+
+def _cache_store(database, version, key, result):
+    size = _result_size(result)
+    if size > QUERY_CACHE_MAX_BYTES:
+        return
+    with _QUERY_CACHE_LOCK:
+        # drop everything cached for an older load of this database
+        if _QUERY_CACHE_VERSIONS.get(database) != version:
+            for stale in [k for k in _QUERY_CACHE if k[0] == database and k[1] != version]:
+                _evict(stale)
+            _QUERY_CACHE_VERSIONS[database] = version
+        if key in _QUERY_CACHE:
+            _evict(key)
+        _QUERY_CACHE[key] = (result, size)
+        _QUERY_CACHE_STATS['bytes'] += size
+        while len(_QUERY_CACHE) > QUERY_CACHE_MAX_ENTRIES or _QUERY_CACHE_STATS['bytes'] > QUERY_CACHE_MAX_BYTES:
+            _evict(next(iter(_QUERY_CACHE)))
+
+
+def cached_query(func):
+    @functools.wraps(func)
+    def wrapper(conn, *args, **kwargs):
+        version = data_version(conn)
+        database = _database_file(conn) if version is not None else None
+        # unversioned and in-memory databases (no file name) cannot be told apart; never cached
+        if not database:
+            return func(conn, *args, **kwargs)
+        key = (database, version, func.__name__, tuple(_freeze(arg) for arg in args),
+               tuple(sorted((k, _freeze(v)) for k, v in kwargs.items())))
+        with _QUERY_CACHE_LOCK:
+            entry = _QUERY_CACHE.get(key)
+            if entry is not None:
+                _QUERY_CACHE.move_to_end(key)
+                _QUERY_CACHE_STATS['hits'] += 1
+                _CALL_STATE.cache_hit = True
+                return _copy_result(entry[0])
+            _QUERY_CACHE_STATS['misses'] += 1
+        result = func(conn, *args, **kwargs)
+        _cache_store(database, version, key, result)
+        return _copy_result(result)
+    return wrapper
+
+
+def clear_query_cache():
+    with _QUERY_CACHE_LOCK:
+        _QUERY_CACHE.clear()
+        _QUERY_CACHE_VERSIONS.clear()
+        _QUERY_CACHE_STATS.update(hits=0, misses=0, bytes=0)
+
+
+def query_cache_info():
+    with _QUERY_CACHE_LOCK:
+        return dict(_QUERY_CACHE_STATS, entries=len(_QUERY_CACHE))
+
+
+# Instrumentation
+# Every metric function records its wall time, rows returned, whether it was
+# answered from the result cache and, on SQLite, the VM steps it took (counted
+# with a progress handler) and the EXPLAIN QUERY PLAN of each statement it ran
+# (captured with a trace callback and explained once per distinct statement).
+# Calls slower than SLOW_QUERY_MS are logged with their plans. When
+# QUERY_LOG_PATH is set every call is also appended to that file as one JSON
+# line. Both can be changed at runtime with configure_instrumentation.
+
+INSTRUMENTATION_ENABLED = os.environ.get('QUERY_ENGINE_INSTRUMENTATION', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('QUERY_ENGINE_SLOW_MS', 250))
+QUERY_LOG_PATH = os.environ.get('QUERY_ENGINE_LOG')
+
+# VM instructions between progress handler calls; steps are counted in these units
+VM_STEP_GRANULARITY = 1000
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Latencies kept per function for percentiles, and slow calls kept for the debug panel
+RECENT_CALLS_PER_FUNCTION = 1000
+SLOW_QUERIES_KEPT = 50
+# Distinct statements whose plan is remembered
+PLAN_CACHE_SIZE = 256
+
+_SLOW_LOG = logging.getLogger('query_engine.slow')
+_CALL_LOG = logging.getLogger('query_engine.calls')
+_CALL_LOG.propagate = False
+
+_STATS = {}
+_SLOW_QUERIES = deque(maxlen=SLOW_QUERIES_KEPT)
+_PLANS = OrderedDict()
+_STATS_LOCK = threading.Lock()
+_CALL_STATE = threading.local()
+
+
+def configure_instrumentation(enabled=None, slow_query_ms=None, log_path=None):
+    global INSTRUMENTATION_ENABLED, SLOW_QUERY_MS, QUERY_LOG_PATH
+    if enabled is not None:
+        INSTRUMENTATION_ENABLED = enabled
+    if slow_query_ms is not None:
+        SLOW_QUERY_MS = slow_query_ms
+    if log_path is not None:
+        QUERY_LOG_PATH = log_path
+        _open_call_log()
+
+
+def _open_call_log():
+    for handler in list(_CALL_LOG.handlers):
+        _CALL_LOG.removeHandler(handler)
+        handler.close()
+    if QUERY_LOG_PATH:
+        handler = logging.FileHandler(QUERY_LOG_PATH, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _CALL_LOG.addHandler(handler)
+        _CALL_LOG.setLevel(logging.INFO)
+
+
+def _explain(conn, statement):
+    with _STATS_LOCK:
+        if statement in _PLANS:
+            _PLANS.move_to_end(statement)
+            return _PLANS[statement]
+    try:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + statement)]
+    except sqlite3.Error as e:
+        plan = [f"unavailable: {e}"]
+    with _STATS_LOCK:
+        _PLANS[statement] = plan
+        while len(_PLANS) > PLAN_CACHE_SIZE:
+            _PLANS.popitem(last=False)
+    return plan
+
+
+def _result_rows(result):
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    if isinstance(result, list):
+        return sum(_result_rows(item) for item in result)
+    return 0 if result is None else 1
+
+
+def _record(record):
+    name = record['function']
+    with _STATS_LOCK:
+        stats = _STATS.get(name)
+        if stats is None:
+            stats = _STATS[name] = {
+                'calls': 0, 'errors': 0, 'cache_hits': 0, 'rows': 0, 'vm_steps': 0,
+                'total_ms': 0.0, 'max_ms': 0.0,
+                'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                'recent': deque(maxlen=RECENT_CALLS_PER_FUNCTION),
+            }
+        stats['calls'] += 1
+        stats['errors'] += record['error'] is not None
+        stats['cache_hits'] += record['cache_hit']
+        stats['rows'] += record['rows']
+        stats['vm_steps'] += record['vm_steps'] or 0
+        stats['total_ms'] += record['elapsed_ms']
+        stats['max_ms'] = max(stats['max_ms'], record['elapsed_ms'])
+        stats['histogram'][bisect.bisect_left(LATENCY_BUCKETS_MS, record['elapsed_ms'])] += 1
+        stats['recent'].append(record['elapsed_ms'])
+        if record['slow']:
+            _SLOW_QUERIES.append(record)
+    if record['slow']:
+        _SLOW_LOG.warning("slow query %s: %.1f ms, %d rows, %s VM steps\n%s", name, record['elapsed_ms'],
+                          record['rows'], record['vm_steps'],
+                          "\n".join(f"{s['sql']}\n  " + "\n  ".join(s['plan']) for s in record['statements']))
+    if _CALL_LOG.handlers:
+        _CALL_LOG.info(json.dumps(record, default=str))
+
+
+def instrumented(func):
+    @functools.wraps(func)
+    def wrapper(conn, *args, **kwargs):
+        # Nested metric calls are part of the outer call's measurement
+        if not INSTRUMENTATION_ENABLED or getattr(_CALL_STATE, 'active', False):
+            return func(conn, *args, **kwargs)
+
+        sqlite = _is_sqlite(conn)
+        statements, steps = [], [0]
+        _CALL_STATE.active, _CALL_STATE.cache_hit = True, False
+        if sqlite:
+            def count_steps():
+                steps[0] += 1
+                return 0
+            conn.set_progress_handler(count_steps, VM_STEP_GRANULARITY)
+            conn.set_trace_callback(statements.append)
+        result, error = None, None
+        start = time.perf_counter()
+        try:
+            result = func(conn, *args, **kwargs)
+            return result
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if sqlite:
+                conn.set_progress_handler(None, 0)
+                conn.set_trace_callback(None)
+            cache_hit = _CALL_STATE.cache_hit
+            _CALL_STATE.active = False
+            statements = [s for s in dict.fromkeys(statements) if s.lstrip()[:6].upper() in ('SELECT', 'WITH')]
+            _record({
+                'timestamp': time.time(),
+                'function': func.__name__,
+                'args': [repr(arg) for arg in args],
+                'kwargs': {k: repr(v) for k, v in kwargs.items()},
+                'database': _database_file(conn) if error is None else None,
+                'elapsed_ms': round(elapsed_ms, 3),
+                'rows': _result_rows(result),
+                'cache_hit': cache_hit,
+                'vm_steps': steps[0] * VM_STEP_GRANULARITY if sqlite else None,
+                'statements': [{'sql': s, 'plan': _explain(conn, s)} for s in statements] if sqlite else [],
+                'slow': elapsed_ms >= SLOW_QUERY_MS,
+                'error': error,
+            })
+    return wrapper
+
+
+# Per-function summary of everything recorded since the last reset
+def query_stats():
+    with _STATS_LOCK:
+        rows = []
+        for name, stats in _STATS.items():
+            recent = sorted(stats['recent'])
+            rows.append({
+                'function': name,
+                'calls': stats['calls'],
+                'errors': stats['errors'],
+                'cache_hits': stats['cache_hits'],
+                'mean_ms': stats['total_ms'] / stats['calls'],
+                'p50_ms': recent[len(recent) // 2],
+                'p95_ms': recent[min(len(recent) - 1, int(len(recent) * 0.95))],
+                'max_ms': stats['max_ms'],
+                'total_ms': stats['total_ms'],
+                'rows': stats['rows'],
+                'vm_steps': stats['vm_steps'],
+            })
+    columns = ['function', 'calls', 'errors', 'cache_hits', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms',
+               'total_ms', 'rows', 'vm_steps']
+    return pd.DataFrame(rows, columns=columns).sort_values('total_ms', ascending=False).reset_index(drop=True)
+
+
+# Call counts per function and latency bucket, one row per non-empty bucket
+def latency_histogram():
+    labels = [f"≤{bound} ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]} ms"]
+    with _STATS_LOCK:
+        rows = [
+            {'function': name, 'bucket': labels[i], 'bucket_index': i, 'calls': count}
+            for name, stats in _STATS.items()
+            for i, count in enumerate(stats['histogram']) if count
+        ]
+    return pd.DataFrame(rows, columns=['function', 'bucket', 'bucket_index', 'calls'])
+
+
+def slow_queries():
+    with _STATS_LOCK:
+        return list(_SLOW_QUERIES)
+
+
+def reset_query_stats():
+    with _STATS_LOCK:
+        _STATS.clear()
+        _SLOW_QUERIES.clear()
+
+
+_open_call_log()
+
+
+def _read_rollup(conn, grain):
+    for table, columns in ROLLUP_TABLES.items():
+        if set(grain) <= set(columns):
+            return read_frame(conn, f"SELECT * FROM {table};")
+    return None
+
+
+def _load_dimensions(conn):
+    if not _is_sqlite(conn):
+        return conn.dimensions()
+    return {
+        'dim_stores': read_frame(conn, "SELECT store_id, city FROM dim_stores;"),
+        'dim_products': read_frame(conn, "SELECT product_code, product_name, category FROM dim_products;"),
+        'dim_campaigns': read_frame(conn, "SELECT campaign_id, campaign_name, start_date, end_date FROM dim_campaigns;",
+                                    parse_dates=CAMPAIGN_DATE_COLUMNS),
+    }
+
+
+def get_dimensions(conn):
+    entry = _aggregate_entry(conn)
+    with entry['lock']:
+        if 'dimensions' not in entry['grains']:
+            entry['grains']['dimensions'] = _load_dimensions(conn)
+        return entry['grains']['dimensions']
+
+
+# Filtered scans kept per database version; the oldest is dropped first
+_FILTERED_SCANS_PER_ENTRY = 16
+
+
+# Units and revenue measures summed over `grain` (a list of column names),
+# optionally restricted by FACT_FILTERS keyword arguments
+def get_grain_aggregates(conn, grain, **filters):
+    grain = tuple(grain)
+    filters = normalize_filters(filters)
+    entry = _aggregate_entry(conn)
+    with entry['lock']:
+        return _compute_grain(conn, entry['grains'], grain, filters)
+
+
+# The cached grains for normalized `filters`
+def _filter_grains(cache, filters):
+    if not filters:
+        return cache.setdefault('unfiltered', {})
+    scans = cache.setdefault('filtered', OrderedDict())
+    if filters not in scans:
+        if len(scans) >= _FILTERED_SCANS_PER_ENTRY:
+            scans.popitem(last=False)
+        scans[filters] = {}
+    return scans[filters]
+
+
+# True when a frame grouped by `source` can be summed up to `grain`: every
+# column is in it or is an attribute of a dimension whose key is
+def _covers(source, grain):
+    return all(column in source or (column in DIMENSION_COLUMNS and
+                                    DIMENSION_KEYS[DIMENSION_COLUMNS[column]] in source)
+               for column in grain)
+
+
+# The smallest scan already read for these grains that `grain` rolls up from,
+# as (scan grain, frame), or None
+def _covering_scan(grains, grain):
+    scans = dict(grains.get('grain_scans', {}))
+    if 'base' in grains:
+        scans[tuple(BASE_GRAIN)] = grains['base']
+    covering = [(len(df), source, df) for source, df in scans.items() if _covers(source, grain)]
+    return min(covering, key=lambda item: item[0])[1:] if covering else None
+
+
+# Scans the fact rows matching `filters` at `grain` with one compiled
+# statement, when nothing has been scanned for `filters` yet. Only that first
+# scan is narrowed to its grain: a later grain it does not cover falls back to
+# the base scan, which covers every grain after it. Rollups answer the
+# unfiltered and whole-campaign grains, and other backends scan the base
+# grain, so neither is scanned here.
+def _scan_grain(conn, cache, grain, filters):
+    grains = _filter_grains(cache, filters)
+    if 'rollups_current' not in cache:
+        cache['rollups_current'] = _rollups_current(conn)
+    if not _is_sqlite(conn) or (cache['rollups_current'] and _campaign_only(filters)):
+        return None
+    if grains.get('grain_scans') or 'base' in grains or grain in grains:
+        return None
+    query, params = compile_grain_query(grain, filters)
+    df = read_frame(conn, query, params)
+    grains['grain_scans'] = {grain: df}
+    return df
+
+
+def _compute_grain(conn, cache, grain, filters):
+    grains = _filter_grains(cache, filters)
+    if grain in grains:
+        return grains[grain]
+
+    if 'rollups_current' not in cache:
+        cache['rollups_current'] = _rollups_current(conn)
+
+    # rollups hold the unfiltered totals; filtered grains scan the matching fact slice
+    df = _read_rollup(conn, grain) if cache['rollups_current'] and not filters else None
+    if df is None:
+        if 'dimensions' not in cache:
+            cache['dimensions'] = _load_dimensions(conn)
+        _scan_grain(conn, cache, grain, filters)
+        covering = _covering_scan(grains, grain)
+        if covering is None:
+            if cache['rollups_current'] and _campaign_only(filters):
+                # whole campaigns (a campaign or date filter) come out of rollup_base
+                campaigns = select_campaigns(cache['dimensions']['dim_campaigns'], filters)
+                grains['base'] = read_frame(
+                    conn, "SELECT * FROM rollup_base WHERE campaign_id IN (SELECT value FROM json_each(?))",
+                    [json.dumps(campaigns)],
+                )
+            else:
+                grains['base'] = _scan_fact_events(conn, filters)
+            covering = tuple(BASE_GRAIN), grains['base']
+        source, df = covering
+        missing = [column for column in grain if column not in source]
+        for table in _dimension_tables(missing):
+            columns = [DIMENSION_KEYS[table]] + [column for column in missing if DIMENSION_COLUMNS[column] == table]
+            df = df.merge(cache['dimensions'][table][columns], on=DIMENSION_KEYS[table], how='inner')
+
+    result = (
+        df.groupby(list(grain), dropna=False)[BASE_MEASURES]
+        .sum()
+        .reset_index()
+    )
+    grains[grain] = _add_derived_measures(result)
+    return result
+
+
+# Batch planning
+# The grain each filter set of a batch of metric queries is scanned at: the
+# columns of all their METRIC_DEFINITIONS grains together, so every metric in
+# the batch rolls up from the one scan. Queries that are not metric functions,
+# or that rank from the sketches, are left out.
+def plan_queries(queries):
+    plan = {}
+    for query in queries:
+        func, keywords = (query.func, query.keywords) if isinstance(query, functools.partial) else (query, {})
+        definition = getattr(func, 'metric', None)
+        if definition is None or keywords.get('mode') == 'approx':
+            continue
+        filters = normalize_filters({name: value for name, value in keywords.items() if name in FACT_FILTERS})
+        plan.setdefault(filters, {}).update(dict.fromkeys(definition.grain))
+    return {filters: tuple(columns) for filters, columns in plan.items()}
+
+
+# The scans of a plan, as their own profiler entry: they run before any of
+# the batch's metric functions, so without it the batch's most expensive
+# statement would not be recorded. Returns the frames read (none when every
+# grain was cached already or comes from the rollups).
+@instrumented
+def grain_scan(conn, plan):
+    entry = _aggregate_entry(conn)
+    with entry['lock']:
+        scans = [_scan_grain(conn, entry['grains'], grain, filters) for filters, grain in plan.items()]
+    return [df for df in scans if df is not None]
+
+
+# Reads the scans plan_queries(queries) calls for, so the queries that follow
+# (on this or any other connection to the same database) roll up from them
+def prefetch_queries(conn, queries):
+    plan = plan_queries(queries)
+    if plan:
+        grain_scan(conn, plan)
+
+
+def _top(df, column, n, ascending=False):
+    return df.sort_values(column, ascending=ascending, kind='mergesort').head(n).reset_index(drop=True)
+
+
+# The rows of METRIC_DEFINITIONS[name] for filters, the first n when given
+def _evaluate(conn, name, filters, n=None):
+    definition = METRIC_DEFINITIONS[name]
+    return definition.evaluate(get_grain_aggregates(conn, definition.grain, **filters), n)
+
+
+@instrumented
+@cached_query
+@metric('top_stores_by_ir')
+def get_top_10_stores_by_ir(conn, n=10, mode='exact', **filters):
+    if _use_sketches(mode, filters):
+        df = _sketch_estimates(conn, 'store_id', ['incremental_revenue'])
+        df = df.merge(get_dimensions(conn)['dim_stores'], on='store_id', how='inner')
+        columns = ['store_id', 'city', 'incremental_revenue', 'incremental_revenue_lower', 'incremental_revenue_upper']
+        return _top(df, 'incremental_revenue', n)[columns]
+    return _evaluate(conn, 'top_stores_by_ir', filters, n)
+
+
+@instrumented
+@cached_query
+@metric('bottom_stores_by_isu')
+def get_bottom_10_stores_by_isu(conn, n=10, mode='exact', **filters):
+    _use_sketches(mode, filters, bottom=True)
+    return _evaluate(conn, 'bottom_stores_by_isu', filters, n)
+
+
+@instrumented
+@cached_query
+def get_store_count_by_city(conn, city=None):
+    stores = get_dimensions(conn)['dim_stores']
+    for _, cities in normalize_filters({'city': city}):
+        stores = stores[stores['city'].isin(cities)]
+    df = stores.groupby('city')['store_id'].count().reset_index(name='store_count')
+    return df.sort_values(['store_count', 'city'], ascending=[False, True], kind='mergesort').reset_index(drop=True)
+
+
+@instrumented
+@cached_query
+@metric('top_promo_types_by_ir')
+def get_top_2_promo_types_by_ir(conn, n=2, mode='exact', **filters):
+    if _use_sketches(mode, filters):
+        df = _sketch_estimates(conn, 'promo_type', ['incremental_revenue'])
+        return _top(df, 'incremental_revenue', n)
+    return _evaluate(conn, 'top_promo_types_by_ir', filters, n)
+
+
+@instrumented
+@cached_query
+@metric('bottom_promo_types_by_isu')
+def get_bottom_2_promo_types_by_isu(conn, n=2, mode='exact', **filters):
+    _use_sketches(mode, filters, bottom=True)
+    return _evaluate(conn, 'bottom_promo_types_by_isu', filters, n)
+
+
+# Product lift rankings. sold_lift is the incremental units, as units_lift
+# is in the best and worst performing products.
+@instrumented
+@cached_query
+@metric('top_products_by_lift')
+def get_top_10_products_by_lift(conn, n=10, **filters):
+    return _evaluate(conn, 'top_products_by_lift', filters, n)
+
+
+@instrumented
+@cached_query
+@metric('bottom_products_by_lift')
+def get_bottom_10_products_by_lift(conn, n=10, **filters):
+    return _evaluate(conn, 'bottom_products_by_lift', filters, n)
+
+
+@instrumented
+@cached_query
+@metric('category_promo_effectiveness')
+def get_category_promo_effectiveness(conn, **filters):
+    return _evaluate(conn, 'category_promo_effectiveness', filters)
+
+
+@instrumented
+@cached_query
+@metric('balanced_promotions')
+def get_balanced_promotions(conn, **filters):
+    return _evaluate(conn, 'balanced_promotions', filters)
+
+
+@instrumented
+@cached_query
+@metric('category_wise_sales_lift')
+def get_category_wise_sales_lift(conn, **filters):
+    return _evaluate(conn, 'category_wise_sales_lift', filters)
+
+
+# The same metric under its older name
+get_sales_lift_by_category = get_category_wise_sales_lift
+
+
+# Row budgets
+# Metrics whose size grows with the catalog take max_rows. Within the budget
+# the largest groups are returned as they are and every smaller group is
+# summed into one OTHER_LABEL group, so a chart's payload stays the same size
+# however many products or categories there are. Tables page through the full
+# result instead (get_table_page).
+
+OTHER_LABEL = 'Other'
+DEFAULT_PAGE_SIZE = 25
+
+
+# The `key` values to keep, largest summed `measure` first, so their rows plus
+# `reserve` rows for the Other group fit in `max_rows`. Everything is kept when
+# it all fits without an Other group.
+def _groups_within_budget(df, key, measure, max_rows, reserve):
+    if max_rows is not None and max_rows < reserve:
+        raise ValueError(f"max_rows must be at least {reserve} (one Other row per promo type), got {max_rows}")
+    if max_rows is None or len(df) <= max_rows:
+        return df[key].unique()
+    ranked = df.groupby(key).agg(rows=(measure, 'size'), total=(measure, 'sum'))
+    ranked = ranked.sort_values('total', ascending=False, kind='mergesort')
+    fits = (ranked['rows'].cumsum() <= max_rows - reserve).cummin()
+    return ranked.index[fits.to_numpy()]
+
+
+# One page of a metric's table, `query(conn, **kwargs)` sliced to rows
+# [page * page_size, (page + 1) * page_size). The full result comes from the
+# result cache; only the page is handed on. Out-of-range pages are clamped.
+def get_table_page(conn, query, page=0, page_size=DEFAULT_PAGE_SIZE, **kwargs):
+    if page_size <= 0:
+        raise ValueError(f"page_size must be positive, got {page_size}")
+    df = query(conn, **kwargs)
+    pages = max(1, -(-len(df) // page_size))
+    page = min(max(page, 0), pages - 1)
+    return {
+        'rows': df.iloc[page * page_size:(page + 1) * page_size].reset_index(drop=True),
+        'page': page,
+        'pages': pages,
+        'total_rows': len(df),
+    }
+
+
+@instrumented
+@cached_query
+@metric('product_response_analysis')
+def get_product_response_analysis(conn, max_rows=None, **filters):
+    df = _evaluate(conn, 'product_response_analysis', filters)
+    kept = _groups_within_budget(df, 'product_name', 'total_lift', max_rows, df['promo_type'].nunique())
+    rest = df[~df['product_name'].isin(kept)]
+    df = df[df['product_name'].isin(kept)].reset_index(drop=True)
+    if rest.empty:
+        return df
+    other = rest.groupby('promo_type')['total_lift'].sum().reset_index()
+    other['product_name'] = f"{OTHER_LABEL} ({rest['product_name'].nunique()} products)"
+    other['category'] = OTHER_LABEL
+    return pd.concat([df, _top(other, 'total_lift', len(other))[df.columns]], ignore_index=True)
+
+
+import pandas as pd
+
+@instrumented
+@cached_query
+@metric('overall_kpis')
+def get_overall_kpis(conn, **filters):
+    normalized = normalize_filters(filters)
+    campaign_summary = _kpi_summary(conn) if _campaign_only(normalized) else None
+    if campaign_summary is not None and normalized:
+        selected = select_campaigns(get_dimensions(conn)['dim_campaigns'], normalized)
+        campaign_summary = campaign_summary[campaign_summary['campaign_id'].isin(selected)]
+    if campaign_summary is None:
+        campaign_summary = _evaluate(conn, 'overall_kpis', filters)
+    incremental_units = campaign_summary['units_after'] - campaign_summary['units_before']
+    return {
+        'total_campaigns': len(campaign_summary),
+        'total_units_before': int(campaign_summary['units_before'].sum()),
+        'total_units_after': int(campaign_summary['units_after'].sum()),
+        'incremental_units': int(incremental_units.sum()),
+        'incremental_revenue': int(campaign_summary['incremental_revenue'].sum()),
+        # no average over no campaigns
+        'avg_lift_per_campaign': float(incremental_units.mean()) if len(campaign_summary) else None,
+    }
+
+def _promo_type_group(promo_type):
+    promo_type = str(promo_type).lower()
+    if promo_type.startswith('discount'):
+        return 'Discount'
+    if promo_type == 'bogof':
+        return 'BOGOF'
+    if promo_type == 'cashback':
+        return 'Cashback'
+    return 'Other'
+
+@instrumented
+@cached_query
+@metric('discount_vs_bogof_cashback')
+def get_discount_vs_bogof_cashback(conn, **filters):
+    df = _evaluate(conn, 'discount_vs_bogof_cashback', filters)
+    df = df.assign(promo_type_group=df['promo_type'].map(_promo_type_group))
+    df = df.groupby('promo_type_group', sort=False)['incremental_revenue'].sum().reset_index()
+    return _top(df, 'incremental_revenue', len(df))
+
+# Product lift estimates from the sketches, with revenue_lift bounds
+def _approx_product_lift(conn):
+    df = _sketch_estimates(conn, 'product_code', SKETCH_MEASURES)
+    df = df.merge(get_dimensions(conn)['dim_products'], on='product_code', how='inner')
+    df.columns = [column.replace('incremental_units', 'units_lift').replace('incremental_revenue', 'revenue_lift')
+                  for column in df.columns]
+    return df.sort_values('product_name', kind='mergesort')
+
+@instrumented
+@cached_query
+@metric('top_categories_by_lift')
+def get_top_categories_by_lift(conn, n=5, **filters):
+    return _evaluate(conn, 'top_categories_by_lift', filters, n)
+
+
+@instrumented
+@cached_query
+@metric('best_performing_products')
+def get_best_performing_products(conn, n=10, mode='exact', **filters):
+    if not _use_sketches(mode, filters):
+        return _evaluate(conn, 'best_performing_products', filters, n)
+    df = _approx_product_lift(conn)
+    df = df[(df['units_lift'] > 0) & (df['revenue_lift'] > 0)]
+    columns = ['product_name', 'units_lift', 'revenue_lift', 'revenue_lift_lower', 'revenue_lift_upper']
+    return _top(df, 'revenue_lift', n)[columns]
+
+@instrumented
+@cached_query
+@metric('worst_performing_products')
+def get_worst_performing_products(conn, n=10, mode='exact', **filters):
+    _use_sketches(mode, filters, bottom=True)
+    return _evaluate(conn, 'worst_performing_products', filters, n)
+
+@instrumented
+@cached_query
+def get_filter_options(conn):
+    dimensions = get_dimensions(conn)
+    campaigns = dimensions['dim_campaigns']
+    return {
+        'campaign': dict(zip(campaigns['campaign_id'], campaigns['campaign_name'])),
+        'city': sorted(dimensions['dim_stores']['city'].unique().tolist()),
+        'category': sorted(dimensions['dim_products']['category'].unique().tolist()),
+        'promo_type': sorted(get_grain_aggregates(conn, ['promo_type'])['promo_type'].tolist()),
+        'date_range': (campaigns['start_date'].min().date(), campaigns['end_date'].max().date()),
+    }
 
+@instrumented
+@cached_query
+@metric('category_promo_correlation')
+def get_category_promo_correlation_data(conn, max_rows=None, **filters):
+    definition = METRIC_DEFINITIONS['category_promo_correlation']
+    df = get_grain_aggregates(conn, definition.grain, **filters)
+    # heatmap cells: the busiest categories by events, the rest binned into one Other row
+    kept = _groups_within_budget(df, 'category', 'event_count', max_rows, df['promo_type'].nunique())
+    rest = df[~df['category'].isin(kept)]
+    if not rest.empty:
+        other = rest.groupby('promo_type')[BASE_MEASURES].sum().reset_index()
+        other['category'] = OTHER_LABEL
+        df = pd.concat([df[df['category'].isin(kept)], _add_derived_measures(other)], ignore_index=True)
+    return definition.evaluate(df)
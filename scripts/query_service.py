@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import math
+import asyncio
+import hashlib
+import inspect
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import tornado.web
+import tornado.netutil
+import tornado.process
+import tornado.httpserver
+
+from query_engine import (
+    DB_PATH,
+    DATE_FILTERS,
+    FACT_FILTERS,
+    ConnectionPool,
+    data_version,
+    query_cache_info,
+)
+from export_metrics import METRICS
+from snapshot_backend import SnapshotPool
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Threads running metric functions, each on its own pooled read-only connection
+SERVICE_WORKERS = min(8, os.cpu_count() or 1)
+
+JSON_TYPE = 'application/json'
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+FORMATS = {'json': JSON_TYPE, 'arrow': ARROW_TYPE}
+# Metric parameters that are not filters and take an integer
+INTEGER_PARAMETERS = ('n', 'max_rows')
+
+
+# Query service
+# Serves every metric in export_metrics.METRICS over HTTP on an asyncio
+# (Tornado) event loop. The SQLite work runs on a bounded thread pool, never on
+# the loop. Identical requests that arrive while one is being computed wait for
+# that computation instead of starting their own, and every response carries an
+# ETag derived from the data version, the metric and its parameters, so a
+# client revalidating with If-None-Match gets a 304 without any metric running.
+# To serve from several processes, publish a snapshot (snapshot_backend.py) and
+# start with --snapshot and --processes: the workers share one listening socket
+# and one memory-mapped copy of the fact data.
+
+def _parameters(query):
+    signature = inspect.signature(query)
+    named = [name for name in list(signature.parameters)[1:]
+             if signature.parameters[name].kind is not inspect.Parameter.VAR_KEYWORD]
+    filters = any(param.kind is inspect.Parameter.VAR_KEYWORD for param in signature.parameters.values())
+    return named, filters
+
+
+# Parses the query string of a request for `query` into its keyword arguments.
+# Filters may be repeated (?city=Chennai&city=Mysuru); dates and the other
+# parameters take a single value.
+def parse_arguments(query, arguments):
+    named, filters = _parameters(query)
+    kwargs = {}
+    for name, values in arguments.items():
+        values = [value.decode() if isinstance(value, bytes) else value for value in values]
+        if name == 'format':
+            continue
+        if name in named and name not in FACT_FILTERS:
+            try:
+                kwargs[name] = int(values[-1]) if name in INTEGER_PARAMETERS else values[-1]
+            except ValueError:
+                raise ValueError(f"{name} must be an integer, got {values[-1]!r}") from None
+        elif name in FACT_FILTERS and (filters or name in named):
+            kwargs[name] = values[-1] if name in DATE_FILTERS or len(values) == 1 else values
+        else:
+            accepted = [*named, *(FACT_FILTERS if filters else ())]
+            raise ValueError(f"unknown parameter {name!r}; expected one of {', '.join(accepted) or 'none'}")
+    return kwargs
+
+
+def _as_table(result):
+    # tables as they are; flat dicts (the KPIs) as one row; anything nested has no Arrow form
+    if isinstance(result, pd.DataFrame):
+        return pa.Table.from_pandas(result, preserve_index=False)
+    if isinstance(result, dict) and not any(isinstance(value, (dict, list, tuple)) for value in result.values()):
+        return pa.Table.from_pylist([result])
+    return None
+
+
+# JSON has no NaN or Infinity; metrics with nothing to average send null instead
+def _json_safe(value):
+    if isinstance(value, dict):
+        return {k: _json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def serialize(result, fmt):
+    if fmt == 'arrow':
+        table = _as_table(result)
+        if table is None:
+            raise ValueError("this metric is not a table; request it as json")
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    if isinstance(result, pd.DataFrame):
+        return result.to_json(orient='records', date_format='iso').encode()
+    return json.dumps(_json_safe(result), default=str, allow_nan=False).encode()
+
+
+def etag_key(name, kwargs, fmt):
+    return json.dumps([name, sorted((k, v if isinstance(v, (str, int)) else sorted(v)) for k, v in kwargs.items()),
+                       fmt], default=str)
+
+
+def etag(version, key):
+    return '"' + hashlib.sha1(json.dumps([version, key], default=str).encode()).hexdigest()[:20] + '"'
+
+
+class QueryService:
+    def __init__(self, db_path=DB_PATH, workers=SERVICE_WORKERS, metrics=METRICS, coalesce=True, snapshot=None):
+        self.metrics = dict(metrics)
+        self.coalesce = coalesce
+        self.pool = SnapshotPool(snapshot) if snapshot else ConnectionPool(db_path)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='query_service')
+        self.stats = {'requests': 0, 'computed': 0, 'coalesced': 0, 'not_modified': 0}
+        self._inflight = {}
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _version(self):
+        return data_version(self.pool.get())
+
+    async def version(self):
+        return await self._run(self._version)
+
+    def _compute(self, name, kwargs, fmt):
+        conn = self.pool.get()
+        version = data_version(conn)
+        return version, serialize(self.metrics[name](conn, **kwargs), fmt)
+
+    # Returns (data version, body). A request identical to one already being
+    # computed waits for that computation (unless coalescing is turned off, as
+    # benchmark_service.py does for its baseline); shield() keeps a client that
+    # hangs up from cancelling it for the others.
+    async def fetch(self, name, kwargs, fmt, version):
+        key = (version, etag_key(name, kwargs, fmt))
+        future = self._inflight.get(key) if self.coalesce else None
+        if future is None:
+            future = self._inflight[key] = self._run(self._compute, name, kwargs, fmt)
+            future.add_done_callback(lambda done: self._inflight.pop(key, None)
+                                     if self._inflight.get(key) is done else None)
+            self.stats['computed'] += 1
+        else:
+            self.stats['coalesced'] += 1
+        return await asyncio.shield(future)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.pool.close_all()
+
+
+class ServiceHandler(tornado.web.RequestHandler):
+    def initialize(self, service):
+        self.service = service
+
+    def write_error(self, status_code, **kwargs):
+        self.set_header('Content-Type', JSON_TYPE)
+        self.finish(json.dumps({'error': self._reason}))
+
+    def fail(self, status_code, message):
+        raise tornado.web.HTTPError(status_code, reason=message)
+
+
+class MetricHandler(ServiceHandler):
+    def _format(self):
+        fmt = self.get_query_argument('format', None)
+        if fmt is None:
+            return 'arrow' if ARROW_TYPE in self.request.headers.get('Accept', '') else 'json'
+        if fmt not in FORMATS:
+            self.fail(400, f"unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+        return fmt
+
+    async def get(self, name):
+        service = self.service
+        service.stats['requests'] += 1
+        if name not in service.metrics:
+            self.fail(404, f"unknown metric {name!r}")
+        fmt = self._format()
+        try:
+            kwargs = parse_arguments(service.metrics[name], self.request.query_arguments)
+        except ValueError as e:
+            self.fail(400, str(e))
+
+        key = etag_key(name, kwargs, fmt)
+        version = await service.version()
+        # a database without etl_metadata has no data version to revalidate against
+        if version is not None:
+            self.set_header('Etag', etag(version, key))
+            self.set_header('Cache-Control', 'no-cache')
+            # the data has not changed since the client's copy
+            if self.check_etag_header():
+                service.stats['not_modified'] += 1
+                self.set_status(304)
+                return
+
+        try:
+            computed_version, body = await service.fetch(name, kwargs, fmt, version)
+        except ValueError as e:
+            self.fail(400, str(e))
+        if computed_version != version:
+            # a load landed in between; label the body with the data it was read from
+            if computed_version is None:
+                self.clear_header('Etag')
+            else:
+                self.set_header('Etag', etag(computed_version, key))
+        self.set_header('Content-Type', FORMATS[fmt])
+        self.set_header('X-Data-Version', json.dumps(computed_version))
+        self.write(body)
+
+    def compute_etag(self):
+        # set in get(), before the body exists
+        return None
+
+
+class IndexHandler(ServiceHandler):
+    async def get(self):
+        metrics = {}
+        for name, query in self.service.metrics.items():
+            named, filters = _parameters(query)
+            metrics[name] = {'parameters': named, 'filters': list(FACT_FILTERS) if filters else []}
+        self.write({'data_version': await self.service.version(), 'formats': list(FORMATS), 'metrics': metrics})
+
+
+class StatsHandler(ServiceHandler):
+    def get(self):
+        self.write({'service': self.service.stats, 'in_flight': len(self.service._inflight),
+                    'query_cache': query_cache_info()})
+
+
+def make_app(service):
+    return tornado.web.Application([
+        (r'/metrics', IndexHandler, {'service': service}),
+        (r'/metrics/([a-z0-9_]+)', MetricHandler, {'service': service}),
+        (r'/stats', StatsHandler, {'service': service}),
+    ])
+
+
+async def serve(db_path=DB_PATH, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=SERVICE_WORKERS, snapshot=None,
+                sockets=None):
+    service = QueryService(db_path, workers, snapshot=snapshot)
+    server = tornado.httpserver.HTTPServer(make_app(service))
+    server.add_sockets(sockets or tornado.netutil.bind_sockets(port, host))
+    if tornado.process.task_id() in (None, 0):
+        source = os.path.basename(os.path.abspath(snapshot or db_path))
+        print(f"🚀 Serving {len(service.metrics)} metrics from {source} on http://{host}:{port}/metrics")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the dashboard metrics as JSON or Arrow over a local HTTP API")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=SERVICE_WORKERS, help="threads running queries, per process")
+    parser.add_argument('--snapshot', default=None, metavar='DIR',
+                        help="serve from the snapshot published in DIR instead of the database")
+    parser.add_argument('--processes', type=int, default=1, help="server processes sharing the port (0: one per CPU)")
+    args = parser.parse_args()
+
+    if not args.snapshot and not os.path.exists(args.db):
+        sys.exit(f"❌ No database at {args.db}; run load_data_to_sqlite.py first")
+    sockets = tornado.netutil.bind_sockets(args.port, args.host)
+    try:
+        if args.processes != 1:
+            # forked before any event loop exists; each worker maps the snapshot itself
+            tornado.process.fork_processes(args.processes)
+        asyncio.run(serve(args.db, args.host, args.port, args.workers, args.snapshot, sockets))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
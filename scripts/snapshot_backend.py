@@ -0,0 +1,229 @@
+import os
+import json
+import sqlite3
+import shutil
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+import query_engine
+from query_engine import data_version
+from numpy_backend import FactArrays
+
+#Set paths
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), '..', 'retail_events_snapshot')
+
+# File in the snapshot root naming the live snapshot directory
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+# Snapshot directories left on disk after a publish: the live one and the one
+# before it, which workers that have not noticed the swap yet may still read
+SNAPSHOTS_KEPT = 2
+FACT_COLUMNS = ['store', 'product', 'campaign', 'promo_type', 'base_price', 'units_before', 'units_after', 'group']
+
+
+# Memory-mapped snapshot
+# A snapshot is a FactArrays written out as one .npy file per column: the
+# dictionary-encoded grain codes, the int32 measures, the group code, the group
+# index and the campaign offsets, all fixed width. Dimension columns are saved
+# as fixed-width unicode and datetime64 arrays, so nothing is pickled. Readers
+# np.load the fact columns with mmap_mode='r': every process serving the same
+# snapshot shares their pages through the OS page cache, and the only private
+# copies are the small dimension tables. A snapshot directory is never
+# modified after it is published; the loader writes a new one and repoints
+# CURRENT at it.
+
+def _save(path, array):
+    with open(path, 'wb') as f:
+        np.save(f, array, allow_pickle=False)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _dimension_array(column):
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column.to_numpy(dtype='datetime64[ns]')
+    if column.dtype == object:
+        return column.to_numpy(dtype=str)
+    return column.to_numpy()
+
+
+def current_snapshot(root=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"No snapshot published in {os.path.abspath(root)}; "
+                                f"run snapshot_backend.py or load_data_to_sqlite.py --snapshot") from None
+
+
+def _snapshot_names(root):
+    return sorted(name for name in os.listdir(root) if name.isdigit())
+
+
+def publish_snapshot(conn, root=SNAPSHOT_DIR, keep=SNAPSHOTS_KEPT):
+    # Written under a .tmp name, fsynced and renamed into place before CURRENT
+    # is replaced, so a reader only ever sees a complete snapshot.
+    root = os.path.abspath(root)
+    os.makedirs(root, exist_ok=True)
+    names = _snapshot_names(root)
+    name = f'{int(names[-1]) + 1 if names else 1:06d}'
+    staging_dir = os.path.join(root, name + '.tmp')
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+
+    arrays = FactArrays(conn)
+    for column in FACT_COLUMNS:
+        _save(os.path.join(staging_dir, f'{column}.npy'), arrays.columns[column])
+    _save(os.path.join(staging_dir, 'campaign_offsets.npy'), arrays.campaign_offsets)
+    _save(os.path.join(staging_dir, 'group_index.npy'), arrays.group_index)
+    dimensions = {}
+    for dimension, frame in arrays.dimensions.items():
+        dimensions[dimension] = list(frame.columns)
+        for column in frame.columns:
+            _save(os.path.join(staging_dir, f'{dimension}.{column}.npy'), _dimension_array(frame[column]))
+    manifest = {
+        'data_version': data_version(conn),
+        'rows': len(arrays.columns['group']),
+        'shape': list(arrays.shape),
+        'promo_types': arrays.labels['promo_type']['promo_type'].tolist(),
+        'dimensions': dimensions,
+    }
+    with open(os.path.join(staging_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    _fsync_dir(staging_dir)
+    os.rename(staging_dir, os.path.join(root, name))
+
+    # The swap itself: one rename over CURRENT
+    pointer = os.path.join(root, CURRENT_FILE + '.tmp')
+    with open(pointer, 'w') as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(root, CURRENT_FILE))
+    _fsync_dir(root)
+
+    # Mapped files outlive their unlink, so readers still on a pruned snapshot
+    # keep working until they move to the new one
+    for old in _snapshot_names(root)[:-keep]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return name, manifest
+
+
+class MappedFactArrays(FactArrays):
+    # A FactArrays over a published snapshot directory; scan() is inherited
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.dimensions = {}
+        for dimension, columns in self.manifest['dimensions'].items():
+            frame = {}
+            for column in columns:
+                values = np.load(os.path.join(path, f'{dimension}.{column}.npy'), allow_pickle=False)
+                frame[column] = values.astype(object) if values.dtype.kind == 'U' else values
+            self.dimensions[dimension] = pd.DataFrame(frame)
+        self.labels = {
+            'store': self.dimensions['dim_stores'],
+            'product': self.dimensions['dim_products'],
+            'campaign': self.dimensions['dim_campaigns'],
+            'promo_type': pd.DataFrame({'promo_type': pd.Series(self.manifest['promo_types'], dtype=object)}),
+        }
+        self.shape = tuple(self.manifest['shape'])
+        # numpy cannot map a zero-length file region; an empty snapshot is read normally
+        mode = 'r' if self.manifest['rows'] else None
+        self.columns = {
+            column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode=mode, allow_pickle=False)
+            for column in FACT_COLUMNS
+        }
+        self.campaign_offsets = np.load(os.path.join(path, 'campaign_offsets.npy'), allow_pickle=False)
+        self.group_index = np.load(os.path.join(path, 'group_index.npy'), mmap_mode=mode, allow_pickle=False)
+
+
+# Backend
+class SnapshotBackend:
+    # A query_engine storage backend over the live snapshot in root. Every
+    # call checks CURRENT and maps the new snapshot once the loader has
+    # published one; scans already running finish on the mapping they started
+    # with. Pass an instance wherever the metric functions take a connection.
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = os.path.abspath(root)
+        self.identity = f'snapshot:{self.root}'
+        self._lock = threading.Lock()
+        self._name = None
+        self._arrays = None
+
+    # Snapshot names restart at 000001 in a recreated root, so the version also
+    # carries the one of the database the snapshot was published from, which
+    # holds its random load_id
+    def data_version(self):
+        arrays = self.arrays()
+        return (arrays.name, tuple(arrays.manifest['data_version'] or ()))
+
+    def arrays(self):
+        name = current_snapshot(self.root)
+        with self._lock:
+            if name != self._name:
+                try:
+                    self._arrays = MappedFactArrays(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    # pruned by publishes that landed since CURRENT was read
+                    name = current_snapshot(self.root)
+                    self._arrays = MappedFactArrays(os.path.join(self.root, name))
+                self._name = name
+            return self._arrays
+
+    def dimensions(self):
+        return self.arrays().dimensions
+
+    def scan(self, filters=()):
+        return self.arrays().scan(filters)
+
+    def close(self):
+        with self._lock:
+            self._name = self._arrays = None
+
+
+class SnapshotPool:
+    # Stands in for a ConnectionPool: every thread gets the same backend, so
+    # run_queries, export_metrics and query_service can serve from a snapshot
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.backend = SnapshotBackend(root)
+
+    def get(self):
+        return self.backend
+
+    def close_all(self):
+        self.backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish a memory-mapped snapshot of the SQLite star schema")
+    parser.add_argument('--db', default=query_engine.DB_PATH)
+    parser.add_argument('--out', default=SNAPSHOT_DIR, help="snapshot root; CURRENT names the live snapshot")
+    parser.add_argument('--keep', type=int, default=SNAPSHOTS_KEPT, help="snapshots left on disk, live one included")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    name, manifest = publish_snapshot(conn, args.out, max(args.keep, 1))
+    conn.close()
+    print(f"✅ Published snapshot {name} ({manifest['rows']:,} fact rows) to {os.path.abspath(args.out)}")
+
+
+if __name__ == "__main__":
+    main()
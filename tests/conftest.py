@@ -0,0 +1,9 @@
+import os
+import sys
+
+#Set paths
+SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'scripts')
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+# The scripts import each other as top-level modules
+sys.path.insert(0, os.path.abspath(SCRIPTS_DIR))
@@ -0,0 +1,115 @@
+import os
+import csv
+import shutil
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from conftest import DATA_DIR
+from load_data_to_sqlite import DIMENSION_KEYS, load_full, merge_incremental
+from query_engine import (
+    ROLLUP_TABLES,
+    SKETCH_DIMENSIONS,
+    SKETCH_MEASURES,
+    _sketch_estimates,
+    build_rollup_tables,
+    kpi_summary_current,
+    ranking_sketches_current,
+)
+
+# Rows of the sample fact_events.csv loaded before the merge
+INITIAL_ROWS = 1000
+
+
+def _write_data_dir(path, header, rows):
+    os.makedirs(path)
+    for table in DIMENSION_KEYS:
+        shutil.copy(os.path.join(DATA_DIR, f'{table}.csv'), path)
+    with open(os.path.join(path, 'fact_events.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _load(db_path, data_dir, merge_dir=None):
+    conn = sqlite3.connect(db_path)
+    load_full(conn, data_dir, workers=1)
+    build_rollup_tables(conn)
+    if merge_dir is not None:
+        # the merge must patch the summaries, not fall back to rebuilding them
+        assert kpi_summary_current(conn) and ranking_sketches_current(conn)
+        merge_incremental(conn, merge_dir, workers=1)
+        build_rollup_tables(conn)
+    return conn
+
+
+def _sorted(df):
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def _kpi_summary(conn):
+    return _sorted(pd.read_sql("""
+        SELECT c.campaign_id, k.event_count, k.units_before, k.units_after, k.incremental_revenue
+        FROM kpi_campaign_summary k
+        JOIN dim_campaigns c ON c.campaign_key = k.campaign_key
+    """, conn))
+
+
+def _sketch(conn, dimension):
+    df = _sketch_estimates(conn, dimension, SKETCH_MEASURES)
+    # an item every side nets out to zero reads the same as one never sketched
+    values = df.drop(columns=dimension)
+    return _sorted(df[(values != 0).any(axis=1)])
+
+
+@pytest.fixture
+def merged_and_rebuilt(tmp_path):
+    with open(os.path.join(DATA_DIR, 'fact_events.csv'), newline='') as f:
+        header, *rows = list(csv.reader(f))
+    initial, later = rows[:INITIAL_ROWS], rows[INITIAL_ROWS:]
+    stores = pd.read_csv(os.path.join(DATA_DIR, 'dim_stores.csv'))['store_id'].tolist()
+    products = pd.read_csv(os.path.join(DATA_DIR, 'dim_products.csv'))['product_code'].tolist()
+    campaigns = pd.read_csv(os.path.join(DATA_DIR, 'dim_campaigns.csv'))['campaign_id'].tolist()
+
+    changed = [row[:6] + [str(int(row[6]) + 7), str(int(row[7]) * 2)] for row in initial[0:100]]
+    moved = [
+        [row[0], stores[(stores.index(row[1]) + 1) % len(stores)],
+         campaigns[(campaigns.index(row[2]) + 1) % len(campaigns)],
+         products[(products.index(row[3]) + 1) % len(products)], *row[4:]]
+        for row in initial[100:200]
+    ]
+    duplicates = initial[200:300]
+    # repeated within the file: the last copy wins
+    superseded = [row[:6] + ['0', '0'] for row in later[:50]]
+    batch = changed + moved + duplicates + superseded + later
+
+    _write_data_dir(tmp_path / 'initial', header, initial)
+    _write_data_dir(tmp_path / 'batch', header, batch)
+    # a full load of both files in order holds the same rows the merge should end with
+    _write_data_dir(tmp_path / 'combined', header, initial + batch)
+
+    merged = _load(tmp_path / 'merged.sqlite', tmp_path / 'initial', tmp_path / 'batch')
+    rebuilt = _load(tmp_path / 'rebuilt.sqlite', tmp_path / 'combined')
+    yield merged, rebuilt
+    merged.close()
+    rebuilt.close()
+
+
+def test_merge_keeps_kpi_summary_equal_to_rebuild(merged_and_rebuilt):
+    merged, rebuilt = merged_and_rebuilt
+    pd.testing.assert_frame_equal(_kpi_summary(merged), _kpi_summary(rebuilt))
+
+
+def test_merge_keeps_rollups_equal_to_rebuild(merged_and_rebuilt):
+    merged, rebuilt = merged_and_rebuilt
+    for table in ROLLUP_TABLES:
+        pd.testing.assert_frame_equal(_sorted(pd.read_sql(f"SELECT * FROM {table}", merged)),
+                                      _sorted(pd.read_sql(f"SELECT * FROM {table}", rebuilt)))
+
+
+def test_merge_keeps_ranking_sketches_equal_to_rebuild(merged_and_rebuilt):
+    merged, rebuilt = merged_and_rebuilt
+    assert ranking_sketches_current(merged)
+    for dimension in SKETCH_DIMENSIONS:
+        pd.testing.assert_frame_equal(_sketch(merged, dimension), _sketch(rebuilt, dimension))
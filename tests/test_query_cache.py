@@ -0,0 +1,71 @@
+import os
+import shutil
+import sqlite3
+
+import pandas as pd
+
+from conftest import DATA_DIR
+from generate_synthetic_data import generate
+from load_data_to_sqlite import load_full
+from query_engine import data_version, get_overall_kpis, get_store_count_by_city
+from query_service import etag, etag_key
+from snapshot_backend import SnapshotBackend, publish_snapshot
+
+
+def _units_before(conn):
+    return int(pd.read_sql("SELECT SUM(quantity_sold_before_promo) FROM fact_events", conn).iloc[0, 0])
+
+
+def test_recreated_database_is_not_served_from_the_cache(tmp_path):
+    db_path = tmp_path / 'events.sqlite'
+    conn = sqlite3.connect(db_path)
+    load_full(conn, DATA_DIR, workers=1)
+    first_version = data_version(conn)
+    assert get_overall_kpis(conn)['total_units_before'] == _units_before(conn)
+    conn.close()
+
+    # a different dataset at the same path starts again at load generation 1
+    os.remove(db_path)
+    generate(tmp_path / 'other', 2000)
+    conn = sqlite3.connect(db_path)
+    load_full(conn, tmp_path / 'other', workers=1)
+    assert data_version(conn) != first_version
+    assert get_overall_kpis(conn)['total_units_before'] == _units_before(conn)
+    conn.close()
+
+
+def test_in_memory_databases_do_not_share_cache_entries(tmp_path):
+    generate(tmp_path / 'other', 2000)
+    results = []
+    for data_dir in (DATA_DIR, tmp_path / 'other'):
+        conn = sqlite3.connect(':memory:')
+        load_full(conn, data_dir, workers=1)
+        results.append((get_overall_kpis(conn)['total_units_before'], _units_before(conn)))
+        conn.close()
+    assert all(cached == actual for cached, actual in results)
+
+
+
+
+def test_positional_list_arguments_are_cached(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'events.sqlite')
+    load_full(conn, DATA_DIR, workers=1)
+    first = get_store_count_by_city(conn, ['Chennai'])
+    pd.testing.assert_frame_equal(get_store_count_by_city(conn, ['Chennai']), first)
+    assert first['city'].tolist() == ['Chennai']
+    conn.close()
+
+
+def test_recreated_snapshot_root_changes_the_etag(tmp_path):
+    generate(tmp_path / 'other', 2000)
+    key = etag_key('overall_kpis', {}, 'json')
+    tags = []
+    for data_dir in (DATA_DIR, tmp_path / 'other'):
+        # a fresh database and snapshot root each time: both start again at generation 1 and 000001
+        shutil.rmtree(tmp_path / 'snapshots', ignore_errors=True)
+        conn = sqlite3.connect(tmp_path / f'{len(tags)}.sqlite')
+        load_full(conn, data_dir, workers=1)
+        publish_snapshot(conn, tmp_path / 'snapshots')
+        conn.close()
+        tags.append(etag(SnapshotBackend(tmp_path / 'snapshots').data_version(), key))
+    assert tags[0] != tags[1]
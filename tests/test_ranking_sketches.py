@@ -0,0 +1,86 @@
+import os
+import csv
+import shutil
+import sqlite3
+
+import pytest
+
+from generate_synthetic_data import generate
+from load_data_to_sqlite import DIMENSION_KEYS, load_full, merge_incremental
+from query_engine import (
+    SKETCH_CAPACITY,
+    get_bottom_10_stores_by_isu,
+    get_bottom_2_promo_types_by_isu,
+    get_top_10_stores_by_ir,
+    get_worst_performing_products,
+    ranking_sketches_current,
+)
+
+STORES = 1000
+ROWS = 20_000
+# Rows of the generated file loaded before the merge
+INITIAL_ROWS = 15_000
+
+
+def _exact_top(conn):
+    return get_top_10_stores_by_ir(conn).set_index('store_id')['incremental_revenue']
+
+
+@pytest.fixture(scope='module')
+def databases(tmp_path_factory):
+    root = tmp_path_factory.mktemp('sketches')
+    generate(root / 'all', ROWS, stores=STORES)
+    with open(root / 'all' / 'fact_events.csv', newline='') as f:
+        header, *rows = list(csv.reader(f))
+    # changed rows go in with the later ones, so the merge replaces as well as adds
+    changed = [row[:7] + [str(int(row[7]) * 3)] for row in rows[:500]]
+    for name, fact_rows in {'initial': rows[:INITIAL_ROWS], 'batch': changed + rows[INITIAL_ROWS:]}.items():
+        os.makedirs(root / name)
+        for table in DIMENSION_KEYS:
+            shutil.copy(root / 'all' / f'{table}.csv', root / name)
+        with open(root / name / 'fact_events.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(fact_rows)
+
+    full = sqlite3.connect(root / 'full.sqlite')
+    load_full(full, root / 'all', workers=1)
+    merged = sqlite3.connect(root / 'merged.sqlite')
+    load_full(merged, root / 'initial', workers=1)
+    merge_incremental(merged, root / 'batch', workers=1)
+    yield full, merged
+    full.close()
+    merged.close()
+
+
+def test_approx_top_stores_match_exact_past_sketch_capacity(databases):
+    full, _ = databases
+    assert full.execute("SELECT COUNT(*) FROM dim_stores").fetchone()[0] > SKETCH_CAPACITY
+    approx = get_top_10_stores_by_ir(full, mode='approx')
+    exact = _exact_top(full)
+    assert approx['store_id'].tolist() == exact.index.tolist()
+    # after a full load the largest items are kept with no error
+    for column in ('incremental_revenue', 'incremental_revenue_lower', 'incremental_revenue_upper'):
+        assert approx[column].tolist() == exact.tolist()
+
+
+def test_approx_top_stores_bound_exact_after_merge(databases):
+    _, merged = databases
+    assert ranking_sketches_current(merged)
+    approx = get_top_10_stores_by_ir(merged, mode='approx')
+    exact = get_top_10_stores_by_ir(merged, n=STORES).set_index('store_id')['incremental_revenue']
+    truth = exact.loc[approx['store_id']].to_numpy()
+    assert (approx['incremental_revenue_lower'].to_numpy() <= truth).all()
+    assert (truth <= approx['incremental_revenue_upper'].to_numpy()).all()
+    assert set(approx['store_id']) == set(_exact_top(merged).index)
+
+
+@pytest.mark.parametrize('query', [
+    get_bottom_10_stores_by_isu,
+    get_bottom_2_promo_types_by_isu,
+    get_worst_performing_products,
+])
+def test_bottom_rankings_refuse_approx(databases, query):
+    full, _ = databases
+    with pytest.raises(ValueError, match='top-N'):
+        query(full, mode='approx')
@@ -0,0 +1,39 @@
+import sqlite3
+
+import pytest
+
+from conftest import DATA_DIR
+from load_data_to_sqlite import load_full
+from query_engine import (
+    get_category_promo_correlation_data,
+    get_product_response_analysis,
+    get_table_page,
+)
+
+
+@pytest.fixture(scope='module')
+def conn(tmp_path_factory):
+    conn = sqlite3.connect(tmp_path_factory.mktemp('budgets') / 'events.sqlite')
+    load_full(conn, DATA_DIR, workers=1)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('query', [get_product_response_analysis, get_category_promo_correlation_data])
+@pytest.mark.parametrize('max_rows', [-1, 0, 1])
+def test_budget_below_the_other_rows_is_rejected(conn, query, max_rows):
+    with pytest.raises(ValueError, match='max_rows'):
+        query(conn, max_rows=max_rows)
+
+
+def test_smallest_budget_is_only_other_rows(conn):
+    promo_types = conn.execute("SELECT COUNT(DISTINCT promo_type) FROM fact_events").fetchone()[0]
+    df = get_product_response_analysis(conn, max_rows=promo_types)
+    assert len(df) == promo_types
+    assert (df['category'] == 'Other').all()
+
+
+@pytest.mark.parametrize('page_size', [0, -5])
+def test_non_positive_page_size_is_rejected(conn, page_size):
+    with pytest.raises(ValueError, match='page_size'):
+        get_table_page(conn, get_product_response_analysis, page_size=page_size)